@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_async.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Ejecución no bloqueante de lectura, cálculo y gráficos para servicios
+   con ciclo de eventos.
+
+   Las funciones de Service entregan un Future inmediatamente: la lectura
+   de planillas se hace en threads, los cálculos en un pool de procesos
+   (o threads) y los gráficos en threads con Figures propias (ver
+   hidro_data.render). Cada pool acepta a lo más max_pending tareas
+   pendientes, submit espera un cupo y try_submit retorna None si no hay
+   cupo. Los callbacks de Future.add_done_callback se ejecutan en el
+   thread del pool, un ciclo de eventos debe pasar el resultado a su
+   propio thread (ej. loop.call_soon_threadsafe).
+
+   serve inicia un servidor HTTP local de prueba y bench mide el número
+   de consultas por segundo.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import tempfile
+import threading
+import time
+import urllib2
+import urlparse
+import cPickle as pickle
+import hidro_data
+
+# Resultado de una tarea
+class Future(object):
+    """ Resultado de una tarea que termina en otro thread o proceso
+
+    @note: Ejemplos
+
+    >>> f = Future()
+    >>> f.add_done_callback(lambda fut: fut.result() * 2)
+    >>> f.done()
+    False
+    >>> f.set_result(21)
+    >>> f.done(), f.result()
+    (True, 21)
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def _set(self, result, exception):
+        self._lock.acquire()
+        try:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        finally:
+            self._lock.release()
+        for fn in callbacks:
+            fn(self)
+
+    def set_result(self, result):
+        self._set(result, None)
+
+    def set_exception(self, exception):
+        self._set(None, exception)
+
+    def done(self):
+        return self._event.is_set()
+
+    def exception(self, timeout=None):
+        """ Excepción de la tarea o None, espera hasta timeout segundos """
+        if not self._event.wait(timeout):
+            raise RuntimeError, "Tiempo de espera agotado"
+        return self._exception
+
+    def result(self, timeout=None):
+        """ Resultado de la tarea, espera hasta timeout segundos
+        y levanta la excepción de la tarea si falló """
+        exception = self.exception(timeout)
+        if exception != None:
+            raise exception
+        return self._result
+
+    def add_done_callback(self, fn):
+        """ Llama fn(future) al terminar la tarea (de inmediato si ya
+        terminó) """
+        self._lock.acquire()
+        try:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._lock.release()
+        fn(self)
+
+def _call(task):
+    """ Ejecuta (fn, args, kwargs), retorna (ok, resultado o excepción) """
+    fn, args, kwargs = task
+    try:
+        return True, fn(*args, **kwargs)
+    except Exception, e:
+        return False, e
+
+def _call_pickled(payload):
+    """ Como _call con la tarea y el resultado serializados, un resultado
+    que no se puede serializar también se retorna como excepción """
+    try:
+        res = _call(pickle.loads(payload))
+    except Exception, e:
+        res = False, e
+    try:
+        return pickle.dumps(res, pickle.HIGHEST_PROTOCOL)
+    except Exception, e:
+        return pickle.dumps((False, pickle.PicklingError(
+            "Resultado no serializable: %s" % e)), pickle.HIGHEST_PROTOCOL)
+
+# Pool de tareas con límite de tareas pendientes
+class Executor(object):
+    """ Pool de threads o procesos con a lo más max_pending tareas
+    pendientes
+
+    @note: Ejemplos
+
+    >>> ex = Executor(2, max_pending=2)
+    >>> f = ex.submit(pow, 2, 10)
+    >>> f.result(10)
+    1024
+    >>> ex.submit(int, 'x').exception(10)
+    ValueError("invalid literal for int() with base 10: 'x'",)
+    >>> ev = threading.Event()
+    >>> busy = [ex.submit(ev.wait, 10) for i in range(2)]
+    >>> ex.try_submit(pow, 2, 2) == None # Sin cupo
+    True
+    >>> ev.set()
+    >>> ex.close()
+    >>> ex = Executor(1, max_pending=1, kind='process')
+    >>> type(ex.submit(lambda: 1).exception(10)).__name__ # Tarea no serializable
+    'PicklingError'
+    >>> type(ex.submit(threading.Lock).exception(10)).__name__ # Resultado
+    'PicklingError'
+    >>> ex.try_submit(pow, 2, 2).result(10) # Cupos liberados
+    4
+    >>> ex.close()
+    """
+    def __init__(self, workers=4, max_pending=None, kind='thread'):
+        """
+        @param workers: Número de threads o procesos
+        @param max_pending: Máximo de tareas pendientes (en cola o en
+            ejecución), si max_pending=None 2 * workers
+        @param kind: 'thread' o 'process'
+        """
+        if kind == 'thread':
+            self._pool = multiprocessing.pool.ThreadPool(workers)
+        elif kind == 'process':
+            self._pool = multiprocessing.Pool(workers)
+        else:
+            raise ValueError, "kind no válido"
+        self.kind = kind
+        if max_pending == None:
+            max_pending = 2 * workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _submit(self, fn, args, kwargs):
+        future = Future()
+        # Con procesos la tarea y el resultado se serializan aquí, si no un
+        # error de pickle en el pool no llama callback y el cupo no se libera
+        task = fn, args, kwargs
+        call = _call
+        if self.kind == 'process':
+            try:
+                task = pickle.dumps(task, pickle.HIGHEST_PROTOCOL)
+            except Exception, e:
+                self._slots.release()
+                future.set_exception(e)
+                return future
+            call = _call_pickled
+        def done(res):
+            self._slots.release()
+            if call == _call_pickled:
+                try:
+                    res = pickle.loads(res)
+                except Exception, e:
+                    res = False, e
+            ok, value = res
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        try:
+            self._pool.apply_async(call, (task,), callback=done)
+        except Exception:
+            self._slots.release()
+            raise
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        """ Agrega la tarea fn(*args, **kwargs), espera si hay
+        max_pending tareas pendientes
+        @return: Future
+        """
+        self._slots.acquire()
+        return self._submit(fn, args, kwargs)
+
+    def try_submit(self, fn, *args, **kwargs):
+        """ Como submit, pero retorna None si hay max_pending tareas
+        pendientes """
+        if not self._slots.acquire(False):
+            return None
+        return self._submit(fn, args, kwargs)
+
+    def close(self):
+        """ Espera las tareas pendientes y termina el pool """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Funciones de hidro_data no bloqueantes
+class Service(object):
+    """ Lectura, cálculo y gráficos de hidro_data entregando Future
+
+    @note: Ejemplos
+
+    >>> service = Service(workers=2, kind='thread')
+    >>> a = service.from_xls('data_test.xls', 0).result(10)
+    >>> service.vol_yr(a).result(10)[0]
+    [1950.0, 1951.0]
+    >>> service.fill_data(a).result(10)[1][2][3] == '' # 1952 no se rellena
+    True
+    >>> service.close()
+    """
+    def __init__(self, workers=4, io_workers=4, max_pending=None,
+                 kind='process', cache=None):
+        """
+        @param workers: Número de procesos (o threads) de cálculo y
+            threads de gráficos
+        @param io_workers: Número de threads de lectura
+        @param max_pending: Máximo de tareas pendientes de cada pool
+        @param kind: Pool de cálculo, 'process' o 'thread'
+        @param cache: Directorio del cache de figuras (ver
+            hidro_data.fig_cache_stats), si cache=None no usa cache
+        """
+        self.io = Executor(io_workers, max_pending, 'thread')
+        self.cpu = Executor(workers, max_pending, kind)
+        self.fig = Executor(workers, max_pending, 'thread')
+        self.cache = cache
+
+    def from_xls(self, archivo, nsheet=0, wait=True):
+        """ Lee una hoja excel (ver hidro_data.from_xls)
+        @param wait: Si es False retorna None si no hay cupo
+        @return: Future con la matriz de datos
+        """
+        return self._submit(self.io, wait, hidro_data.from_xls, archivo,
+                            nsheet)
+
+    def fill_data(self, data1, data2=None, wait=True):
+        """ Future de hidro_data.fill_data(data1, data2) """
+        return self._submit(self.cpu, wait, hidro_data.fill_data, data1,
+                            data2)
+
+    def vol_yr(self, data, wait=True):
+        """ Future de hidro_data.vol_yr(data) """
+        return self._submit(self.cpu, wait, hidro_data.vol_yr, data)
+
+    def plot_q(self, data, archivo, wait=True, **kwargs):
+        """ Future del archivo PNG de caudales (ver hidro_data.draw_q) """
+        return self._submit(self.fig, wait, hidro_data.render,
+                            hidro_data.draw_q, data, archivo, self.cache,
+                            **kwargs)
+
+    def plot_vol(self, data, archivo, wait=True, **kwargs):
+        """ Future del archivo PNG de volúmenes (ver hidro_data.draw_vol) """
+        return self._submit(self.fig, wait, hidro_data.render,
+                            hidro_data.draw_vol, data, archivo, self.cache,
+                            **kwargs)
+
+    def _submit(self, executor, wait, fn, *args, **kwargs):
+        if wait:
+            return executor.submit(fn, *args, **kwargs)
+        return executor.try_submit(fn, *args, **kwargs)
+
+    def close(self):
+        for executor in [self.io, self.cpu, self.fig]:
+            executor.close()
+
+# Servidor HTTP local de prueba
+def serve(service,data_dir='.',host='127.0.0.1',port=0):
+    """ Inicia un servidor HTTP en un thread con las consultas::
+        /vol_yr?file=archivo.xls&nsheet=0   JSON {"years": .., "vol": ..}
+        /plot_q?file=archivo.xls&nsheet=0   PNG
+        /plot_vol?file=archivo.xls&nsheet=0 PNG
+    Si un pool no tiene cupo responde 503.
+    @param service: Service que ejecuta las consultas
+    @param data_dir: Directorio de las planillas
+    @param port: Puerto, si port=0 uno libre
+    @return: (server, url) detener con server.shutdown()
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> service = Service(workers=2, kind='thread')
+    >>> server, url = serve(service)
+    >>> res = json.load(urllib2.urlopen(url + '/vol_yr?file=data_test.xls'))
+    >>> res['years']
+    [1950.0, 1951.0]
+    >>> urllib2.urlopen(url + '/plot_q?file=data_test.xls').read()[:4]
+    '\\x89PNG'
+    >>> stats = bench(url + '/vol_yr?file=data_test.xls', 40, 4)
+    >>> stats['ok'] + stats['busy'], stats['error']
+    (40, 0)
+    >>> server.shutdown()
+    >>> service.close()
+    """
+    out_dir = tempfile.gettempdir()
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, code, body, ctype):
+            self.send_response(code)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse.urlparse(self.path)
+            query = urlparse.parse_qs(url.query)
+            archivo = os.path.join(data_dir,
+                                   os.path.basename(query.get('file', [''])[0]))
+            nsheet = int(query.get('nsheet', ['0'])[0])
+            if url.path not in ['/vol_yr', '/plot_q', '/plot_vol']:
+                return self._reply(404, 'No encontrado', 'text/plain')
+            try:
+                future = service.from_xls(archivo, nsheet, wait=False)
+                if future == None:
+                    return self._reply(503, 'Ocupado', 'text/plain')
+                data = future.result()
+                if url.path == '/vol_yr':
+                    future = service.vol_yr(data, wait=False)
+                    if future == None:
+                        return self._reply(503, 'Ocupado', 'text/plain')
+                    vol = future.result()
+                    body = json.dumps({'years': vol[0], 'vol': vol[1]})
+                    return self._reply(200, body, 'application/json')
+                fd, png = tempfile.mkstemp('.png', dir=out_dir)
+                os.close(fd)
+                try:
+                    plot = getattr(service, url.path[1:])
+                    future = plot(data, png, wait=False)
+                    if future == None:
+                        return self._reply(503, 'Ocupado', 'text/plain')
+                    future.result()
+                    f = open(png, 'rb')
+                    try:
+                        body = f.read()
+                    finally:
+                        f.close()
+                finally:
+                    os.remove(png)
+                return self._reply(200, body, 'image/png')
+            except Exception, e:
+                return self._reply(500, '%s: %s' % (type(e).__name__, e),
+                                   'text/plain')
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = Server((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://%s:%d' % server.server_address
+
+# Mide consultas por segundo
+def bench(url,n_requests=100,concurrency=8):
+    """ Envía n_requests consultas a url desde concurrency threads
+    @return: Diccionario con ok, busy (503), error, seconds y rps
+        (consultas respondidas por segundo)
+    @rtype: dict
+    """
+    counts = {'ok': 0, 'busy': 0, 'error': 0}
+    lock = threading.Lock()
+    todo = range(n_requests)
+    def client():
+        while True:
+            lock.acquire()
+            try:
+                if todo == []:
+                    return
+                todo.pop()
+            finally:
+                lock.release()
+            try:
+                urllib2.urlopen(url).read()
+                stat = 'ok'
+            except urllib2.HTTPError, e:
+                stat = 'busy' if e.code == 503 else 'error'
+            except Exception:
+                stat = 'error'
+            lock.acquire()
+            counts[stat] += 1
+            lock.release()
+    t0 = time.time()
+    threads = [threading.Thread(target=client) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - t0
+    counts['seconds'] = seconds
+    counts['rps'] = counts['ok'] / max(seconds, 1.0e-9)
+    return counts
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
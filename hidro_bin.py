@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_bin.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Archivo binario de matrices de datos con lectura sin copia.
+
+   Formato (versión 2), todos los enteros little-endian::
+       'HYDB'                 4 bytes
+       versión                uint16
+       reservado              uint16
+       largo del encabezado   uint32
+       encabezado             JSON utf8, completado con espacios hasta
+                              un múltiplo de 8 bytes
+       bloques                por estación, valores de n_años x
+                              n_columnas en el tipo del archivo (float64
+                              por defecto, ver hidro_data.encode)
+                              seguido de la máscara de datos faltantes
+                              empaquetada con np.packbits, cada bloque
+                              comienza en un múltiplo de 8 bytes
+
+   El encabezado contiene por estación: nombre, etiquetas, rangos de
+   años [[año_inicio, n_años], ...], n_columnas, tipo, escala y
+   desplazamiento de los valores y la posición de los bloques de valores
+   y máscara. Los archivos versión 1 son float64 sin escala.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import json
+import struct
+import numpy as np
+from hidro_data import ArrayRows, encode, is_stack, to_array
+
+MAGIC = 'HYDB'
+VERSION = 2
+_PREFIX = struct.Struct('<4sHHI')
+
+def _pad(n):
+    """ Bytes de relleno para alinear n a 8 bytes """
+    return -n % 8
+
+# Rangos de años consecutivos
+def yrs_ranges(yrs_data):
+    """ Comprime una lista de años en rangos de años consecutivos
+    @param yrs_data: Lista de años
+    @return: Lista de [año_inicio, n_años]
+    @rtype: list
+
+    @note: Ejemplos
+
+    >>> yrs_ranges([1950.0, 1951.0, 1952.0, 1960.0])
+    [[1950.0, 3], [1960.0, 1]]
+    """
+    ranges = []
+    for yr in yrs_data:
+        if ranges != [] and ranges[-1][0] + ranges[-1][1] == yr:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([float(yr), 1])
+    return ranges
+
+def _yrs_from_ranges(ranges):
+    yrs_data = []
+    for yr0, n in ranges:
+        yrs_data.extend([yr0 + i for i in xrange(n)])
+    return yrs_data
+
+# Guarda matrices de datos en un archivo binario
+def to_bin(archivo,names_data,*args,**kwargs):
+    """ Guarda una o varias matrices de datos en un archivo binario
+    @param archivo: Nombre del archivo
+    @param names_data: Lista con nombre de las estaciones
+        correspondientes a las matrices de datos, [name1, ... ,nameN]
+    @param args: Matrices de datos, matriz_datos1, ... ,matriz_datosN,
+        o una colección de estaciones (ver stack_data)
+    @keyword dtype: Tipo de los valores en el archivo, '<f8', '<f4',
+        '<i2' o '<i4' con escala por estación (ver hidro_data.encode)
+    @return: Archivo binario
+    @rtype: binary file
+
+    @note: Ejemplos
+
+    >>> import os, tempfile, hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> b = hidro_data.from_xls('data_test.xls', 1) # Lee sheet anual
+    >>> tmp = tempfile.mktemp('.hdb')
+    >>> to_bin(tmp, ['lost', 'anual'], a, b)
+    >>> a_bin = from_bin(tmp, 'lost')
+    >>> a_bin[0] == a[0], a_bin[1][0] == a[1][0], a_bin[2] == a[2]
+    (True, True, True)
+    >>> hidro_data.index_lost(a_bin) == hidro_data.index_lost(a)
+    True
+    >>> from_bin(tmp, 1)[1][:]
+    [1.1, 2.1, '']
+    >>> names, datas = from_bin(tmp)
+    >>> names
+    [u'lost', u'anual']
+    >>> to_bin(tmp, ['lost'], a, dtype='<i2')
+    >>> a16 = from_bin(tmp, 'lost')
+    >>> a16[1].array.dtype.str, hidro_data.index_lost(a16)[0]
+    ('<i2', [1950.0, 0])
+    >>> np.allclose(to_array(a16)[1], to_array(a)[1], 1e-4, equal_nan=True)
+    True
+    >>> os.remove(tmp)
+    """
+    dtype = np.dtype(kwargs.get('dtype', '<f8')).str
+    is_col = len(args) == 1 and is_stack(args[0])
+    if is_col:
+        stack = args[0]
+        names_data = stack[0]
+        arrays = [(stack[1], stack[2][i], stack[3])
+                  for i in range(len(names_data))]
+    else:
+        if len(args) != len(names_data):
+            raise IndexError, "largo names_data no coincide con args"
+        arrays = [to_array(arg) for arg in args]
+    stations = []
+    blocks = []
+    offset = 0
+    for name, (yrs_data, valores, label_data) in zip(names_data, arrays):
+        lost = np.isnan(valores)
+        # Caso colección, no guarda años sin datos de la estación
+        if is_col:
+            keep = ~lost.all(axis=1)
+            yrs_data = np.asarray(yrs_data)[keep]
+            valores = valores[keep]
+            lost = lost[keep]
+        mask = np.packbits(lost.ravel())
+        valores, scale, shift = encode(valores, dtype)
+        valores = np.ascontiguousarray(valores)
+        stations.append({'name': name, 'label': list(label_data),
+                         'years': yrs_ranges(yrs_data),
+                         'n_cols': valores.shape[1], 'dtype': dtype,
+                         'scale': scale, 'shift': shift,
+                         'offset': offset,
+                         'mask_offset': offset + valores.nbytes +
+                                        _pad(valores.nbytes)})
+        blocks.append((valores, mask))
+        offset += valores.nbytes + _pad(valores.nbytes)
+        offset += mask.nbytes + _pad(mask.nbytes)
+    header = json.dumps({'stations': stations})
+    header += ' ' * _pad(_PREFIX.size + len(header))
+    f = open(archivo, 'wb')
+    try:
+        f.write(_PREFIX.pack(MAGIC, VERSION, 0, len(header)))
+        f.write(header)
+        for valores, mask in blocks:
+            f.write(valores.tobytes())
+            f.write('\0' * _pad(valores.nbytes))
+            f.write(mask.tobytes())
+            f.write('\0' * _pad(mask.nbytes))
+    finally:
+        f.close()
+
+# Encabezado del archivo binario
+def bin_info(archivo):
+    """ Lee el encabezado de un archivo binario
+    @param archivo: Nombre del archivo
+    @return: (encabezado, posición de inicio de los bloques)
+    @rtype: tuple
+    """
+    f = open(archivo, 'rb')
+    try:
+        magic, version, reserved, n = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError, "%s no es un archivo binario de datos" % archivo
+        if version > VERSION:
+            raise ValueError, "Versión de archivo no soportada: %d" % version
+        header = json.loads(f.read(n))
+    finally:
+        f.close()
+    return header, _PREFIX.size + n
+
+def _station_data(buf,start,station):
+    """ Matriz de datos de una estación a partir del buffer del archivo """
+    yrs_data = _yrs_from_ranges(station['years'])
+    n_yrs = len(yrs_data)
+    n_cols = station['n_cols']
+    ini = start + station['offset']
+    valores = np.frombuffer(buf, dtype=station['dtype'], count=n_yrs * n_cols,
+                            offset=ini).reshape(n_yrs, n_cols)
+    ini = start + station['mask_offset']
+    mask = np.frombuffer(buf, dtype='uint8', count=-(-n_yrs * n_cols // 8),
+                         offset=ini)
+    def lost():
+        bits = np.unpackbits(mask)[:n_yrs * n_cols]
+        return bits.reshape(n_yrs, n_cols).astype(bool)
+    return yrs_data, ArrayRows(valores, lost, station.get('scale', 1.0),
+                               station.get('shift', 0.0)), station['label']
+
+# Lee matrices de datos de un archivo binario
+def from_bin(archivo,station=None,mmap=True):
+    """ Lee matrices de datos de un archivo binario sin copiar los valores
+    @param archivo: Nombre del archivo (ver to_bin)
+    @param station: Nombre o índice de la estación,
+        si station=None lee todas las estaciones
+    @param mmap: Si es True los valores se leen con np.memmap bajo demanda,
+        si es False se lee el archivo completo a memoria
+    @return: Matriz de datos, o (names_data, lista de matrices de datos)
+        si station=None. Los valores son ArrayRows sobre el archivo.
+    @rtype: Matriz de datos o tuple
+    """
+    header, start = bin_info(archivo)
+    stations = header['stations']
+    if mmap:
+        buf = np.memmap(archivo, dtype='uint8', mode='r')
+    else:
+        f = open(archivo, 'rb')
+        try:
+            buf = f.read()
+        finally:
+            f.close()
+    if station == None:
+        return ([st['name'] for st in stations],
+                [_station_data(buf, start, st) for st in stations])
+    if type(station) == int:
+        if not 0 <= station < len(stations):
+            raise ValueError, "station fuera de rango"
+        return _station_data(buf, start, stations[station])
+    for st in stations:
+        if st['name'] == station:
+            return _station_data(buf, start, st)
+    raise ValueError, "Estación no encontrada: %s" % station
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_boot.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Incertidumbre por bootstrap del relleno con regresión lineal.
+
+   Se remuestrean con reemplazo los años concurrentes de las 2
+   estaciones, la regresión de cada réplica se calcula con las sumas
+   por año (ver hidro_reg.yr_sums) y el relleno de fill_data se repite
+   para todas las réplicas y datos faltantes a la vez. Las partes del
+   relleno que no dependen de la regresión (interpolación y datos
+   vecinos) se calculan una sola vez.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import multiprocessing
+import numpy as np
+from hidro_data import find_neighbors, index_lost, to_array, vol_array
+from hidro_reg import reg_params, yr_sums
+
+CHUNK = 250     # Réplicas por tarea de los procesos
+
+def _cells(data1,data2,lind_lost):
+    """ Datos de fill_data que no dependen de la regresión, retorna
+    (cells, yl, ant, pos, donor, corr) de los datos que se rellenan """
+    yrs2, valores2, label2 = to_array(data2)
+    rows2 = dict((yr, rx) for rx, yr in enumerate(yrs2.tolist()))
+    def donor(yr, cx):
+        rx = rows2.get(yr)
+        if rx == None:
+            return np.nan
+        return valores2[rx, cx]
+    cells = []
+    info = []
+    for iyr, cx in lind_lost:
+        try:
+            ant, pos, length, place = find_neighbors(data1, iyr, cx, val=True)
+        # En casos extremos fill_data no rellena datos
+        except IndexError:
+            continue
+        yl = (pos - ant) / (length) * place + ant
+        antyr, antcx, posyr, poscx, yr = find_neighbors(data1, iyr, cx,
+                                                        val=False)
+        d = [donor(antyr, antcx), donor(posyr, poscx), donor(yr, cx)]
+        corr = (length > 2 and not np.isnan(d).any() and ant != 0 and
+                pos != 0)
+        cells.append([iyr, cx])
+        info.append([yl, ant, pos] + d + [corr])
+    info = np.array(info, dtype='float64').reshape(-1, 7)
+    return (cells, info[:, 0], info[:, 1], info[:, 2], info[:, 3:6],
+            info[:, 6].astype(bool))
+
+def _fill(params,yl,ant,pos,donor,corr):
+    """ Datos rellenados de n_réplicas x n_datos (ver fill_data) """
+    g = params[:, 0, np.newaxis]
+    b = params[:, 1, np.newaxis]
+    d = np.where(corr[:, np.newaxis], donor, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ylr1 = d[:, 0] * g + b
+        ylr2 = d[:, 1] * g + b
+        ylr = d[:, 2] * g + b
+        error2_ast = ((ant - ylr1) / ant + (pos - ylr2) / pos) / 2
+        yl_c = (error2_ast * yl + ylr + yl) / 2
+    # Caso corrección genera caudales negativos
+    ok = corr & (yl_c >= 0)
+    return np.where(ok, yl_c, yl)
+
+def _replicates(task):
+    """ Rellena y calcula volúmenes anuales de un bloque de réplicas """
+    params, cells, yl, ant, pos, donor, corr, yrs_data, valores, label = task
+    est = _fill(params, yl, ant, pos, donor, corr)
+    vals = np.repeat(valores[np.newaxis], len(params), axis=0)
+    if len(cells) > 0:
+        rx, cx = np.array(cells).T
+        vals[:, rx, cx] = est
+    return est, vol_array(yrs_data, vals, label)
+
+# Bandas de confianza del relleno
+def boot_fill(data1,data2,n_boot=1000,percentiles=(5, 50, 95),lind_lost=None,
+              seed=None,workers=1):
+    """ Bandas de confianza por bootstrap de los datos rellenados con
+    fill_data(data1, data2) y de los volúmenes anuales
+    @param data1: Matriz de datos mensuales a rellenar
+    @param data2: Matriz de datos de la estación donante
+    @param n_boot: Número de réplicas
+    @param percentiles: Percentiles de las bandas (0 ... 100)
+    @param lind_lost: Lista de índices de datos faltantes (ver fill_data)
+    @param seed: Semilla de números aleatorios
+    @param workers: Número de procesos, si workers=1 no usa procesos
+    @return: (cells, fill_band, yrs_vol, vol_band) con cells lista de
+        [rx, cx] de los datos rellenados, fill_band arreglo de n_datos x
+        n_percentiles, yrs_vol lista de años completos después de
+        rellenar y vol_band arreglo de n_años x n_percentiles en MMm3
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> rnd = np.random.RandomState(0)
+    >>> yrs = [1950.0 + i for i in range(10)]
+    >>> label = hidro_data.from_xls('data_test.xls', 0)[2]
+    >>> x = rnd.gamma(4.0, 5.0, (10, 12))
+    >>> y = 0.8 * x + 1.0 + rnd.normal(0.0, 1.0, (10, 12))
+    >>> x[4, 3:7] = np.nan
+    >>> a = hidro_data.from_array(yrs, x, label)
+    >>> b = hidro_data.from_array(yrs, y, label)
+    >>> cells, band, yrs_vol, vol_band = boot_fill(a, b, 1000, seed=0)
+    >>> cells, band.shape, len(yrs_vol), vol_band.shape
+    ([[4, 3], [4, 4], [4, 5], [4, 6]], (4, 3), 10, (10, 3))
+    >>> a_r = hidro_data.fill_data(a, b)
+    >>> lo, med, hi = band[0]
+    >>> bool(lo <= a_r[1][4][3] <= hi)
+    True
+    >>> bool(vol_band[0, 0] == vol_band[0, 2]) # Año sin relleno
+    True
+    >>> np.allclose(boot_fill(a, b, 600, seed=1, workers=2)[1],
+    ...             boot_fill(a, b, 600, seed=1)[1])
+    True
+    """
+    if lind_lost == None:
+        lind_lost = index_lost(data1, yrx=False)
+    # Caso 1 sólo dato
+    if lind_lost != [] and type(lind_lost[0]) != list:
+        lind_lost = [lind_lost]
+    yrs_conc, sums = yr_sums(data1, data2)
+    if len(yrs_conc) < 3:
+        raise ValueError, "Se requieren al menos 3 años concurrentes"
+    cells, yl, ant, pos, donor, corr = _cells(data1, data2, lind_lost)
+    # Réplicas de años concurrentes como número de veces de cada año
+    rnd = np.random.RandomState(seed)
+    n_yrs = len(yrs_conc)
+    pick = rnd.randint(0, n_yrs, (n_boot, n_yrs))
+    pick += (np.arange(n_boot) * n_yrs)[:, np.newaxis]
+    counts = np.bincount(pick.ravel(), minlength=n_boot * n_yrs)
+    params = reg_params(counts.reshape(n_boot, n_yrs).dot(sums))
+    yrs_data, valores, label_data = to_array(data1)
+    tasks = [(params[i:i+CHUNK], cells, yl, ant, pos, donor, corr, yrs_data,
+              valores, label_data) for i in range(0, n_boot, CHUNK)]
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            res = pool.map(_replicates, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        res = [_replicates(task) for task in tasks]
+    est = np.concatenate([r[0] for r in res])
+    vol = np.concatenate([r[1] for r in res])
+    fill_band = np.percentile(est, percentiles, axis=0).T
+    # Sólo años completos, los mismos en todas las réplicas
+    keep = ~np.isnan(vol[0])
+    vol_band = np.percentile(vol[:, keep], percentiles, axis=0).T
+    return (cells, fill_band.reshape(len(cells), len(percentiles)),
+            yrs_data[keep].tolist(), vol_band)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_corr.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Correlación cruzada con desfase entre índices climáticos y estaciones.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import numpy as np
+from hidro_data import to_series
+
+# Correlación cruzada de a con b para desfases -max_lag ... max_lag
+def _xcorr_fft(a,b,max_lag):
+    """ c[..., k] = sum_t a[t] * b[t+k] con k = -max_lag ... max_lag
+    @param a: Arreglo n_a x n_datos
+    @param b: Arreglo n_b x n_datos
+    @return: Arreglo n_a x n_b x (2 max_lag + 1)
+    """
+    n = a.shape[-1]
+    nfft = 1
+    while nfft < n + max_lag:
+        nfft *= 2
+    fa = np.fft.rfft(a, nfft)
+    fb = np.fft.rfft(b, nfft)
+    c = np.fft.irfft(np.conj(fa)[:, np.newaxis] * fb[np.newaxis], nfft)
+    # Desfases negativos quedan al final del arreglo circular
+    return np.concatenate((c[..., nfft-max_lag:], c[..., :max_lag+1]), axis=-1)
+
+# Sumas para correlación con desfase mediante FFT
+def _lag_sums_fft(x,y,mx,my,max_lag):
+    """ Retorna (n, sx, sy, sxx, syy, sxy) de n_x x n_y x n_lags """
+    n = np.round(_xcorr_fft(mx, my, max_lag))
+    sx = _xcorr_fft(x, my, max_lag)
+    sy = _xcorr_fft(mx, y, max_lag)
+    sxx = _xcorr_fft(x * x, my, max_lag)
+    syy = _xcorr_fft(mx, y * y, max_lag)
+    sxy = _xcorr_fft(x, y, max_lag)
+    return n, sx, sy, sxx, syy, sxy
+
+# Sumas para correlación con desfase mediante sumas enmascaradas
+def _lag_sums_direct(x,y,mx,my,max_lag):
+    """ Retorna (n, sx, sy, sxx, syy, sxy) de n_x x n_y x n_lags """
+    n_datos = x.shape[-1]
+    shape = (x.shape[0], y.shape[0], 2 * max_lag + 1)
+    sums = [np.zeros(shape) for i in range(6)]
+    for il, lag in enumerate(range(-max_lag, max_lag + 1)):
+        # x[t] con y[t+lag]
+        ix = slice(max(0, -lag), n_datos - max(0, lag))
+        iy = slice(max(0, lag), n_datos + min(0, lag))
+        xa = x[:, np.newaxis, ix]
+        ma = mx[:, np.newaxis, ix]
+        yb = y[np.newaxis, :, iy]
+        mb = my[np.newaxis, :, iy]
+        xm = xa * mb
+        ym = yb * ma
+        sums[0][..., il] = (ma * mb).sum(axis=-1)
+        sums[1][..., il] = xm.sum(axis=-1)
+        sums[2][..., il] = ym.sum(axis=-1)
+        sums[3][..., il] = (xm * xa).sum(axis=-1)
+        sums[4][..., il] = (ym * yb).sum(axis=-1)
+        sums[5][..., il] = (xa * yb).sum(axis=-1)
+    return tuple(sums)
+
+# Correlación cruzada con desfase
+def lag_corr(index,data,max_lag=12,min_data=3,method='auto'):
+    """ Correlación de Pearson entre índices y estaciones para desfases
+    de -max_lag a +max_lag meses. Para un desfase k se correlaciona
+    index[t] con data[t+k], k > 0 indica que el índice antecede a la
+    estación. Sólo se usan los meses con datos en ambas series.
+    @param index: Índice(s) climático(s), matriz de datos, colección de
+        estaciones, lista de valores (ej. rd_data_col(enso,lost_OK=True)[1])
+        o arreglo de n_indices x n_datos
+    @param data: Estación(es), matriz de datos, colección de estaciones
+        (ver stack_data), lista de listas de valores o arreglo de
+        n_estaciones x n_datos. Debe estar alineada en el tiempo con index
+    @param max_lag: Desfase máximo en meses
+    @type max_lag: int
+    @param min_data: Mínimo de datos concurrentes para calcular la
+        correlación de un desfase
+    @type min_data: int
+    @param method: 'fft' correlación cruzada mediante FFT, 'direct' sumas
+        enmascaradas vectorizadas por desfase, 'auto' usa 'fft' si no hay
+        datos faltantes y 'direct' en otro caso. Ambos son exactos.
+    @return: (lags, r, best_lag, best_r)
+        lags arreglo de desfases,
+        r arreglo n_estaciones x n_lags (n_indices x n_estaciones x n_lags
+        si hay más de un índice), NaN sin datos suficientes,
+        best_lag desfase con mayor |r| por estación,
+        best_r correlación del mejor desfase (NaN y best_lag 0 si ningún
+        desfase tiene datos suficientes)
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> x = hidro_data.to_series(a)[0][0]
+    >>> y = np.concatenate(([np.nan, np.nan], x[:-2])) # Retraso 2 meses
+    >>> lags, r, best_lag, best_r = lag_corr(x, [x, y], max_lag=3)
+    >>> lags.tolist()
+    [-3, -2, -1, 0, 1, 2, 3]
+    >>> r.shape
+    (2, 7)
+    >>> best_lag.tolist()
+    [0, 2]
+    >>> np.round(best_r, 6).tolist()
+    [1.0, 1.0]
+    >>> r_fft = lag_corr(x, [x, y], max_lag=3, method='fft')[1]
+    >>> bool(np.allclose(r, r_fft, equal_nan=True))
+    True
+    >>> from scipy import stats
+    >>> m = ~np.isnan(x[:-1]) & ~np.isnan(y[1:])
+    >>> r_lr = stats.linregress(x[:-1][m], y[1:][m])[2] # Desfase 1
+    >>> bool(np.allclose(r[1, 4], r_lr))
+    True
+    """
+    if type(max_lag) != int or max_lag < 0:
+        raise ValueError, "max_lag no válido"
+    if method not in ('auto', 'fft', 'direct'):
+        raise ValueError, "method no válido"
+    x, multi_index = to_series(index)
+    y, multi_data = to_series(data)
+    if x.shape[-1] != y.shape[-1]:
+        raise ValueError, "Largo de series no coincide"
+    max_lag = min(max_lag, x.shape[-1] - 1)
+    mx = (~np.isnan(x)).astype('float64')
+    my = (~np.isnan(y)).astype('float64')
+    # Se resta la media de cada serie para estabilidad numérica
+    x = np.where(mx > 0, x, 0.0)
+    y = np.where(my > 0, y, 0.0)
+    x = (x - x.sum(axis=-1)[:, np.newaxis] /
+         np.maximum(mx.sum(axis=-1), 1)[:, np.newaxis]) * mx
+    y = (y - y.sum(axis=-1)[:, np.newaxis] /
+         np.maximum(my.sum(axis=-1), 1)[:, np.newaxis]) * my
+    if method == 'auto':
+        if mx.all() and my.all():
+            method = 'fft'
+        else:
+            method = 'direct'
+    if method == 'fft':
+        n, sx, sy, sxx, syy, sxy = _lag_sums_fft(x, y, mx, my, max_lag)
+    else:
+        n, sx, sy, sxx, syy, sxy = _lag_sums_direct(x, y, mx, my, max_lag)
+    vx = n * sxx - sx * sx
+    vy = n * syy - sy * sy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (n * sxy - sx * sy) / np.sqrt(vx * vy)
+    r[(vx <= 1e-10 * n * sxx) | (vy <= 1e-10 * n * syy)] = np.nan
+    r[n < max(min_data, 2)] = np.nan
+    r = np.clip(r, -1.0, 1.0)
+    lags = np.arange(-max_lag, max_lag + 1)
+    # Mejor desfase por estación (máximo |r|)
+    abs_r = np.where(np.isnan(r), -1.0, np.abs(r))
+    ibest = abs_r.argmax(axis=-1)
+    r_flat = r.reshape(-1, len(lags))
+    best_r = r_flat[np.arange(len(r_flat)), ibest.ravel()].reshape(ibest.shape)
+    # Sin correlación válida el mejor desfase es 0 con best_r NaN
+    best_lag = np.where(np.isnan(best_r), 0, lags[ibest])
+    if not multi_index:
+        r, best_lag, best_r = r[0], best_lag[0], best_r[0]
+    return lags, r, best_lag, best_r
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
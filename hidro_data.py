@@ -29,6 +29,17 @@
 """
 
 import datetime
+import filecmp
+import glob
+import hashlib
+import multiprocessing
+import multiprocessing.pool
+import os
+import shutil
+import tempfile
+import threading
+import cPickle as pickle
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy import stats
@@ -99,6 +110,122 @@ def from_xls(archivo,nsheet=0):
         valores.append(sheet.row_values(rx,1,sheet.ncols)) # Elimina
     return yrs_data,valores,label_data                    # col años
 
+# Lee una hoja usando el cache de archivos leídos
+def _read_xls(args):
+    """ Lee (archivo, nsheet, cache) para from_dir.
+    @return: (matriz de datos, None) o (None, mensaje de error)
+    """
+    archivo, nsheet, cache = args
+    try:
+        if cache == None:
+            return from_xls(archivo, nsheet), None
+        stat = os.stat(archivo)
+        key = '%s:%d' % (os.path.abspath(archivo), nsheet)
+        cache_file = os.path.join(cache,
+                                  hashlib.md5(key.encode('utf8')).hexdigest())
+        # Archivo sin cambios desde que se guardó en cache
+        if os.path.exists(cache_file):
+            f = open(cache_file, 'rb')
+            try:
+                mtime, size, data = pickle.load(f)
+            finally:
+                f.close()
+            if mtime == stat.st_mtime and size == stat.st_size:
+                return data, None
+        data = from_xls(archivo, nsheet)
+        f = open(cache_file + '.tmp', 'wb')
+        try:
+            pickle.dump((stat.st_mtime, stat.st_size, data), f, 2)
+        finally:
+            f.close()
+        os.rename(cache_file + '.tmp', cache_file)
+        return data, None
+    except Exception, e:
+        return None, '%s: %s' % (type(e).__name__, e)
+
+# Lee todas las planillas de un directorio
+def from_dir(path,pattern='*.xls',nsheet=0,names=None,workers=4,
+             pool='thread',cache=None):
+    """
+    Lee en paralelo las planillas excel de un directorio y genera
+    una colección de estaciones (ver stack_data).
+    @param path: Directorio o patrón glob de archivos (ej. 'datos/*.xls')
+    @param pattern: Patrón de archivos si path es un directorio
+    @param nsheet: Indice o lista de índices de las hojas a leer de
+        cada archivo (ver from_xls)
+    @type nsheet: int o list
+    @param names: Función names(archivo, nsheet) que entrega el nombre de la
+        estación. Si names=None el nombre es el del archivo sin extensión,
+        más '_nsheet' si se leen varias hojas.
+    @param workers: Número de procesos o threads que leen archivos
+    @type workers: int
+    @param pool: 'thread' lee con threads, 'process' lee con procesos
+        (más rápido para muchos archivos grandes)
+    @param cache: Directorio donde se guardan los archivos leídos, los
+        archivos no modificados desde la última lectura no se vuelven a leer.
+        Si cache=None no usa cache.
+    @return: (colección de estaciones, errores) con errores lista de
+        (archivo, nsheet, mensaje) de las hojas que no se pudieron leer
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> c, errors = from_dir('.', 'data_test.xls', nsheet=[0, 3])
+    >>> c[0]
+    ['data_test_0', 'data_test_3']
+    >>> c[2].shape
+    (2, 4, 12)
+    >>> c, errors = from_dir('data_test.xls', nsheet=[0, 9])
+    >>> c[0], errors
+    (['data_test_0'], [('data_test.xls', 9, 'ValueError: nsheet fuera de rango')])
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> c = from_dir('data_test.xls', cache=tmp)[0]
+    >>> c = from_dir('data_test.xls', cache=tmp)[0] # Lee desde cache
+    >>> c[0], len(os.listdir(tmp))
+    (['data_test'], 1)
+    >>> shutil.rmtree(tmp)
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, pattern)
+    archivos = sorted(glob.glob(path))
+    if type(nsheet) != list:
+        nsheets = [nsheet]
+    else:
+        nsheets = nsheet
+    if cache != None and not os.path.isdir(cache):
+        os.makedirs(cache)
+    tasks = [(archivo, n, cache) for archivo in archivos for n in nsheets]
+    if pool == 'thread':
+        workers_pool = multiprocessing.pool.ThreadPool(workers)
+    elif pool == 'process':
+        workers_pool = multiprocessing.Pool(workers)
+    else:
+        raise ValueError, "pool no válido"
+    try:
+        results = workers_pool.map(_read_xls, tasks)
+    finally:
+        workers_pool.close()
+        workers_pool.join()
+    names_data = []
+    datas = []
+    errors = []
+    for (archivo, n, cache), (data, error) in zip(tasks, results):
+        if error != None:
+            errors.append((archivo, n, error))
+            continue
+        if names != None:
+            name = names(archivo, n)
+        else:
+            name = os.path.splitext(os.path.basename(archivo))[0]
+            if len(nsheets) > 1:
+                name = '%s_%d' % (name, n)
+        names_data.append(name)
+        datas.append(data)
+    if datas == []:
+        return None, errors
+    return stack_data(names_data, *datas), errors
+
 # Guarda la matriz de datos en un archivo excel
 def to_xls(data,file_name='file01.xls',sheet_name='Hoja0'):
     """
@@ -180,6 +307,8 @@ def rd_data_col(data,cx=None,lost_OK=False):
     [u'JAN', u'JAN', u'JAN']
     >>> rd_data_col(a,0)[0]
     [1950.0, 1951.0, 1952.0]
+
+    @see: rd_data_rec para series largas, usa códigos en vez de textos
     """
     valores = []
     yrs_data = []
@@ -267,7 +396,7 @@ def rd_col(data,cx=None):
         Si cx=None extra todas las columnas 
     @return: Matriz de datos con la columna especificada
     @rtype: Matriz de datos
-    @note: Obsoleto preferir rd_data_col
+    @note: Obsoleto preferir rd_data_col o rd_data_rec
     """
     valores = []
     yrs_data = []
@@ -294,7 +423,592 @@ def rd_col(data,cx=None):
         return yrs_data,valores,label_data
     else:
         raise ValueError, "cx fuera de rango"
-        
+
+REC_DTYPE = np.dtype([('year', 'f8'), ('code', 'i1'), ('value', 'f8')])
+
+# Transforma la matriz de datos en registros (año, código, valor)
+def rd_data_rec(data,cx=None,lost_OK=False):
+    """ Genera un arreglo de registros (year, code, value) con los datos
+    de la columna cx, o de todas las columnas si cx=None, leídos año por
+    año. Equivale a rd_data_col pero la etiqueta de cada dato es un código
+    int8 de la tabla de etiquetas compartida (code = cx), en vez de una
+    lista de textos repetidos.
+    @param data: Matriz de datos
+    @param cx: Indice de la columna a leer
+        Si cx=None extrae todas las columnas
+    @type cx: int
+    @param lost_OK: Si es True incluye los datos faltantes como NaN
+    @return: (rec, label_data) con rec arreglo con dtype REC_DTYPE y
+        label_data lista de etiquetas de la matriz de datos, la etiqueta
+        del código c es label_data[c+1] (ver rec_labels)
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls') # Lee sheet 0 (mensual)
+    >>> rec, label = rd_data_rec(a, 11) # Datos Diciembre
+    >>> rec['value'].tolist(), rec['code'].tolist()
+    ([12.1, 13.1], [11, 11])
+    >>> rec, label = rd_data_rec(a)
+    >>> len(rec), rec.dtype.itemsize
+    (27, 17)
+    >>> rec[:2].tolist()
+    [(1950.0, 0, 1.1), (1950.0, 1, 2.1)]
+    >>> rec_labels(rec[:2], label)
+    [u'JAN', u'FEB']
+    >>> len(rd_data_rec(a, lost_OK=True)[0])
+    36
+    """
+    yrs_data, valores, label_data = to_array(data)
+    n_yrs, n_cols = valores.shape
+    if cx != None:
+        if type(cx) != int:
+            raise ValueError, "cx no válido"
+        if not 0 <= cx < n_cols:
+            raise ValueError, "cx fuera de rango"
+        valores = valores[:, cx:cx+1]
+        codes = np.array([cx], dtype='int8')
+    else:
+        codes = np.arange(n_cols, dtype='int8')
+    rec = np.empty(valores.size, dtype=REC_DTYPE)
+    rec['year'] = np.repeat(yrs_data, valores.shape[1])
+    rec['code'] = np.tile(codes, n_yrs)
+    rec['value'] = valores.ravel()
+    if not lost_OK:
+        rec = rec[~np.isnan(rec['value'])]
+    return rec, label_data
+
+# Etiquetas de texto de los registros
+def rec_labels(rec,label_data):
+    """ Etiquetas de texto de los registros de rd_data_rec
+    @param rec: Arreglo de registros o arreglo de códigos
+    @param label_data: Lista de etiquetas de la matriz de datos
+    @return: Lista de etiquetas de cada registro
+    @rtype: list
+    """
+    if rec.dtype.names != None:
+        rec = rec['code']
+    table = label_data[1:]
+    return [table[code] for code in rec.tolist()]
+
+# Filas de una matriz de datos guardada en un arreglo
+class ArrayRows(object):
+    """ Valores de una matriz de datos guardados en un arreglo numpy
+    (ej. leído con np.memmap), que se comportan como la lista de filas
+    data[1] de una matriz de datos. Cada fila se genera al leerla como
+    lista con '' en los datos faltantes, el arreglo no se copia.
+    Así cualquier función que recibe una matriz de datos acepta
+    (yrs_data, ArrayRows(valores), label_data).
+
+    @note: Ejemplos
+
+    >>> rows = ArrayRows(np.array([[1.0, np.nan], [3.0, 4.0]]))
+    >>> len(rows), rows[0], rows[1]
+    (2, [1.0, ''], [3.0, 4.0])
+    >>> data = ([1950.0, 1951.0], rows, [u'YEAR', u'JAN', u'FEB'])
+    >>> index_lost(data)
+    [[1950.0, 1]]
+    >>> to_array(data)[1] is rows.array # float64 no se copia
+    True
+    >>> ArrayRows(np.array([[2.5], [np.nan]]))[:] # Datos anuales
+    [2.5, '']
+    >>> raw, scale, offset = encode(np.array([[1.0, np.nan]]), 'int16')
+    >>> ArrayRows(raw, scale=scale, offset=offset)[0]
+    [1.0, '']
+    """
+    def __init__(self, valores, lost=None, scale=1.0, offset=0.0):
+        """
+        @param valores: Arreglo de n_años x n_columnas, float64 o
+            guardado con encode (float32, int16 o int32)
+        @param lost: Arreglo bool de datos faltantes, o función que lo
+            genera la primera vez que se necesita. Si lost=None
+            los datos faltantes son los NaN de valores
+        @param scale: Escala de valores enteros (ver encode)
+        @param offset: Desplazamiento de valores enteros (ver encode)
+        """
+        self.array = valores
+        self._lost = lost
+        self.scale = scale
+        self.offset = offset
+
+    def lost(self):
+        """ Arreglo bool de datos faltantes """
+        if self._lost is None:
+            self._lost = _lost_raw(self.array)
+        elif callable(self._lost):
+            self._lost = self._lost()
+        return self._lost
+
+    def values(self):
+        """ Valores float64 con NaN en datos faltantes, sin copiar si el
+        arreglo es float64 """
+        return decode(self.array, self.scale, self.offset)
+
+    def _row(self, rx):
+        row = decode(self.array[rx], self.scale, self.offset).tolist()
+        for cx in np.flatnonzero(self.lost()[rx]):
+            row[cx] = ''
+        # Caso datos anuales, filas de un solo dato
+        if self.array.shape[1] == 1:
+            return row[0]
+        return row
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, rx):
+        if isinstance(rx, slice):
+            return [self._row(i) for i in xrange(*rx.indices(len(self)))]
+        if rx < 0:
+            rx += len(self)
+        if not 0 <= rx < len(self):
+            raise IndexError, "fila fuera de rango"
+        return self._row(rx)
+
+    def __iter__(self):
+        for rx in xrange(len(self)):
+            yield self._row(rx)
+
+# Tipos de datos de almacenamiento
+DTYPES = ['<f8', '<f4', '<i2', '<i4']
+
+def _lost_raw(raw):
+    """ Datos faltantes de un arreglo guardado con encode """
+    if raw.dtype.kind == 'i':
+        return raw == np.iinfo(raw.dtype).min
+    return np.isnan(raw)
+
+# Valores en precisión reducida
+def encode(valores,dtype='<f4'):
+    """ Guarda valores float64 en un tipo de menor tamaño.
+    Con enteros los valores se escalan al rango del tipo,
+    valor = entero * scale + offset, y el mínimo del tipo es dato
+    faltante. Error máximo: float32 relativo 6e-8; int16 y int32
+    absoluto de scale / 2, con scale = (máximo - mínimo) / (2**16 - 4)
+    y (2**32 - 4) respectivamente.
+    @param valores: Arreglo con NaN en datos faltantes
+    @param dtype: Tipo de DTYPES
+    @return: (arreglo, scale, offset)
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> x = np.array([1.1, 2.2, np.nan, 1000.0])
+    >>> raw, scale, offset = encode(x, '<i2')
+    >>> raw.dtype.str, raw.tolist()
+    ('<i2', [-32766, -32694, -32768, 32766])
+    >>> bool(np.nanmax(np.abs(decode(raw, scale, offset) - x)) <= scale / 2)
+    True
+    """
+    dtype = np.dtype(dtype)
+    if dtype.str not in DTYPES:
+        raise ValueError, "dtype no soportado: %s" % dtype.str
+    valores = np.asarray(valores, dtype='float64')
+    if dtype.kind == 'f':
+        return valores.astype(dtype), 1.0, 0.0
+    info = np.iinfo(dtype)
+    lost = np.isnan(valores)
+    if lost.all():
+        vmin = vmax = 0.0
+    else:
+        vmin = float(valores[~lost].min())
+        vmax = float(valores[~lost].max())
+    offset = (vmin + vmax) / 2
+    half = float(info.max - 1)
+    scale = (vmax - vmin) / (2 * half)
+    if scale == 0:
+        scale = 1.0
+    with np.errstate(invalid='ignore'):
+        raw = np.clip(np.round((valores - offset) / scale), -half, half)
+    raw[lost] = info.min
+    return raw.astype(dtype), scale, offset
+
+def decode(raw,scale=1.0,offset=0.0):
+    """ Valores float64 de un arreglo guardado con encode, sin copiar
+    si el arreglo es float64 """
+    if raw.dtype.kind == 'i':
+        valores = raw * float(scale) + offset
+        valores[_lost_raw(raw)] = np.nan
+        return valores
+    return np.asarray(raw, dtype='float64')
+
+# Matriz de datos en precisión reducida
+def compact(data,dtype='<f4'):
+    """ Matriz de datos con los valores guardados en un tipo de menor
+    tamaño (ver encode), los cálculos se hacen en float64 (ver to_array)
+    @param data: Matriz de datos
+    @param dtype: Tipo de DTYPES
+    @return: Matriz de datos con valores ArrayRows
+    @rtype: Matriz de datos
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> a16 = compact(a, '<i2')
+    >>> a16[1].array.nbytes, index_lost(a16) == index_lost(a)
+    (72, True)
+    >>> np.allclose(vol_yr(a16)[1], vol_yr(a)[1], rtol=1e-4)
+    True
+    >>> np.allclose(stad(compact(a)), stad(a))
+    True
+    """
+    yrs_data, valores, label_data = to_array(data)
+    raw, scale, offset = encode(valores, dtype)
+    return list(data[0]), ArrayRows(raw, None, scale, offset), label_data
+
+# Transforma la matriz de datos en arreglos numpy
+def to_array(data):
+    """ Transforma una matriz de datos en arreglos numpy.
+    Los datos faltantes ('') se reemplazan por NaN.
+    @param data: Matriz de datos mensuales o anuales
+    @return: (yrs_data, valores, label_data)
+        yrs_data arreglo float64 con los años,
+        valores arreglo float64 de n_años x n_columnas
+        (n_columnas=1 en datos anuales),
+        label_data lista de etiquetas
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> yrs, val, label = to_array(a)
+    >>> val.shape
+    (3, 12)
+    >>> int(np.isnan(val).sum())
+    4
+    >>> b = from_xls('data_test.xls', 1) # Lee sheet anual
+    >>> to_array(b)[1].shape
+    (3, 1)
+    """
+    yrs_data = np.asarray([np.nan if yr == '' else yr for yr in data[0]],
+                          dtype='float64')
+    # Arreglo float64 se usa sin copiar
+    if isinstance(data[1], ArrayRows):
+        return yrs_data, data[1].values(), list(data[2])
+    if isinstance(data[1], np.ndarray):
+        valores = np.asarray(data[1], dtype='float64')
+        if valores.ndim == 1:
+            valores = valores.reshape(-1, 1)
+        return yrs_data, valores, list(data[2])
+    # Caso datos anuales
+    if is_data_one_colum(data):
+        rows = [[val] for val in data[1]]
+    else:
+        rows = data[1]
+    valores = np.array([[np.nan if val == '' else val for val in row]
+                        for row in rows], dtype='float64')
+    return yrs_data, valores.reshape(len(rows), -1), list(data[2])
+
+# Transforma arreglos numpy en una matriz de datos
+def from_array(yrs_data, valores, label_data):
+    """ Transforma arreglos numpy en una matriz de datos.
+    Los NaN se reemplazan por dato faltante ('').
+    @param yrs_data: Arreglo con los años
+    @param valores: Arreglo de n_años x n_columnas
+    @param label_data: Lista de etiquetas
+    @return: Matriz de datos mensuales o anuales (n_columnas=1)
+    @rtype: Matriz de datos
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> from_array(*to_array(a)) == a
+    True
+    """
+    valores = np.asarray(valores, dtype='float64')
+    yrs = [float(yr) for yr in yrs_data]
+    rows = [['' if np.isnan(val) else float(val) for val in row]
+            for row in valores.reshape(len(yrs), -1)]
+    # Caso datos anuales
+    if valores.ndim == 1 or valores.shape[1] == 1:
+        rows = [row[0] for row in rows]
+    return yrs, rows, list(label_data)
+
+# Colección de estaciones
+def stack_data(names_data,*args):
+    """ Agrupa matrices de datos de varias estaciones en una colección.
+    Los años se unen en un solo eje ordenado, los años sin datos
+    de una estación quedan con NaN.
+    @param names_data: Lista con nombre de las estaciones
+        correspondientes a las matrices de datos, [name1, ... ,nameN]
+    @type names_data: list
+    @param args: Matrices de datos, matriz_datos1, ... ,matriz_datosN
+    @type args: tuple
+    @return: Colección de estaciones (names, yrs_data, valores, label_data)
+
+        Descripción de colección de estaciones::
+            C[0] lista de nombres de estaciones
+            C[1] arreglo de años (unión de los años de las estaciones)
+            C[2] arreglo float64 de n_estaciones x n_años x n_columnas
+            C[3] lista de etiqueta datos
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls',0) # Lee sheet mensual
+    >>> b = from_xls('data_test.xls',3) # Lee sheet mensual1
+    >>> c = stack_data(['a','b'], a, b)
+    >>> c[1].tolist()
+    [1950.0, 1951.0, 1952.0, 1953.0]
+    >>> c[2].shape
+    (2, 4, 12)
+    >>> bool(np.isnan(c[2][0, 3]).all()) # 1953 no existe en a
+    True
+    """
+    if len(args) != len(names_data):
+        raise IndexError, "largo names_data no coincide con args"
+    arrays = [to_array(arg) for arg in args]
+    ncols = arrays[0][1].shape[1]
+    for arr in arrays:
+        if arr[1].shape[1] != ncols:
+            raise ValueError, "Matrices de datos con distinto número de columnas"
+    yrs_data = arrays[0][0]
+    for arr in arrays[1:]:
+        yrs_data = np.union1d(yrs_data, arr[0])
+    valores = np.empty((len(arrays), len(yrs_data), ncols), dtype='float64')
+    valores.fill(np.nan)
+    for i, arr in enumerate(arrays):
+        valores[i, np.searchsorted(yrs_data, arr[0])] = arr[1]
+    return list(names_data), yrs_data, valores, arrays[0][2]
+
+# Detecta si data es una colección de estaciones
+def is_stack(data):
+    """ Detecta si data es una colección de estaciones (ver stack_data)
+    @param data: Matriz de datos o colección de estaciones
+    @return: True si data es una colección de estaciones
+    @rtype: bool
+    """
+    return (type(data) == tuple and len(data) == 4 and
+            isinstance(data[2], np.ndarray) and data[2].ndim == 3)
+
+# Series mensuales continuas de una matriz de datos o colección
+def to_series(data):
+    """ Transforma los datos en series continuas (datos leídos año por año).
+    @param data: Matriz de datos, colección de estaciones (ver stack_data),
+        lista de valores (ej. rd_data_col(data,lost_OK=True)[1]),
+        lista de listas de valores o arreglo de n_series x n_datos
+    @return: (series, is_multi) con series arreglo float64 de
+        n_series x n_datos con NaN en datos faltantes, is_multi es False
+        si data es una sola serie
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> x, is_multi = to_series(a)
+    >>> x.shape, is_multi
+    ((1, 36), False)
+    >>> to_series([[1.0, ''], [2.0, 3.0]])[0].shape
+    (2, 2)
+    """
+    if is_stack(data):
+        return data[2].reshape(data[2].shape[0], -1), True
+    if type(data) == tuple:
+        return to_array(data)[1].reshape(1, -1), False
+    if isinstance(data, np.ndarray) and data.ndim == 2:
+        return np.asarray(data, dtype='float64'), True
+    if len(data) > 0 and isinstance(data[0], (list, np.ndarray)):
+        series = np.array([[np.nan if val == '' else val for val in serie]
+                           for serie in data], dtype='float64')
+        return series, True
+    serie = np.asarray([np.nan if val == '' else val for val in data],
+                       dtype='float64')
+    return serie.reshape(1, -1), False
+
+# Suma de ventana móvil con sumas acumuladas
+def _win_sum(x,n):
+    """ Suma móvil de largo n sobre el último eje en O(len(x)).
+    Los primeros n-1 valores quedan en 0.
+    """
+    cum = np.zeros(x.shape[:-1] + (x.shape[-1] + 1,), dtype='float64')
+    np.cumsum(x, axis=-1, out=cum[..., 1:])
+    out = np.zeros(x.shape, dtype='float64')
+    out[..., n-1:] = cum[..., n:] - cum[..., :-n]
+    return out
+
+# Valida parámetros de ventana móvil
+def win_param(n,min_data):
+    """ Valida el largo de una ventana móvil y el mínimo de datos válidos
+    @param n: Largo de la ventana
+    @param min_data: Mínimo de datos válidos en la ventana,
+        si min_data=None n
+    @return: min_data
+    @rtype: int
+
+    @note: Ejemplos
+
+    >>> win_param(6, None), win_param(6, 2)
+    (6, 2)
+    >>> win_param(6, 7)
+    Traceback (most recent call last):
+    ...
+    ValueError: min_data fuera de rango
+    """
+    if type(n) != int or n < 1:
+        raise ValueError, "n no válido"
+    if min_data == None:
+        min_data = n
+    if not 1 <= min_data <= n:
+        raise ValueError, "min_data fuera de rango"
+    return min_data
+
+# Estadísticos de ventana móvil
+def _mov_stats(data,n,min_data):
+    """ Retorna (x, valid, cnt, s, is_multi) de la ventana móvil """
+    min_data = win_param(n, min_data)
+    x, is_multi = to_series(data)
+    valid = ~np.isnan(x)
+    cnt = _win_sum(valid, n)
+    x0 = np.where(valid, x, 0.0)
+    s = _win_sum(x0, n)
+    s[cnt < min_data] = np.nan
+    return x0, valid, cnt, s, is_multi
+
+def _out(res,is_multi):
+    if is_multi:
+        return res
+    return res[0]
+
+# Suma móvil
+def mov_sum(data,n=6,min_data=None):
+    """ Suma móvil de los datos mensuales en una sola columna.
+    Los datos se leen año por año (ver rd_data_col con lost_OK=True)
+    y la ventana termina en el dato calculado. Se calcula en O(n_datos)
+    con sumas acumuladas, independiente del largo de la ventana.
+    @param data: Matriz de datos, colección de estaciones (ver stack_data),
+        lista de valores o arreglo de n_series x n_datos
+    @param n: Largo de la ventana
+    @type n: int
+    @param min_data: Mínimo de datos válidos en la ventana para
+        calcular, si min_data=None exige la ventana completa.
+        Con datos faltantes se suman sólo los datos válidos.
+    @type min_data: int
+    @return: Arreglo de largo n_datos (n_series x n_datos si data
+        es una colección), NaN donde no hay datos suficientes
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> np.round(mov_sum(a, 3)[:4], 2).tolist()
+    [nan, nan, nan, 9.3]
+    >>> np.round(mov_sum(a, 3, min_data=2)[:4], 2).tolist()
+    [nan, nan, 5.2, 9.3]
+    """
+    x0, valid, cnt, s, is_multi = _mov_stats(data, n, min_data)
+    return _out(s, is_multi)
+
+# Media móvil
+def mov_mean(data,n=6,min_data=None):
+    """ Media móvil de los datos mensuales en una sola columna,
+    reemplaza a media_movil.
+    @param data: Matriz de datos, colección de estaciones (ver stack_data),
+        lista de valores o arreglo de n_series x n_datos
+    @param n: Largo de la ventana
+    @param min_data: Mínimo de datos válidos en la ventana (ver mov_sum)
+    @return: Arreglo de largo n_datos (n_series x n_datos si data
+        es una colección), NaN donde no hay datos suficientes
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> np.round(mov_mean(a, 3)[:4], 2).tolist()
+    [nan, nan, 2.1, 3.1]
+    >>> b = from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> mov_mean(stack_data(['a','b'], a, b), 6).shape
+    (2, 48)
+    """
+    x0, valid, cnt, s, is_multi = _mov_stats(data, n, min_data)
+    return _out(s / np.maximum(cnt, 1), is_multi)
+
+# Desviación estándar móvil
+def mov_std(data,n=6,min_data=None,ddof=1):
+    """ Desviación estándar móvil de los datos mensuales en una
+    sola columna.
+    @param data: Matriz de datos, colección de estaciones (ver stack_data),
+        lista de valores o arreglo de n_series x n_datos
+    @param n: Largo de la ventana
+    @param min_data: Mínimo de datos válidos en la ventana (ver mov_sum)
+    @param ddof: Grados de libertad descontados (1 muestral, 0 poblacional)
+    @return: Arreglo de largo n_datos (n_series x n_datos si data
+        es una colección), NaN donde no hay datos suficientes
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> np.round(mov_std(a, 3)[:4], 2).tolist()
+    [nan, nan, 1.0, 1.0]
+    """
+    x0, valid, cnt, s, is_multi = _mov_stats(data, n, min_data)
+    # Se resta la media de cada serie para estabilidad numérica
+    mu = x0.sum(axis=-1) / np.maximum(valid.sum(axis=-1), 1)
+    xc = np.where(valid, x0 - mu[:, np.newaxis], 0.0)
+    sc = _win_sum(xc, n)
+    ss = _win_sum(xc * xc, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (ss - sc * sc / cnt) / (cnt - ddof)
+    var[cnt <= ddof] = np.nan
+    var[np.isnan(s)] = np.nan
+    return _out(np.sqrt(np.maximum(var, 0.0)), is_multi)
+
+# Correlación móvil
+def mov_corr(data1,data2,n=6,min_data=None):
+    """ Correlación de Pearson móvil entre datos mensuales de data1 y data2.
+    Sólo se usan los meses con datos en ambas series. Una serie
+    (ej. índice ENSO) se compara con todas las estaciones de una colección.
+    @param data1: Matriz de datos, colección de estaciones, lista de
+        valores o arreglo de n_series x n_datos
+    @param data2: Matriz de datos, colección de estaciones, lista de
+        valores o arreglo de n_series x n_datos
+    @param n: Largo de la ventana
+    @param min_data: Mínimo de datos concurrentes en la ventana (ver mov_sum)
+    @return: Arreglo de largo n_datos (n_series x n_datos si data1 o
+        data2 es una colección), NaN donde no hay datos suficientes
+    @rtype: numpy.ndarray
+
+    @note: Las series deben tener el mismo largo, para alinear años de
+        distintas estaciones usar stack_data.
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> np.round(mov_corr(a, a, 3)[:4], 2).tolist()
+    [nan, nan, 1.0, 1.0]
+    >>> np.round(mov_corr(a, b, 3, min_data=2)[:4], 2).tolist()
+    [nan, nan, 1.0, 1.0]
+    """
+    min_data = win_param(n, min_data)
+    x, is_multi1 = to_series(data1)
+    y, is_multi2 = to_series(data2)
+    if x.shape[-1] != y.shape[-1]:
+        raise ValueError, "Largo de series no coincide"
+    if x.shape[0] != y.shape[0] and 1 not in (x.shape[0], y.shape[0]):
+        raise ValueError, "Número de series no coincide"
+    x, y = np.broadcast_arrays(x, y)
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    cnt = _win_sum(valid, n)
+    # Se resta la media de cada serie para estabilidad numérica
+    nv = np.maximum(valid.sum(axis=-1), 1)[:, np.newaxis]
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    x = np.where(valid, x - x.sum(axis=-1)[:, np.newaxis] / nv, 0.0)
+    y = np.where(valid, y - y.sum(axis=-1)[:, np.newaxis] / nv, 0.0)
+    sx = _win_sum(x, n)
+    sy = _win_sum(y, n)
+    xx = cnt * _win_sum(x * x, n)
+    yy = cnt * _win_sum(y * y, n)
+    sxx = xx - sx * sx
+    syy = yy - sy * sy
+    sxy = cnt * _win_sum(x * y, n) - sx * sy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = sxy / np.sqrt(sxx * syy)
+    # Ventanas con varianza nula (error de redondeo) no tienen correlación
+    r[(sxx <= 1e-10 * xx) | (syy <= 1e-10 * yy)] = np.nan
+    r[(cnt < min_data) | (cnt < 2)] = np.nan
+    return _out(np.clip(r, -1.0, 1.0), is_multi1 or is_multi2)
 
 # Transforma matriz de datos de año calendario a hidrológico
 def hidro_yr(data,estiaje=4):
@@ -325,6 +1039,10 @@ def hidro_yr(data,estiaje=4):
         valores.append(valores_yr)                  # prox año
     return yrs_data,valores,label_data
 
+MESES = {u'JAN':1, u'FEB':2, u'MAR':3, u'APR':4,
+         u'MAY':5, u'JUN':6, u'JUL':7, u'AUG':8,
+         u'SEP':9, u'OCT':10, u'NOV':11, u'DEC':12}
+
 # Crea un vector de datos con volúmen anual
 def vol_yr(data,years=None):
     """ Crea un vector de datos con volumen anual
@@ -332,39 +1050,185 @@ def vol_yr(data,years=None):
     @type data: Datos de caudales mensuales
     @return: Datos de volúmenes anuales
     @rtype: Matriz de datos
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> yrs, vol, label = vol_yr(a) # Años leídos como float
+    >>> yrs, [round(v, 4) for v in vol]
+    ([1950.0, 1951.0], [208.9584, 240.4944])
     """
-    valores = []
-    yrs_data = []
-    seg_day = 60 * 60 * 24.0
-    MM = 1.0e6
     label_data = [data[2][0], u'Vol[MMm3]']
-    meses = {u'JAN':1, u'FEB':2, u'MAR':3, u'APR':4,
-             u'MAY':5, u'JUN':6, u'JUL':7, u'AUG':8, 
-             u'SEP':9, u'OCT':10, u'NOV':11, u'DEC':12}
     if years == None:
         years = data[0]
     if type(years) != list: # Caso arg es un sólo año
         years = [years]
-    for year in years:            
-        rx = data[0].index(year)
-        if data[1][rx].count('') == 0:
-            year = data[0][rx]
-            yrs_data.append(year)
-            sum = 0.0
-            for cx in range(len(data[1][rx])):
-                mes = meses[data[2][cx+1]]      # data[2][0] = u'YEAR'
-                first_day = datetime.date(year, mes, 1)
-                if mes == 12:
-                    year += 1
-                    last_day = datetime.date(year, 1, 1)
-                else:
-                    last_day = datetime.date(year, mes+1, 1)
-                delta_day = last_day - first_day
-                sum = sum + data[1][rx][cx] * delta_day.days * seg_day                    
-            valores.append(sum / MM)
-    return yrs_data,valores,label_data
-    
-    
+    rows = [data[0].index(year) for year in years]
+    # Sólo años completos
+    rows = [rx for rx in rows if data[1][rx].count('') == 0]
+    yrs_data = [data[0][rx] for rx in rows]
+    if rows == []:
+        return yrs_data,[],label_data
+    valores = np.array([data[1][rx] for rx in rows], dtype='float64')
+    vol = vol_array(yrs_data, valores, data[2])
+    return yrs_data,vol.tolist(),label_data
+
+# Eje de tiempo mensual
+def month_axis(yrs_data,label_data):
+    """ Mes datetime64[M] de cada dato, considerando años hidrológicos
+    (los meses posteriores a DEC son del año siguiente).
+    @param yrs_data: Lista o arreglo de años
+    @param label_data: Lista de etiquetas (label_data[0] = u'YEAR')
+    @return: Arreglo datetime64[M] de n_años x n_meses
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> month_axis([1950.0], [u'YEAR', u'NOV', u'DEC', u'JAN']).tolist()
+    [[datetime.date(1950, 11, 1), datetime.date(1950, 12, 1), datetime.date(1951, 1, 1)]]
+    """
+    mes = np.array([MESES[label] for label in label_data[1:]])
+    # Año siguiente después de DEC (año hidrológico)
+    offset = np.concatenate(([0], np.cumsum(mes[1:] < mes[:-1])))
+    yrs = np.asarray(yrs_data, dtype='int64')[:, np.newaxis]
+    return ((yrs + offset - 1970) * 12 + mes - 1).astype('datetime64[M]')
+
+# Días de cada mes de una matriz de datos mensuales
+def days_month(yrs_data,label_data):
+    """ Días de cada mes, considerando años bisiestos y años
+    hidrológicos (los meses posteriores a DEC son del año siguiente).
+    @param yrs_data: Lista o arreglo de años
+    @param label_data: Lista de etiquetas (label_data[0] = u'YEAR')
+    @return: Arreglo de n_años x n_meses
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> days_month([1951.0, 1952.0], [u'YEAR', u'FEB', u'MAR']).tolist()
+    [[28, 31], [29, 31]]
+    >>> days_month([1951.0], [u'YEAR', u'DEC', u'FEB']).tolist()
+    [[31, 29]]
+    """
+    return days_in(month_axis(yrs_data, label_data))
+
+# Días de meses datetime64[M]
+def days_in(months):
+    """ Días de cada mes de un arreglo datetime64[M] """
+    months = np.asarray(months, dtype='datetime64[M]')
+    return ((months + 1).astype('datetime64[D]') -
+            months.astype('datetime64[D]')).astype('int64')
+
+# Serie mensual con eje de tiempo
+def to_time(data,ini=None,fin=None):
+    """ Transforma una matriz de datos mensuales en una serie continua
+    con eje de tiempo datetime64[M], con selección de rango de meses
+    como comparación de enteros.
+    @param data: Matriz de datos mensuales (año calendario o hidrológico)
+    @param ini: Primer mes, ej. '1950-04', si ini=None desde el inicio
+    @param fin: Último mes (inclusive), si fin=None hasta el final
+    @return: (months, valores) arreglos datetime64[M] y float64 (NaN en
+        datos faltantes) ordenados por mes
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> months, valores = to_time(a, '1951-11', '1952-02')
+    >>> [str(m) for m in months], valores.tolist()
+    (['1951-11', '1951-12', '1952-01', '1952-02'], [12.1, 13.1, 3.1, 4.1])
+    """
+    yrs_data, valores, label_data = to_array(data)
+    months = month_axis(yrs_data, label_data).ravel()
+    valores = valores.ravel()
+    order = np.argsort(months, kind='mergesort')
+    months = months[order]
+    valores = valores[order]
+    keep = np.ones(len(months), dtype=bool)
+    if ini != None:
+        keep &= months >= np.datetime64(ini, 'M')
+    if fin != None:
+        keep &= months <= np.datetime64(fin, 'M')
+    return months[keep], valores[keep]
+
+# Matriz de datos a partir de una serie con eje de tiempo
+def from_time(months,valores,estiaje=1,label_yr=u'YEAR'):
+    """ Transforma una serie mensual con eje de tiempo datetime64[M] en
+    una matriz de datos, cada año comienza en el mes estiaje (ver
+    hidro_yr), los meses sin dato quedan como dato faltante ('')
+    @param months: Arreglo datetime64[M]
+    @param valores: Arreglo de valores (NaN en datos faltantes)
+    @param estiaje: Mes de inicio del año (1 ... 12), 1 año calendario
+    @return: Matriz de datos mensuales
+    @rtype: Matriz de datos
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = from_time(*to_time(a), estiaje=4)
+    >>> b[0], b[2][1], b[2][-1]
+    ([1949.0, 1950.0, 1951.0], u'APR', u'MAR')
+    >>> b[1][1] == hidro_yr(a)[1][0]
+    True
+    >>> from_time(*to_time(a)) == from_array(*to_array(a))
+    True
+    """
+    n = np.asarray(months, dtype='datetime64[M]').astype('int64') - (estiaje - 1)
+    yrs = n // 12
+    cx = n % 12
+    yr0 = yrs.min()
+    mat = np.empty((yrs.max() - yr0 + 1, 12), dtype='float64')
+    mat.fill(np.nan)
+    mat[yrs - yr0, cx] = valores
+    # No agrega años sin datos
+    keep = ~np.isnan(mat).all(axis=1)
+    nombres = sorted(MESES, key=MESES.get)
+    label_data = [label_yr] + [nombres[(estiaje - 1 + i) % 12]
+                               for i in range(12)]
+    yrs_data = np.arange(yr0, yrs.max() + 1)[keep] + 1970
+    return from_array(yrs_data, mat[keep], label_data)
+
+# Meses concurrentes de 2 matrices de datos
+def time_concurrent(data1,data2):
+    """ Meses con dato en ambas matrices de datos
+    @param data1: Matriz de datos mensuales
+    @param data2: Matriz de datos mensuales
+    @return: Arreglo datetime64[M] de meses concurrentes
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> len(time_concurrent(a, b)), str(time_concurrent(a, b)[-1])
+    (26, '1952-03')
+    """
+    months1, valores1 = to_time(data1)
+    months2, valores2 = to_time(data2)
+    return np.intersect1d(months1[~np.isnan(valores1)],
+                          months2[~np.isnan(valores2)])
+
+# Volumen anual vectorizado
+def vol_array(yrs_data,valores,label_data):
+    """ Volumen anual en MMm3 de caudales mensuales en arreglos
+    (ver to_array y stack_data), equivalente a vol_yr.
+    @param yrs_data: Arreglo de años
+    @param valores: Arreglo de ... x n_años x n_meses con NaN en datos
+        faltantes, ej. valores de una colección de estaciones
+    @param label_data: Lista de etiquetas
+    @return: Arreglo de ... x n_años, NaN en años incompletos
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> np.round(vol_array(*to_array(a)), 4).tolist()
+    [208.9584, 240.4944, nan]
+    >>> np.round(vol_yr(a)[1], 4).tolist()
+    [208.9584, 240.4944]
+    """
+    days = days_month(yrs_data, label_data)
+    return (np.asarray(valores) * days).sum(axis=-1) * (60 * 60 * 24.0) / 1.0e6
+
 # Extrae los datos de un año específico
 def yr(data,year,fill=None):
     """
@@ -469,12 +1333,14 @@ def yrs_type(data_vol,vol_hi=None,vol_low=None, is_data=False):
     return dry_yrs,normal_yrs,wet_yrs
 
 # Datos faltantes objeto data
-def index_lost(data,yrx=True,hidecx=False):
+def index_lost(data,yrx=True,hidecx=False,flags=None):
     """  Entrega índices de datos faltantes
     @param data: Matriz de datos
     @param yrx: Si es True entrega el índice de la fila, 
         si es False entrega el año del dato faltante
     @param hidecx: Si es True agrega el índice de la columna
+    @param flags: Arreglo de n_años x n_columnas, los datos con flag
+        distinto de 0 se consideran faltantes (ver hidro_qa.qa_flags)
     @return: Lista de índices
     @rtype: list
     
@@ -493,7 +1359,13 @@ def index_lost(data,yrx=True,hidecx=False):
     >>> c = from_xls('data_test.xls', 0) # Lee sheet mensual    
     >>> index_lost(c, yrx=False, hidecx=False)
     [[2, 3], [2, 4], [2, 5], [2, 6], [2, 7], [2, 8], [2, 9], [2, 10], [2, 11]]
+    >>> flags = np.zeros((3, 12), dtype='uint8')
+    >>> flags[1, 5] = 1
+    >>> index_lost(a, flags=flags)
+    [[1950.0, 0], [1950.0, 8], [1951.0, 5], [1951.0, 7], [1952.0, 11]]
     """
+    if flags is not None:
+        data = mask_flags(data, flags)
     valores = []    
     for rx in range(len(data[1])):
         for cx in range(len(data[1][rx])):
@@ -509,6 +1381,23 @@ def index_lost(data,yrx=True,hidecx=False):
                     valores.append(rx)
     return valores
 
+# Marca como faltantes los datos con flag
+def mask_flags(data,flags):
+    """ Copia de la matriz de datos con los datos con flag distinto
+    de 0 reemplazados por dato faltante ('')
+    @param data: Matriz de datos
+    @param flags: Arreglo de n_años x n_columnas (ver hidro_qa.qa_flags)
+    @return: Matriz de datos
+    @rtype: Matriz de datos
+    """
+    flags = np.asarray(flags)
+    if flags.shape[0] != len(data[1]):
+        raise ValueError, "flags no coincide con la matriz de datos"
+    yrs_data,valores,label_data = copy_data(data)
+    for rx, cx in np.argwhere(flags.reshape(len(valores), -1)).tolist():
+        valores[rx][cx] = ''
+    return yrs_data,valores,label_data
+
 # Datos concurrentes
 def concurrent(data1,data2=None):
     """ Compara años completos recurrentes de 2 matrices de datos
@@ -772,11 +1661,13 @@ def find_neighbors(data,iyr,cx,val=True):
         return (data[0][antiyr],antcx,data[0][posiyr],poscx,data[0][iyr])
 
 # Rellenar datos faltantes con prom datos anterior y posterior válida
-def fill_data_s(data,lind_lost=None):
+def fill_data_s(data,lind_lost=None,flags=None):
     """Rellenar datos faltantes con prom datos anterior y posterior válida
     @param data: Matriz de datos
     @param lind_lost: Lista de índice de datos faltantes.
         Si lind_lost=None entonces rellena todos los datos faltantes
+    @param flags: Arreglo de n_años x n_columnas, los datos con flag
+        distinto de 0 se tratan como faltantes (ver index_lost)
     @return: Matriz de datos con datos rellenados
     @rtype: Matriz de datos
     
@@ -790,7 +1681,11 @@ def fill_data_s(data,lind_lost=None):
     ''
     >>> c_r[1][1][3]
     5.0999999999999996
+    >>> c_r[1][3][3:] == c[1][3][3:] # Sin dato posterior no rellena
+    True
     """
+    if flags is not None:
+        data = mask_flags(data, flags)
     yrs_data,valores,label_data = copy_data(data)
     if lind_lost == None:
         lind_lost = index_lost(data,yrx=False)
@@ -802,7 +1697,7 @@ def fill_data_s(data,lind_lost=None):
             ant, pos, length, place = find_neighbors(data, iyr, cx)
         # En casos extremos no rellena datos
         except IndexError:
-            pass
+            continue
         # Rellena si falta un solo dato
         if length == 2:
             valores[iyr][cx] = (ant + pos) / 2
@@ -810,7 +1705,7 @@ def fill_data_s(data,lind_lost=None):
 
 
 # Rellenar datos faltantes con regresión lineal
-def fill_data(data1,data2=None,lind_lost=None,lin_reg_param=None):
+def fill_data(data1,data2=None,lind_lost=None,lin_reg_param=None,flags=None):
     """Rellenar datos faltantes y corrige con regresión lineal
     @param data1: Matriz de datos
     @param data2: Matriz de datos
@@ -820,6 +1715,8 @@ def fill_data(data1,data2=None,lind_lost=None,lin_reg_param=None):
     @param lin_reg_param: Parámetros de la regresión lineal
         Si lin_reg_param=None calcula los parámetros a partir de data2.
     @type lin_reg_param: tuple (gradient, intercept, r_value, p_value, std_err)
+    @param flags: Arreglo de n_años x n_columnas, los datos de data1 con
+        flag distinto de 0 se tratan como faltantes (ver index_lost)
     @return: Matriz de datos con datos rellenados
     @rtype: Matriz de datos
     
@@ -833,11 +1730,21 @@ def fill_data(data1,data2=None,lind_lost=None,lin_reg_param=None):
     ''
     >>> c_r[1][1][3]
     5.0999999999999996
+    >>> c_r[1][3][3:] == c[1][3][3:] # Sin dato posterior no rellena
+    True
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> fill_data(a, lind_lost=[])[1] == a[1] # Sin datos faltantes
+    True
     """
+    if flags is not None:
+        data1 = mask_flags(data1, flags)
     # Crea un duplicado de data 
     yrs_data,valores,label_data = copy_data(data1)
     if lind_lost == None:
         lind_lost = index_lost(data1,yrx=False)
+    # Caso sin datos faltantes
+    if lind_lost == []:
+        return yrs_data,valores,label_data
     # Caso 1 sólo dato
     if type(lind_lost[0]) != list:
         lind_lost = [lind_lost]
@@ -852,7 +1759,7 @@ def fill_data(data1,data2=None,lind_lost=None,lin_reg_param=None):
             ant, pos, length, place = find_neighbors(data1, iyr, cx, val=True)
         # En casos extremos no rellena datos
         except IndexError:
-            pass
+            continue
         # Rellena datos con interpolación lineal de datos vecinos
         if length > 5 and data2 == None:
             warnings.warn("Interpolación tramo de más de 4 datos faltantes",RuntimeWarning)
@@ -965,8 +1872,181 @@ def data_prom(data,iyr,cx):
     m = (pos - ant) / (length)
     return m * place + ant
 
+# Lista de valores a arreglo float64 con NaN en datos faltantes
+def _as_float(valores):
+    if isinstance(valores, np.ndarray) and valores.dtype.kind in 'fiu':
+        return np.asarray(valores, dtype='float64')
+    return np.asarray([np.nan if val == '' else val for val in valores],
+                      dtype='float64')
+
+# Reduce el número de puntos de una serie para plotear
+def decimate(x,y,n_out,method='minmax'):
+    """ Reduce una serie larga a n_out puntos conservando su forma
+    en el gráfico. Los datos faltantes (NaN o '') se eliminan.
+    @param x: Lista o arreglo de abscisas ordenadas
+    @param y: Lista o arreglo de valores
+    @param n_out: Número de puntos de salida
+    @type n_out: int
+    @param method: 'minmax' conserva el mínimo y máximo de cada grupo de
+        datos (envolvente, n_out/2 grupos), 'lttb' Largest Triangle
+        Three Buckets, un punto por grupo que conserva la forma visual
+    @return: (x, y) arreglos de a lo más n_out puntos
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> x = np.arange(1000.0)
+    >>> y = np.sin(x / 50.0)
+    >>> xd, yd = decimate(x, y, 100)
+    >>> len(xd), float(yd.max()) == float(y.max())
+    (100, True)
+    >>> xd, yd = decimate(x, y, 100, 'lttb')
+    >>> len(xd), xd[0], xd[-1]
+    (100, 0.0, 999.0)
+    >>> decimate([1, 2, 3], [1, '', 3], 10)[1].tolist()
+    [1.0, 3.0]
+    """
+    x = _as_float(x)
+    y = _as_float(y)
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    x = x[valid]
+    y = y[valid]
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return x, y
+    if method == 'minmax':
+        n_bins = n_out // 2
+        size = -(-n // n_bins)      # División hacia arriba
+        pad = n_bins * size - n
+        yb = np.concatenate((y, np.repeat(y[-1], pad))).reshape(n_bins, size)
+        ini = np.arange(n_bins) * size
+        imin = np.minimum(ini + yb.argmin(axis=1), n - 1)
+        imax = np.minimum(ini + yb.argmax(axis=1), n - 1)
+        idx = np.unique(np.concatenate((imin, imax)))
+        return x[idx], y[idx]
+    elif method == 'lttb':
+        # Límites de los grupos, el primer y último punto se conservan
+        edges = (np.arange(n_out - 1) * (n - 2.0) / (n_out - 2)).astype(int) + 1
+        edges[-1] = n - 1
+        # Promedio de cada grupo, usado como tercer vértice del triángulo
+        cum_x = np.concatenate(([0.0], np.cumsum(x)))
+        cum_y = np.concatenate(([0.0], np.cumsum(y)))
+        nxt = np.append(edges[1:], n)
+        cnt = nxt - edges
+        avg_x = (cum_x[nxt] - cum_x[edges]) / cnt
+        avg_y = (cum_y[nxt] - cum_y[edges]) / cnt
+        idx = np.empty(n_out, dtype=int)
+        idx[0] = 0
+        idx[-1] = n - 1
+        a = 0
+        for i in xrange(n_out - 2):
+            xs = x[edges[i]:edges[i+1]]
+            ys = y[edges[i]:edges[i+1]]
+            area = np.abs((x[a] - avg_x[i+1]) * (ys - y[a]) -
+                          (x[a] - xs) * (avg_y[i+1] - y[a]))
+            a = edges[i] + area.argmax()
+            idx[i+1] = a
+        return x[idx], y[idx]
+    raise ValueError, "method no válido"
+
+# Cache de figuras por contenido
+FIG_CACHE_VERSION = 1
+FIG_CACHE_STATS = {'hit': 0, 'miss': 0}
+_FIG_CACHE_LOCK = threading.Lock()
+
+def _fig_key(cache,name,datas,*args):
+    """ Clave md5 de una figura a partir de los valores de las matrices
+    de datos, los argumentos del ploteo y las versiones de hidropy y
+    matplotlib, None si cache=None """
+    if cache == None:
+        return None
+    h = hashlib.md5('%d:%s:%s:%r' % (FIG_CACHE_VERSION, matplotlib.__version__,
+                                     name, args))
+    for data in datas:
+        yrs_data, valores, label_data = to_array(data)
+        h.update(yrs_data.tobytes())
+        h.update(np.ascontiguousarray(valores).tobytes())
+        h.update(repr(label_data))
+    return h.hexdigest()
+
+def _fig_png(archivo):
+    """ Nombre del archivo que genera plt.savefig """
+    if os.path.splitext(archivo)[1] == '':
+        return archivo + '.png'
+    return archivo
+
+def _fig_count(stat):
+    _FIG_CACHE_LOCK.acquire()
+    try:
+        FIG_CACHE_STATS[stat] += 1
+    finally:
+        _FIG_CACHE_LOCK.release()
+
+def _fig_hit(cache,key,archivo):
+    """ Copia la figura desde el cache, True si estaba en el cache """
+    if key == None:
+        return False
+    cache_file = os.path.join(cache, key + '.png')
+    if not os.path.exists(cache_file):
+        _fig_count('miss')
+        return False
+    archivo = _fig_png(archivo)
+    # Copia si el archivo no existe o su contenido es distinto
+    if not (os.path.exists(archivo) and
+            filecmp.cmp(archivo, cache_file, shallow=False)):
+        shutil.copyfile(cache_file, archivo)
+    _fig_count('hit')
+    return True
+
+def _fig_save(cache,key,archivo):
+    """ Guarda en el cache la figura recién generada """
+    if key == None:
+        return
+    if not os.path.isdir(cache):
+        try:
+            os.makedirs(cache)
+        except OSError:
+            if not os.path.isdir(cache):
+                raise
+    cache_file = os.path.join(cache, key + '.png')
+    # Archivo temporal propio de cada escritura, varios threads o procesos
+    # pueden guardar la misma figura a la vez
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache)
+    os.close(fd)
+    try:
+        shutil.copyfile(_fig_png(archivo), tmp)
+        os.rename(tmp, cache_file)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# Estadísticas del cache de figuras
+def fig_cache_stats(reset=False):
+    """ Figuras leídas desde el cache (hit) y generadas (miss) por las
+    funciones plot_* con parámetro cache
+    @param reset: Si es True vuelve los contadores a 0
+    @return: Diccionario {'hit': n, 'miss': n}
+    @rtype: dict
+    """
+    _FIG_CACHE_LOCK.acquire()
+    try:
+        stats_fig = dict(FIG_CACHE_STATS)
+        if reset:
+            FIG_CACHE_STATS['hit'] = 0
+            FIG_CACHE_STATS['miss'] = 0
+    finally:
+        _FIG_CACHE_LOCK.release()
+    return stats_fig
+
+# Número de puntos a plotear según el ancho del gráfico en pixeles
+def _n_pixels():
+    fig = plt.gcf()
+    return int(fig.get_figwidth() * fig.dpi)
+
 # Plotear correlacion entre 2 matrices de datos
-def plot_corr_q(data1,data2,yr_conc=None,lin_reg_param=None,name_fig='fig02',title='LinReg ',path_fig=''):
+def plot_corr_q(data1,data2,yr_conc=None,lin_reg_param=None,name_fig='fig02',title='LinReg ',path_fig='',
+                cache=None):
     """ Plotear correlacion entre 2 matrices de datos
     @param data1: Matriz de datos
     @param data2: Matriz de datos
@@ -977,9 +2057,16 @@ def plot_corr_q(data1,data2,yr_conc=None,lin_reg_param=None,name_fig='fig02',tit
     @param name_fig: Nombre archivo PNG donde se guarda el ploteo
     @param title: Título del plot
     @param path_fig: Ruta de salida del plot
+    @param cache: Directorio del cache de figuras, si los datos y
+        parámetros no cambiaron la figura se copia desde el cache
+        (ver fig_cache_stats). Si cache=None no usa cache.
     @return: Archivo PNG donde se guarda el ploteo
     @rtype: bitmap file
     """
+    key = _fig_key(cache, 'plot_corr_q', (data1, data2), yr_conc,
+                   lin_reg_param, name_fig, title)
+    if _fig_hit(cache, key, '%s%s' % (path_fig, name_fig)):
+        return
     valores1 = []
     valores2 = []
     valores_lin_reg = []
@@ -1005,9 +2092,11 @@ def plot_corr_q(data1,data2,yr_conc=None,lin_reg_param=None,name_fig='fig02',tit
     plt.title('%s %s\n m:%s, n:%s, R2:%s'%(title, name_fig, gradient, intercept, r_2))
     plt.savefig('%s%s'%(path_fig,name_fig))
     plt.close()
+    _fig_save(cache, key, '%s%s' % (path_fig, name_fig))
 
 # Plotear datos de años con datos completos en un sólo archivo
-def plot_q(data,yrs=None,name_fig='fig01',title='Caudales ',path_fig=''):
+def plot_q(data,yrs=None,name_fig='fig01',title='Caudales ',path_fig='',
+           cache=None):
     """ Plotear caudales de años con datos completos en un sólo archivo
     @param data: Matriz de datos con caudales mensuales
     @param yrs: Lista de años a plotear
@@ -1015,8 +2104,46 @@ def plot_q(data,yrs=None,name_fig='fig01',title='Caudales ',path_fig=''):
     @param name_fig: Nombre archivo PNG donde se guarda el ploteo
     @param title: Título del plot
     @param path_fig: Ruta de salida del plot
+    @param cache: Directorio del cache de figuras (ver plot_corr_q)
     @return: Archivo PNG donde se guarda el ploteo
     @rtype: bitmap file
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp() + os.sep
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> s = fig_cache_stats(reset=True)
+    >>> plot_q(a, name_fig='q', path_fig=tmp, cache=tmp + 'cache')
+    >>> plot_q(a, name_fig='q', path_fig=tmp, cache=tmp + 'cache')
+    >>> size = os.path.getsize(tmp + 'q.png')
+    >>> open(tmp + 'q.png', 'wb').write(' ' * size) # Mismo tamaño
+    >>> plot_q(a, name_fig='q', path_fig=tmp, cache=tmp + 'cache')
+    >>> open(tmp + 'q.png', 'rb').read(4)
+    '\\x89PNG'
+    >>> plot_q(a, name_fig='q', title='Q', path_fig=tmp, cache=tmp + 'cache')
+    >>> sorted(fig_cache_stats().items())
+    [('hit', 2), ('miss', 2)]
+    >>> sorted(os.listdir(tmp)), len(os.listdir(tmp + 'cache'))
+    (['cache', 'q.png'], 2)
+    >>> shutil.rmtree(tmp)
+    """
+    key = _fig_key(cache, 'plot_q', (data,), yrs, name_fig, title)
+    if _fig_hit(cache, key, '%s%s' % (path_fig, name_fig)):
+        return
+    draw_q(plt.gca(), data, yrs, name_fig, title)
+    plt.savefig('%s%s'%(path_fig,name_fig))
+    plt.close()
+    _fig_save(cache, key, '%s%s' % (path_fig, name_fig))
+
+# Dibuja caudales de años con datos completos en un Axes
+def draw_q(ax,data,yrs=None,name_fig='fig01',title='Caudales '):
+    """ Dibuja el gráfico de plot_q en un matplotlib Axes, sin usar el
+    estado global de pyplot (ej. Axes de una matplotlib.figure.Figure
+    creada en un thread)
+    @param ax: matplotlib Axes
+    @return: ax
+    @rtype: matplotlib Axes
     """
     if yrs == None:
         range_i = range(len(data[0]))
@@ -1032,18 +2159,19 @@ def plot_q(data,yrs=None,name_fig='fig01',title='Caudales ',path_fig=''):
                 raise ValueError, "Año fuera de rango de datos"
     for i in range_i:
         if data[1][i].count('') == 0:
-            plt.plot(range(1,len(data[2])),     # No cuenta col Year
-                     data[1][i], 
-                     label=str(data[0][i]))
-    plt.ylabel('m3/s')
-    plt.xlabel('meses')
-    plt.title('%s %s'%(title, name_fig))
-    plt.xticks(range(1,len(data[2])),data[2][1:])
-    plt.savefig('%s%s'%(path_fig,name_fig))
-    plt.close()
+            x_i = range(1,len(data[2]))     # No cuenta col Year
+            y_i = data[1][i]
+            ax.plot(x_i, y_i, label=str(data[0][i]))
+    ax.set_ylabel('m3/s')
+    ax.set_xlabel('meses')
+    ax.set_title('%s %s'%(title, name_fig))
+    ax.set_xticks(range(1,len(data[2])))
+    ax.set_xticklabels(data[2][1:])
+    return ax
 
 # Plotear volúmen anual de años con datos completos
-def plot_vol(data,yrs=None,name_fig='fig02',title='Volúmenes ',path_fig='', is_data_vol=False):
+def plot_vol(data,yrs=None,name_fig='fig02',title='Volúmenes ',path_fig='', is_data_vol=False,
+             cache=None):
     """ Plotear volúmen anual de años con datos completos
     @param data: Matriz de datos
     @param yrs: Lista de años a plotear
@@ -1053,9 +2181,28 @@ def plot_vol(data,yrs=None,name_fig='fig02',title='Volúmenes ',path_fig='', is_
     @param path_fig: Ruta de salida del plot
     @param is_data_vol: Indica si la matriz de datos es de volúmenes anuales
         Si is_data_vol=False cuando la matriz de datos es de caudales mensuales
+    @param cache: Directorio del cache de figuras (ver plot_corr_q)
     @return: Archivo PNG donde se guarda el ploteo
     @rtype: bitmap file
     """
+    key = _fig_key(cache, 'plot_vol', (data,), yrs, name_fig, title,
+                   is_data_vol)
+    if _fig_hit(cache, key, '%s%s' % (path_fig, name_fig)):
+        return
+    draw_vol(plt.gca(), data, yrs, name_fig, title, is_data_vol)
+    plt.savefig('%s%s'%(path_fig,name_fig))
+    plt.close()
+    _fig_save(cache, key, '%s%s' % (path_fig, name_fig))
+
+# Dibuja volúmenes anuales en un Axes
+def draw_vol(ax,data,yrs=None,name_fig='fig02',title='Volúmenes ',
+             is_data_vol=False):
+    """ Dibuja el gráfico de plot_vol en un matplotlib Axes, sin usar el
+    estado global de pyplot (ver draw_q)
+    @param ax: matplotlib Axes
+    @return: ax
+    @rtype: matplotlib Axes
+    """
     if not is_data_vol:
         data = vol_yr(data,yrs) # Fn vol_yr
     if yrs == None:
@@ -1069,21 +2216,66 @@ def plot_vol(data,yrs=None,name_fig='fig02',title='Volúmenes ',path_fig='', is_
                 range_i.append(data[0].index(yr))
             except ValueError:
                 raise ValueError, "Año fuera de rango de datos"
-    plt.plot(data[0],
-             data[1], 'v--',
-             label=str(data[2][1]))
+    ax.plot(data[0],
+            data[1], 'v--',
+            label=str(data[2][1]))
     
     # Poner título en unicode
     title_fig = title.decode('utf8')
-    plt.ylabel('Vol[MMm3]')
-    plt.xlabel(u'A\xf1os')
-    plt.title('%s %s'%(title_fig, name_fig))
-    #~ plt.xticks(range(len(data[0])),data[0], rotation=90)
-    plt.savefig('%s%s'%(path_fig,name_fig))
-    plt.close()
+    ax.set_ylabel('Vol[MMm3]')
+    ax.set_xlabel(u'A\xf1os')
+    ax.set_title('%s %s'%(title_fig, name_fig))
+    return ax
+
+# Genera un gráfico con una Figure propia
+def render(draw,data,archivo,cache=None,**kwargs):
+    """ Genera un gráfico PNG con una matplotlib.figure.Figure propia, sin
+    el estado global de pyplot, se puede usar en varios threads a la vez
+    @param draw: Función que dibuja en un Axes, ej. draw_q o draw_vol
+    @param data: Matriz de datos
+    @param archivo: Archivo PNG de salida
+    @param cache: Directorio del cache de figuras (ver plot_corr_q)
+    @param kwargs: Parámetros de draw
+    @return: archivo
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> archivo = render(draw_vol, a, os.path.join(tmp, 'vol.png'))
+    >>> os.listdir(tmp)
+    ['vol.png']
+    >>> cache = os.path.join(tmp, 'cache')
+    >>> errors = []
+    >>> def job(i):
+    ...     try:
+    ...         render(draw_q, a, os.path.join(tmp, 'q%d.png' % i), cache)
+    ...     except Exception, e:
+    ...         errors.append(e)
+    >>> threads = [threading.Thread(target=job, args=(i,)) for i in range(16)]
+    >>> for t in threads: t.start()
+    >>> for t in threads: t.join()
+    >>> errors, len(os.listdir(cache)) # Misma figura desde 16 threads
+    ([], 1)
+    >>> shutil.rmtree(tmp)
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    key = _fig_key(cache, 'render:' + draw.__name__, (data,),
+                   sorted(kwargs.items()))
+    if _fig_hit(cache, key, archivo):
+        return archivo
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    draw(fig.add_subplot(111), data, **kwargs)
+    fig.savefig(archivo)
+    _fig_save(cache, key, archivo)
+    return archivo
 
 # Plotear datos de una columna
-def plot_c(data,lcx=None,ylabel='m3/s',name_fig='fig01',title='Grafo ',path_fig=''):
+def plot_c(data,lcx=None,ylabel='m3/s',name_fig='fig01',title='Grafo ',path_fig='',
+           decim=None,cache=None):
     """ Plotear datos de una columna
     @param data: Matriz de datos
     @param lcx: Lista de índices de la columnas a plotear
@@ -1091,9 +2283,27 @@ def plot_c(data,lcx=None,ylabel='m3/s',name_fig='fig01',title='Grafo ',path_fig=
     @param name_fig: Nombre archivo PNG donde se guarda el ploteo
     @param title: Título del plot
     @param path_fig: Ruta de salida del plot
+    @param decim: Si es 'minmax' o 'lttb' reduce las series con más datos
+        que pixeles del gráfico (ver decimate), si decim=None plotea
+        todos los datos
+    @param cache: Directorio del cache de figuras (ver plot_corr_q)
     @return: Archivo PNG donde se guarda el ploteo
     @rtype: bitmap file
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp() + os.sep
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> plot_c(a, [0, 1], name_fig='c', path_fig=tmp, decim='minmax')
+    >>> os.listdir(tmp)
+    ['c.png']
+    >>> shutil.rmtree(tmp)
     """
+    key = _fig_key(cache, 'plot_c', (data,), lcx, ylabel, name_fig, title,
+                   decim)
+    if _fig_hit(cache, key, '%s%s' % (path_fig, name_fig)):
+        return
     if lcx == None:
         lcx = range(len(data[1][0]))
     if type(lcx) != list:
@@ -1103,6 +2313,8 @@ def plot_c(data,lcx=None,ylabel='m3/s',name_fig='fig01',title='Grafo ',path_fig=
         yrs_c = data_c[0]
         datos_c = data_c[1]
         label_c = data_c[2][1]
+        if decim != None:
+            yrs_c, datos_c = decimate(yrs_c, datos_c, _n_pixels(), decim)
         plt.plot(yrs_c, datos_c, 'o--',label=str(label_c))
     plt.ylabel(ylabel)
     plt.xlabel(str(data_c[2][0]))
@@ -1110,10 +2322,12 @@ def plot_c(data,lcx=None,ylabel='m3/s',name_fig='fig01',title='Grafo ',path_fig=
     plt.title('%s %s'%(title,name_fig))
     plt.savefig('%s%s'%(path_fig,name_fig))
     plt.close()
+    _fig_save(cache, key, '%s%s' % (path_fig, name_fig))
     
 # Plotear en cada archivo datos años completos e incompletos rellenando con promedio
 # datos cercanos al faltante
-def plot_yr(data,years=None,name_fig='fig01',title_fig='Caudales Año',path_fig=''):
+def plot_yr(data,years=None,name_fig='fig01',title_fig='Caudales Año',path_fig='',
+            cache=None):
     """ Plotear en cada archivo datos años completos e incompletos 
     rellenando con promedio datos cercanos al faltante
     @param data: Matriz de datos
@@ -1122,6 +2336,8 @@ def plot_yr(data,years=None,name_fig='fig01',title_fig='Caudales Año',path_fig=
     @param name_fig: Nombre archivo PNG donde se guarda el ploteo
     @param title_fig: Título del plot
     @param path_fig: Ruta de salida del plot
+    @param cache: Directorio del cache de figuras (ver plot_corr_q), la
+        figura de cada año depende de todos los datos (ver data_prom)
     @return: Archivo PNG donde se guarda el ploteo
     @rtype: bitmap file
     """
@@ -1134,6 +2350,10 @@ def plot_yr(data,years=None,name_fig='fig01',title_fig='Caudales Año',path_fig=
             iyear = data[0].index(year)
         except ValueError:
             raise ValueError, "Año fuera de rango de datos"
+        archivo = '%s%s%s' % (path_fig, name_fig, str(int(year)))
+        key = _fig_key(cache, 'plot_yr', (data,), year, name_fig, title_fig)
+        if _fig_hit(cache, key, archivo):
+            continue
         data_iyear = []
         label_iyear = []
         for cx in range(len(data[1][iyear])):
@@ -1155,6 +2375,7 @@ def plot_yr(data,years=None,name_fig='fig01',title_fig='Caudales Año',path_fig=
         plt.xticks(range(len(data_iyear)),label_iyear)
         plt.savefig('%s%s%s'%(path_fig, name_fig, yr_str))
         plt.close()
+        _fig_save(cache, key, archivo)
     
 # Plotear datos años completos e incompletos 
 # rellenado con una correlación con otra estación
@@ -1200,71 +2421,212 @@ def plot_yr_lr(data,years,data1,lin_reg_param,name_fig='fig01',title_fig='Caudal
         plt.savefig('%s%s%s_lr'%(path_fig, name_fig, yr_str))
         plt.close()
 
+# Estado de datos por estación y año
+def status_lost(data):
+    """ Matriz de estado de datos de una colección de estaciones
+    @param data: Colección de estaciones (ver stack_data)
+    @return: Arreglo int8 de n_estaciones x n_años con
+        0 año completo, 1 año incompleto, 2 año sin datos
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> status_lost(stack_data(['a','b'], a, b)).tolist()
+    [[0, 0, 1, 2], [0, 1, 0, 1]]
+    """
+    n_lost = np.isnan(data[2]).sum(axis=-1)
+    status = np.ones(n_lost.shape, dtype='int8')
+    status[n_lost == 0] = 0
+    status[n_lost == data[2].shape[-1]] = 2
+    return status
+
+# Tipo de año por estación y año
+def status_type(data,vol_hi=None,vol_low=None):
+    """ Matriz de tipo de año de una colección de estaciones con caudales
+    mensuales, equivalente a yrs_type de cada estación.
+    @param data: Colección de estaciones (ver stack_data)
+    @param vol_hi: Volumen mínimo anual de un año húmedo
+    @param vol_low: Volumen máximo anual de un año seco
+        Si vol_hi=None y vol_low=None usa los cuartiles de cada estación
+    @return: Arreglo int8 de n_estaciones x n_años con
+        0 año seco, 1 año normal, 2 año húmedo, 3 año incompleto
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> status_type(stack_data(['a'], a)).tolist()
+    [[0, 3, 2, 3]]
+    >>> yrs_type(vol_yr(a))
+    ([1950.0], [], [1952.0])
+    """
+    vol = vol_array(data[1], data[2], data[3])
+    if vol_hi == None and vol_low == None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            vol_low, vol_hi = np.nanpercentile(vol, [25, 75], axis=1)
+        vol_low = vol_low[:, np.newaxis]
+        vol_hi = vol_hi[:, np.newaxis]
+    status = np.empty(vol.shape, dtype='int8')
+    status.fill(3)
+    with np.errstate(invalid='ignore'):
+        status[vol <= vol_low] = 0
+        status[(vol > vol_low) & (vol < vol_hi)] = 1
+        status[vol >= vol_hi] = 2
+    return status
+
+# Ploteo de matrices de estado por páginas
+def _status_grid(data,status_fn,yrs,fill):
+    """ Matriz de estado de una colección en el eje de años yrs (años
+    consecutivos, una columna por año), los años de yrs que no están en
+    la colección quedan con fill
+
+    @note: Ejemplos
+
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = ([1950.0, 1990.0], [a[1][0], a[1][1]], a[2])
+    >>> c = stack_data(['a', 'b'], a, b)
+    >>> c[1].tolist() # Sin 1953 a 1989
+    [1950.0, 1951.0, 1952.0, 1990.0]
+    >>> yrs = np.arange(min(c[1]), max(c[1]) + 1)
+    >>> grid = _status_grid(c, status_lost, yrs, 2)
+    >>> grid.shape, grid[:, [0, 1, 2, 3, 40]].tolist()
+    ((2, 41), [[0, 0, 1, 2, 2], [0, 2, 2, 2, 0]])
+    """
+    status = np.empty((len(data[0]), len(yrs)), dtype='int8')
+    status.fill(fill)
+    status[:, np.searchsorted(yrs, data[1])] = status_fn(data)
+    return status
+
+def _plot_status(names_data,args,status_fn,colors,legend,name_fig,title_fig,
+                 path_fig,rows_page):
+    """ Dibuja la matriz de estado de cada página como una sola imagen.
+    Cada página lee sólo rows_page estaciones, la memoria no depende del
+    número total de estaciones.
+    @return: Lista de archivos PNG generados
+    """
+    from matplotlib.colors import ListedColormap
+    from matplotlib.patches import Patch
+    # Caso colección de estaciones
+    if len(args) == 1 and is_stack(args[0]):
+        stack = args[0]
+        names_data = stack[0]
+        args = None
+        yrs = stack[1]
+    else:
+        if len(args) != len(names_data):
+            raise IndexError, "largo names_data no coincide con args"
+        yrs = np.unique(np.array([yr for arg in args for yr in arg[0]
+                                  if yr != ''], dtype='float64'))
+    # Una columna por año, también los años sin datos en ninguna estación
+    yrs = np.arange(np.min(yrs), np.max(yrs) + 1)
+    n_pages = max(1, (len(names_data) + rows_page - 1) // rows_page)
+    # Poner título en unicode
+    title_fig = title_fig.decode('utf8')
+    files = []
+    for page in range(n_pages):
+        ini = page * rows_page
+        fin = min(ini + rows_page, len(names_data))
+        if args == None:
+            sub = (stack[0][ini:fin], stack[1], stack[2][ini:fin], stack[3])
+        else:
+            sub = stack_data(names_data[ini:fin], *args[ini:fin])
+        # Último color, año sin datos
+        status = _status_grid(sub, status_fn, yrs, len(colors) - 1)
+        fig = plt.figure(figsize=(10, 2 + 0.15 * (fin - ini)))
+        ax = fig.add_subplot(111)
+        ax.imshow(status, aspect='auto', interpolation='nearest',
+                  cmap=ListedColormap(colors), vmin=-0.5,
+                  vmax=len(colors) - 0.5,
+                  extent=(yrs[0] - 0.5, yrs[-1] + 0.5, fin - ini - 0.5, -0.5))
+        ax.set_yticks(range(fin - ini))
+        ax.set_yticklabels(trunc_str(names_data[ini:fin]))  # Utiliza Fn trunc_str
+        ax.set_ylabel(u'Estaci\xf3n')
+        ax.set_xlabel(u'A\xf1o')
+        fig.legend([Patch(color=color) for color in colors], legend,
+                   loc='lower center', ncol=len(colors))
+        fig.subplots_adjust(bottom=min(0.4, 0.8 / fig.get_figheight()))
+        if n_pages == 1:
+            ax.set_title('%s' % title_fig)
+            archivo = '%s%s.png' % (path_fig, name_fig)
+        else:
+            ax.set_title('%s %d/%d' % (title_fig, page + 1, n_pages))
+            archivo = '%s%s_%02d.png' % (path_fig, name_fig, page + 1)
+        fig.savefig(archivo, bbox_inches='tight')
+        plt.close(fig)
+        files.append(archivo)
+    return files
+
 # Plot años hidrológicos sin datos de una serie de matrices de datos
-def plot_yr_lost(names_data,*args):
-    """ Plot de años sin datos
+def plot_yr_lost(names_data,*args,**kwargs):
+    """ Plot de años sin datos, cada estación es una fila de una imagen
+    con años completos, incompletos y sin datos.
     @param names_data: Lista con nombre de las estaciones
         correspondientes a las matrices de datos, [name1, ... ,nameN]
     @type names_data: list
-    @param args: Matrices de datos, matriz_datos1, ... ,matriz_datosN
-    @type args:= tuple
-    @return: Archivo PNG donde se guarda el ploteo
-    @rtype: bitmap file
+    @param args: Matrices de datos, matriz_datos1, ... ,matriz_datosN,
+        o una colección de estaciones (ver stack_data)
+    @type args: tuple
+    @keyword name_fig: Nombre archivo PNG donde se guarda el ploteo
+    @keyword path_fig: Ruta de salida del plot
+    @keyword rows_page: Número de estaciones por archivo, con más
+        estaciones se agrega el número de página a name_fig
+    @return: Lista de archivos PNG donde se guarda el ploteo
+    @rtype: list
     """
-    name_fig='Años sin datos'
-    path_fig=''
-    
-    if len(args) != len(names_data):
-        raise IndexError, "largo names_data no coincide con args"
-    i = 1
-    for arg in args:
-        yrs_lost = index_lost(arg, hidecx=True) # Utiliza Fn index_lost
-        plt.plot(yrs_lost, ones(yrs_lost,i),'o') # Utiliza Fn ones
-        i += 1
-    # Poner título en unicode
-    title_fig = name_fig.decode('utf8')
-    ymin, ymax = plt.ylim()
-    plt.ylim( ymin-1, ymax+1 )
-    xmin, xmax = plt.xlim()
-    plt.xlim( xmin-1, xmax+1 )
-    plt.yticks( range(1,len(args)+1), trunc_str(names_data) ) # Utiliza Fn trunc_str
-    plt.ylabel(u'Estaci\xf3n')
-    plt.xlabel(u'A\xf1o')
-    plt.title('%s'%title_fig)
-    plt.savefig('%s%s'%(path_fig, name_fig))
-    plt.close()
+    return _plot_status(names_data, args, status_lost,
+                        ['#2ca02c', '#ffbf00', '#d62728'],
+                        ['Completo', 'Incompleto', 'Sin datos'],
+                        kwargs.get('name_fig', 'Años sin datos'),
+                        'Años sin datos', kwargs.get('path_fig', ''),
+                        kwargs.get('rows_page', 100))
 
 # Plot años hidrológicos por tipo
-#TODO (Sin implementar es sólo una copia de yr_lost)
-def plot_yr_type(names_data,*args):
-    """ Plot de años sin datos
-    names_data = [name1, ... ,nameN] 
-    args = matriz_datos1, ... ,matriz_datosN
-    @todo: Sin implementar
-    """
-    name_fig='Años sin datos'
-    path_fig=''
-    
-    if len(args) != len(names_data):
-        raise IndexError, "largo names_data no coincide con args"
-    i = 1
-    for arg in args:
-        yrs_lost = index_lost(arg, hidecx=True) # Utiliza Fn index_lost
-        plt.plot(yrs_lost, ones(yrs_lost,i),'o') # Utiliza Fn ones
-        i += 1
-    # Poner título en unicode
-    title_fig = name_fig.decode('utf8')
-    ymin, ymax = plt.ylim()
-    plt.ylim( ymin-1, ymax+1 )
-    xmin, xmax = plt.xlim()
-    plt.xlim( xmin-1, xmax+1 )
-    plt.yticks( range(1,len(args)+1), trunc_str(names_data) ) # Utiliza Fn trunc_str
-    plt.ylabel(u'Estaci\xf3n')
-    plt.xlabel(u'A\xf1o')
-    plt.title('%s'%title_fig)
-    plt.savefig('%s%s'%(path_fig, name_fig))
-    plt.close()
-    
+def plot_yr_type(names_data,*args,**kwargs):
+    """ Plot de tipo de año (seco, normal, húmedo), cada estación es una
+    fila de una imagen. Ver yrs_type.
+    @param names_data: Lista con nombre de las estaciones
+        correspondientes a las matrices de datos, [name1, ... ,nameN]
+    @type names_data: list
+    @param args: Matrices de datos de caudales mensuales,
+        matriz_datos1, ... ,matriz_datosN, o una colección de estaciones
+    @type args: tuple
+    @keyword vol_hi: Volumen mínimo anual de un año húmedo
+    @keyword vol_low: Volumen máximo anual de un año seco
+        Si no se indican usa los cuartiles de cada estación
+    @keyword name_fig: Nombre archivo PNG donde se guarda el ploteo
+    @keyword path_fig: Ruta de salida del plot
+    @keyword rows_page: Número de estaciones por archivo
+    @return: Lista de archivos PNG donde se guarda el ploteo
+    @rtype: list
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp() + os.sep
+    >>> a = from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> files = plot_yr_type(['a', 'b', 'c'], a, b, a, path_fig=tmp, rows_page=2)
+    >>> [f.endswith(s) for f, s in zip(files, ['_01.png', '_02.png'])]
+    [True, True]
+    >>> files = plot_yr_lost(['a', 'b'], stack_data(['a', 'b'], a, b), path_fig=tmp)
+    >>> len(files)
+    1
+    >>> shutil.rmtree(tmp)
+    """
+    vol_hi = kwargs.get('vol_hi')
+    vol_low = kwargs.get('vol_low')
+    def status_fn(data):
+        return status_type(data, vol_hi, vol_low)
+    return _plot_status(names_data, args, status_fn,
+                        ['#d62728', '#2ca02c', '#1f77b4', '#d9d9d9'],
+                        ['Seco', 'Normal', u'H\xfamedo', 'Incompleto'],
+                        kwargs.get('name_fig', 'Tipo de año'),
+                        'Tipo de año', kwargs.get('path_fig', ''),
+                        kwargs.get('rows_page', 100))
+
 # Trunca names_data
 def trunc_str(names,n=6):
     """ Trunca las palabras dentro de una lista de palabras
@@ -1307,5 +2669,10 @@ def ones(lista,value=1):
     return aux
 
 if __name__ == '__main__':
+    import sys
+    # python -m hidro_data config.ini ejecuta el pipeline (ver hidro_pipeline)
+    if len(sys.argv) > 1:
+        import hidro_pipeline
+        sys.exit(hidro_pipeline.main(sys.argv[1:]))
     import doctest
     doctest.testmod()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_drought.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Sequías por teoría de rachas en caudales mensuales.
+
+   Una sequía es una racha de meses consecutivos con caudal bajo el
+   umbral. El umbral es un valor fijo o un percentil de cada mes
+   calendario (columna) de cada estación. Las rachas se obtienen con
+   codificación por largo de racha sobre las series leídas año por año,
+   para todas las estaciones y niveles de umbral a la vez. Los meses sin
+   dato terminan la racha.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import numpy as np
+from hidro_data import days_in, is_stack, month_axis, to_array
+
+EVENT_DTYPE = np.dtype([('level', 'i2'), ('station', 'i4'),
+                        ('start', 'M8[M]'), ('duration', 'i4'),
+                        ('deficit', 'f8'), ('intensity', 'f8'),
+                        ('min_flow', 'f8')])
+
+def _values(data):
+    if is_stack(data):
+        return data[1], data[2], data[3]
+    yrs_data, valores, label_data = to_array(data)
+    return yrs_data, valores[np.newaxis], label_data
+
+# Umbrales por nivel
+def thresholds(data,values=None,percentiles=None):
+    """ Umbrales de cada nivel, estación y mes
+    @param data: Matriz de datos mensuales o colección de estaciones
+    @param values: Lista de umbrales fijos en m3/s
+    @param percentiles: Lista de percentiles (0 ... 100) de cada mes
+        calendario de cada estación
+    @return: Arreglo de n_niveles x n_estaciones x n_años x n_columnas,
+        los niveles fijos primero y luego los percentiles
+    @rtype: numpy.ndarray
+    """
+    yrs_data, valores, label_data = _values(data)
+    levels = []
+    shape = valores.shape
+    for value in values or []:
+        levels.append(np.full(shape, float(value)))
+    if percentiles:
+        with np.errstate(invalid='ignore'):
+            p = np.nanpercentile(valores, percentiles, axis=1)
+        for level in p:
+            levels.append(np.broadcast_to(level[:, np.newaxis], shape))
+    if levels == []:
+        raise ValueError, "Falta values o percentiles"
+    return np.array(levels)
+
+# Eventos de sequía
+def drought_events(data,values=None,percentiles=None,min_dur=1):
+    """ Tabla de sequías de todas las estaciones y niveles de umbral
+    @param data: Matriz de datos mensuales o colección de estaciones
+    @param values: Lista de umbrales fijos en m3/s
+    @param percentiles: Lista de percentiles mensuales (ver thresholds)
+    @param min_dur: Duración mínima en meses
+    @return: Arreglo de eventos con dtype EVENT_DTYPE, ordenado por
+        nivel, estación e inicio. deficit es el volumen bajo el umbral
+        en MMm3, intensity = deficit / duration
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> ev = drought_events(a, values=[3.0, 5.0])
+    >>> ev[['level', 'duration']].tolist()
+    [(0, 2), (0, 1), (1, 4), (1, 3), (1, 2)]
+    >>> [str(m) for m in ev['start'][ev['level'] == 1]]
+    ['1950-01', '1951-01', '1952-01']
+    >>> round(ev['deficit'][0], 4) # (1.9 + 0.9) m3/s en JAN y FEB 1950
+    7.2662
+    >>> ev_p = drought_events(a, percentiles=[50]) # Mediana de cada mes
+    >>> ev_p[['duration', 'min_flow']].tolist()
+    [(12, 1.1)]
+    """
+    yrs_data, valores, label_data = _values(data)
+    n_st = valores.shape[0]
+    thr = thresholds(data, values, percentiles)
+    n_lv = thr.shape[0]
+    months = month_axis(yrs_data, label_data).ravel()
+    vol_mes = days_in(months) * (60 * 60 * 24.0) / 1.0e6
+    x = valores.reshape(n_st, -1)
+    thr = thr.reshape(n_lv, n_st, -1)
+    with np.errstate(invalid='ignore'):
+        below = x < thr                         # NaN no está bajo umbral
+    deficit = np.where(below, (thr - x) * vol_mes, 0.0)
+    flow = np.where(below, x, np.inf)
+    # Inicio y fin de rachas
+    pad = np.zeros((n_lv, n_st, 1), dtype='int8')
+    edge = np.diff(np.concatenate((pad, below.astype('int8'), pad), axis=2),
+                   axis=2)
+    lv, st, ini = np.nonzero(edge == 1)
+    fin = np.nonzero(edge == -1)[2]
+    dur = fin - ini
+    keep = dur >= min_dur
+    lv, st, ini, fin, dur = lv[keep], st[keep], ini[keep], fin[keep], dur[keep]
+    cum = np.zeros(deficit.shape[:2] + (deficit.shape[2] + 1,))
+    np.cumsum(deficit, axis=2, out=cum[:, :, 1:])
+    events = np.empty(len(dur), dtype=EVENT_DTYPE)
+    events['level'] = lv
+    events['station'] = st
+    events['start'] = months[ini]
+    events['duration'] = dur
+    events['deficit'] = cum[lv, st, fin] - cum[lv, st, ini]
+    events['intensity'] = events['deficit'] / dur
+    # Caudal mínimo de cada racha
+    if len(dur) > 0:
+        pos = np.repeat(np.arange(len(dur)), dur)
+        t = np.arange(dur.sum()) - np.repeat(np.cumsum(dur) - dur, dur)
+        t += np.repeat(ini, dur)
+        events['min_flow'] = np.minimum.reduceat(flow[lv[pos], st[pos], t],
+                                                 np.cumsum(dur) - dur)
+    return events
+
+# Resumen de sequías
+def drought_summary(events,n_levels,n_stations):
+    """ Resumen de eventos por nivel y estación
+    @param events: Tabla de drought_events
+    @param n_levels: Número de niveles de umbral
+    @param n_stations: Número de estaciones
+    @return: (count, max_duration, max_deficit, total_deficit) arreglos
+        de n_niveles x n_estaciones
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> c = hidro_data.stack_data(['a', 'a2'], a, a)
+    >>> count, max_dur, max_def, tot = drought_summary(
+    ...     drought_events(c, values=[3.0, 5.0]), 2, 2)
+    >>> count.tolist(), max_dur.tolist()
+    ([[2, 2], [3, 3]], [[2, 2], [4, 4]])
+    """
+    shape = (n_levels, n_stations)
+    idx = np.ravel_multi_index((events['level'], events['station']), shape)
+    size = n_levels * n_stations
+    count = np.bincount(idx, minlength=size).reshape(shape)
+    total = np.bincount(idx, events['deficit'], minlength=size).reshape(shape)
+    max_dur = np.zeros(size, dtype=int)
+    np.maximum.at(max_dur, idx, events['duration'])
+    max_def = np.zeros(size)
+    np.maximum.at(max_def, idx, events['deficit'])
+    return count, max_dur.reshape(shape), max_def.reshape(shape), total
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_freq.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Análisis de frecuencia de volúmenes anuales y curvas de duración.
+   Todas las funciones operan sobre varias estaciones a la vez
+   (una estación por fila, NaN en datos faltantes).
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import contextlib
+import warnings
+import numpy as np
+from scipy import special, stats
+from hidro_data import to_series
+
+EULER = 0.5772156649015329
+DISTS = ('gumbel', 'lognorm', 'pe3')
+
+@contextlib.contextmanager
+def _quiet():
+    """ Silencia advertencias de estaciones sin datos suficientes """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            yield
+
+# Curva de excedencia
+def exceed_curve(data,a=0.0):
+    """ Curva de excedencia de cada estación. Los valores se ordenan de
+    mayor a menor y se asigna la probabilidad de excedencia con la
+    posición de ploteo (i - a) / (n + 1 - 2a), con n el número de datos
+    válidos de la estación.
+    @param data: Matriz de datos (ej. vol_yr), colección de estaciones
+        (ver stack_data), lista de listas de valores o arreglo de
+        n_estaciones x n_datos
+    @param a: Parámetro de la posición de ploteo, 0 Weibull, 0.44 Gringorten,
+        0.5 Hazen
+    @type a: float
+    @return: (valores, prob) arreglos de n_estaciones x n_datos, los
+        datos faltantes quedan al final con NaN
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> val, prob = exceed_curve([[3.0, 1.0, '', 2.0]])
+    >>> val.tolist()
+    [[3.0, 2.0, 1.0, nan]]
+    >>> prob.tolist()
+    [[0.25, 0.5, 0.75, nan]]
+    """
+    x = to_series(data)[0]
+    # np.sort deja NaN al final, se ordena -x para orden descendente
+    valores = -np.sort(-x, axis=-1)
+    n = (~np.isnan(x)).sum(axis=-1)[:, np.newaxis]
+    i = np.arange(1, x.shape[-1] + 1)[np.newaxis]
+    prob = (i - a) / (n + 1.0 - 2.0 * a)
+    prob[i > n] = np.nan
+    return valores, prob
+
+# Curva de duración de caudales
+def flow_duration(data,prob=None):
+    """ Curva de duración de caudales mensuales de cada estación.
+    @param data: Matriz de datos mensuales, colección de estaciones
+        (ver stack_data), lista de listas de valores o arreglo de
+        n_estaciones x n_datos
+    @param prob: Probabilidades de excedencia a evaluar (0 ... 1).
+        Si prob=None retorna la curva completa (ver exceed_curve)
+    @return: Si prob=None (valores, prob), si no arreglo de
+        n_estaciones x len(prob) con el caudal excedido con cada
+        probabilidad (interpolación lineal)
+    @rtype: tuple o numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> flow_duration(a, [0.0, 0.5, 1.0]).round(2).tolist()
+    [[13.1, 6.1, 1.1]]
+    """
+    if prob is None:
+        return exceed_curve(data)
+    x = to_series(data)[0]
+    q = 100.0 * (1.0 - np.asarray(prob, dtype='float64'))
+    with _quiet():
+        return np.nanpercentile(x, q, axis=-1).T
+
+# Momentos de cada estación
+def moments(data):
+    """ Media, desviación estándar y coeficiente de asimetría insesgados
+    de cada estación.
+    @param data: Datos de n_estaciones (ver exceed_curve)
+    @return: (n, media, desv, asim) arreglos de n_estaciones
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> n, mu, sd, g = moments([[1.0, 2.0, 3.0, ''], [1.0, 2.0, 4.0, 9.0]])
+    >>> n.tolist(), mu.tolist()
+    ([3, 4], [2.0, 4.0])
+    >>> np.round(g, 4).tolist()
+    [0.0, 1.3309]
+    """
+    x = to_series(data)[0]
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=-1)
+    nf = n.astype('float64')
+    with _quiet():
+        mu = np.where(valid, x, 0.0).sum(axis=-1) / nf
+        d = np.where(valid, x - mu[:, np.newaxis], 0.0)
+        m2 = (d ** 2).sum(axis=-1)
+        m3 = (d ** 3).sum(axis=-1)
+        sd = np.sqrt(m2 / (nf - 1))
+        g = nf * m3 / ((nf - 1) * (nf - 2) * sd ** 3)
+    sd[n < 2] = np.nan
+    g[n < 3] = np.nan
+    return n, mu, sd, g
+
+# L-momentos de cada estación
+def lmoments(data):
+    """ L-momentos muestrales de cada estación calculados con los momentos
+    ponderados por probabilidad (Hosking, 1990).
+    @param data: Datos de n_estaciones (ver exceed_curve)
+    @return: (n, l1, l2, t3) arreglos de n_estaciones, t3 = l3 / l2
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> n, l1, l2, t3 = lmoments([[1.0, 2.0, 3.0, ''], [1.0, 2.0, 6.0, 7.0]])
+    >>> l1.tolist()
+    [2.0, 4.0]
+    >>> np.round(l2, 4).tolist(), np.round(t3, 4).tolist()
+    ([0.6667, 1.8333], [0.0, 0.0])
+    """
+    x = np.sort(to_series(data)[0], axis=-1)   # NaN al final
+    n = (~np.isnan(x)).sum(axis=-1)
+    nf = n[:, np.newaxis].astype('float64')
+    j = np.arange(x.shape[-1], dtype='float64')[np.newaxis]   # j - 1
+    x0 = np.where(j < nf, x, 0.0)
+    with _quiet():
+        b0 = x0.sum(axis=-1) / n
+        b1 = (x0 * j / (nf - 1)).sum(axis=-1) / n
+        b2 = (x0 * j * (j - 1) / ((nf - 1) * (nf - 2))).sum(axis=-1) / n
+        l2 = 2 * b1 - b0
+        t3 = (6 * b2 - 6 * b1 + b0) / l2
+    l2[n < 2] = np.nan
+    t3[n < 3] = np.nan
+    return n, b0, l2, t3
+
+# Ajuste de distribuciones
+def fit_dist(data,dist='gumbel',method='lmom'):
+    """ Ajusta una distribución a los datos de cada estación.
+    @param data: Datos de n_estaciones (ver exceed_curve)
+    @param dist: 'gumbel' (EV1), 'lognorm' (log-normal 2 parámetros) o
+        'pe3' (Pearson III)
+    @param method: 'mom' método de los momentos o 'lmom' L-momentos
+    @return: Parámetros, arreglos de n_estaciones::
+            gumbel (ubicación, escala)
+            lognorm (media, desv) de ln(x)
+            pe3 (media, desv, asim)
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> x = [[10.0, 12.0, 15.0, 11.0, 20.0, 13.0]]
+    >>> np.round(fit_dist(x, 'gumbel', 'mom'), 3).tolist()
+    [[11.871], [2.822]]
+    >>> np.round(fit_dist(x, 'pe3', 'mom'), 3).tolist()
+    [[13.5], [3.619], [1.367]]
+    """
+    if dist not in DISTS:
+        raise ValueError, "dist no válida"
+    if method not in ('mom', 'lmom'):
+        raise ValueError, "method no válido"
+    if dist == 'lognorm':
+        x = to_series(data)[0]
+        with _quiet():
+            x = np.log(np.where(x > 0, x, np.nan))
+    else:
+        x = to_series(data)[0]
+    if method == 'mom':
+        n, mu, sd, g = moments(x)
+        if dist == 'gumbel':
+            alpha = sd * np.sqrt(6.0) / np.pi
+            return mu - EULER * alpha, alpha
+        elif dist == 'lognorm':
+            return mu, sd
+        return mu, sd, g
+    n, l1, l2, t3 = lmoments(x)
+    if dist == 'gumbel':
+        alpha = l2 / np.log(2.0)
+        return l1 - EULER * alpha, alpha
+    elif dist == 'lognorm':
+        return l1, l2 * np.sqrt(np.pi)
+    # Pearson III, aproximación racional de Hosking y Wallis (1997)
+    at3 = np.abs(t3)
+    with _quiet():
+        z = 3 * np.pi * t3 ** 2
+        a_low = (1 + 0.2906 * z) / (z + 0.1882 * z ** 2 + 0.0442 * z ** 3)
+        z = 1 - at3
+        a_hi = ((0.36067 * z - 0.59567 * z ** 2 + 0.25361 * z ** 3) /
+                (1 - 2.78861 * z + 2.56096 * z ** 2 - 0.77045 * z ** 3))
+        a = np.where(at3 < 1.0 / 3, a_low, a_hi)
+        g = 2 / np.sqrt(a) * np.sign(t3)
+        sd = (l2 * np.sqrt(np.pi * a) *
+              np.exp(special.gammaln(a) - special.gammaln(a + 0.5)))
+    # t3 = 0 corresponde a la distribución normal
+    sd = np.where(t3 == 0, l2 * np.sqrt(np.pi), sd)
+    return l1, sd, g
+
+# Cuantiles de distribuciones ajustadas
+def dist_quantile(params,prob,dist='gumbel'):
+    """ Cuantiles de la distribución ajustada de cada estación.
+    @param params: Parámetros de fit_dist
+    @param prob: Probabilidades de no excedencia (0 ... 1)
+    @param dist: 'gumbel', 'lognorm' o 'pe3' (ver fit_dist)
+    @return: Arreglo de n_estaciones x len(prob)
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> dist_quantile(([0.0], [1.0]), [0.5], 'lognorm').tolist()
+    [[1.0]]
+    >>> np.round(dist_quantile(([0.0], [1.0], [0.0]), [0.975], 'pe3'), 3).tolist()
+    [[1.96]]
+    """
+    if dist not in DISTS:
+        raise ValueError, "dist no válida"
+    params = [np.asarray(par, dtype='float64')[:, np.newaxis]
+              for par in params]
+    prob = np.asarray(prob, dtype='float64')[np.newaxis]
+    if dist == 'gumbel':
+        return params[0] - params[1] * np.log(-np.log(prob))
+    z = stats.norm.ppf(prob)
+    if dist == 'lognorm':
+        return np.exp(params[0] + params[1] * z)
+    mu, sd, g = params
+    # Factor de frecuencia de Pearson III con la distribución gamma
+    with _quiet():
+        ag = np.abs(g)
+        alpha = 4 / ag ** 2
+        p = np.where(g > 0, prob, 1 - prob)
+        k = np.sign(g) * (ag / 2 * stats.gamma.ppf(p, alpha) - 2 / ag)
+    k = np.where(ag < 1e-6, z, k)
+    return mu + sd * k
+
+# Cuantiles por periodo de retorno
+def return_period(data,periods=(2, 5, 10, 25, 50, 100),dist='gumbel',
+                  method='lmom',tail='upper'):
+    """ Cuantiles por periodo de retorno de cada estación.
+    @param data: Datos de n_estaciones (ver exceed_curve),
+        ej. volúmenes anuales de stack_data con datos de vol_yr
+    @param periods: Periodos de retorno en años
+    @param dist: 'gumbel', 'lognorm' o 'pe3' (ver fit_dist)
+    @param method: 'mom' o 'lmom' (ver fit_dist)
+    @param tail: 'upper' volumen excedido en promedio una vez cada T años
+        (años húmedos), 'lower' volumen no alcanzado una vez cada T años
+        (años secos)
+    @return: Arreglo de n_estaciones x len(periods)
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> x = [[10.0, 12.0, 15.0, 11.0, 20.0, 13.0]]
+    >>> np.round(return_period(x, [2, 100], 'gumbel', 'mom'), 2).tolist()
+    [[12.91, 24.85]]
+    >>> np.round(return_period(x, [2], 'pe3', 'mom', 'lower'), 2).tolist()
+    [[12.7]]
+    """
+    if tail not in ('upper', 'lower'):
+        raise ValueError, "tail no válido"
+    periods = np.asarray(periods, dtype='float64')
+    if (periods <= 1).any():
+        raise ValueError, "Periodo de retorno debe ser mayor a 1"
+    prob = 1.0 / periods
+    if tail == 'upper':
+        prob = 1.0 - prob
+    return dist_quantile(fit_dist(data, dist, method), prob, dist)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
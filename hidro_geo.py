@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_geo.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Metadatos de estaciones con índice espacial (KD-tree) para buscar
+   estaciones donantes cercanas y rellenar con distancia inversa.
+
+   Los metadatos (nombre, coordenadas, elevación y cuenca) se guardan
+   en una tabla Stations ordenada como los nombres de una colección de
+   estaciones (ver stack_data). Las coordenadas pueden ser planas
+   (ej. UTM en metros) o geográficas (latitud, longitud en grados),
+   en ese caso las distancias son en km.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import numpy as np
+import xlrd
+from scipy.spatial import cKDTree
+from hidro_data import from_array, is_stack, stack_data, to_array
+
+R_EARTH = 6371.0
+
+def _xyz(lat,lon):
+    """ Coordenadas 3D en km de latitud y longitud en grados """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return R_EARTH * np.column_stack((np.cos(lat) * np.cos(lon),
+                                      np.cos(lat) * np.sin(lon),
+                                      np.sin(lat)))
+
+def _arc(chord):
+    """ Distancia sobre la superficie a partir de la cuerda """
+    return 2 * R_EARTH * np.arcsin(np.minimum(chord / (2 * R_EARTH), 1.0))
+
+# Tabla de estaciones con índice espacial
+class Stations(object):
+    """ Metadatos de estaciones con KD-tree para consultas espaciales
+    en O(log n)
+
+    @note: Ejemplos
+
+    >>> st = Stations(['a', 'b', 'c', 'd'], [0.0, 1.0, 0.0, 5.0],
+    ...               [0.0, 0.0, 2.0, 5.0], basin=['M', 'M', 'N', 'N'])
+    >>> st.nearest('a', k=2)
+    (['b', 'c'], [1.0, 2.0])
+    >>> st.nearest('a', k=2, same_basin=True)
+    (['b'], [1.0])
+    >>> st.within((0.0, 0.0), 1.5)
+    ['a', 'b']
+    >>> geo = Stations(['stgo', 'vina'], [-33.45, -33.02], [-70.66, -71.55],
+    ...                latlon=True)
+    >>> round(geo.nearest('stgo')[1][0], 1) # km
+    95.6
+    """
+    def __init__(self, names, x, y, z=None, basin=None, ids=None,
+                 latlon=False):
+        """
+        @param names: Lista con nombre de las estaciones
+        @param x: Coordenada x o latitud en grados si latlon=True
+        @param y: Coordenada y o longitud en grados si latlon=True
+        @param z: Elevación de cada estación (opcional)
+        @param basin: Cuenca de cada estación (opcional)
+        @param ids: Código de cada estación (opcional)
+        @param latlon: Si es True x, y son latitud y longitud
+        """
+        self.names = list(names)
+        n = len(self.names)
+        self.x = np.asarray(x, dtype='float64')
+        self.y = np.asarray(y, dtype='float64')
+        if len(self.x) != n or len(self.y) != n:
+            raise IndexError, "largo names no coincide con coordenadas"
+        if z is None:
+            z = [np.nan] * n
+        if basin is None:
+            basin = [''] * n
+        if ids is None:
+            ids = list(self.names)
+        self.z = np.asarray(z, dtype='float64')
+        self.basin = list(basin)
+        self.ids = list(ids)
+        self.latlon = latlon
+        self.tree = cKDTree(self._points(self.x, self.y))
+
+    def _points(self, x, y):
+        if self.latlon:
+            return _xyz(x, y)
+        return np.column_stack((x, y))
+
+    def _dist(self, d):
+        if self.latlon:
+            return _arc(d)
+        return d
+
+    def index(self, station):
+        """ Índice de una estación por nombre """
+        try:
+            return self.names.index(station)
+        except ValueError:
+            raise ValueError, "Estación no encontrada: %s" % station
+
+    def _point(self, station):
+        if type(station) == tuple:
+            return self._points(np.array([station[0]]),
+                                np.array([station[1]]))[0], None
+        i = self.index(station)
+        return self.tree.data[i], i
+
+    def nearest(self, station, k=1, same_basin=False, max_dist=np.inf):
+        """ k estaciones más cercanas
+        @param station: Nombre de la estación (se excluye del resultado)
+            o tupla (x, y)
+        @param k: Número de estaciones
+        @param same_basin: Si es True sólo estaciones de la misma cuenca
+        @param max_dist: Distancia máxima
+        @return: (nombres, distancias) ordenados por distancia
+        @rtype: tuple
+        """
+        point, i = self._point(station)
+        n = len(self.names)
+        # Pide más vecinos hasta completar k con los filtros
+        m = min(k + 1, n)
+        while True:
+            dist, idx = self.tree.query(point, m)
+            dist = np.atleast_1d(dist)
+            idx = np.atleast_1d(idx)
+            keep = idx < n
+            if i != None:
+                keep &= idx != i
+            if same_basin and i != None:
+                keep &= np.array([self.basin[j] == self.basin[i]
+                                  for j in idx.tolist()])
+            dist = self._dist(dist)
+            keep &= dist <= max_dist
+            if keep.sum() >= k or m >= n:
+                break
+            m = min(2 * m, n)
+        sel = np.flatnonzero(keep)[:k]
+        return ([self.names[j] for j in idx[sel].tolist()],
+                dist[sel].tolist())
+
+    def within(self, station, radius):
+        """ Estaciones a distancia menor o igual a radius
+        @param station: Nombre de la estación (se incluye) o tupla (x, y)
+        @return: Lista de nombres ordenados por distancia
+        @rtype: list
+        """
+        point, i = self._point(station)
+        r = radius
+        if self.latlon:
+            r = 2 * R_EARTH * np.sin(min(radius / (2 * R_EARTH), np.pi / 2))
+        idx = self.tree.query_ball_point(point, r)
+        dist = np.sqrt(((self.tree.data[idx] - point) ** 2).sum(axis=1))
+        return [self.names[j] for j in np.asarray(idx)[np.argsort(dist)]]
+
+    def neighbors(self, names, k=4, same_basin=False, targets=None):
+        """ k vecinos de cada estación de names en una sola consulta
+        @param names: Lista de nombres de estaciones, ej. de una colección
+        @param targets: Arreglo de índices en names de las estaciones
+            consultadas, si targets=None todas
+        @return: (idx, dist) arreglos de n_consultadas x k con el índice
+            en names de cada vecino y su distancia, idx=-1 sin vecino
+        @rtype: tuple
+        """
+        rows = np.array([self.index(name) for name in names], dtype=int)
+        n = len(rows)
+        if targets is None:
+            targets = np.arange(n)
+        targets = np.asarray(targets, dtype=int)
+        out_i = -np.ones((len(targets), k), dtype=int)
+        out_d = np.full((len(targets), k), np.inf)
+        if same_basin:
+            groups = {}
+            for i, row in enumerate(rows.tolist()):
+                groups.setdefault(self.basin[row], []).append(i)
+            groups = groups.values()
+        else:
+            groups = [range(n)]
+        for members in groups:
+            members = np.array(members, dtype=int)
+            m = min(k + 1, len(members))
+            sel = np.flatnonzero(np.in1d(targets, members))
+            if m < 2 or len(sel) == 0:
+                continue
+            pos = np.searchsorted(members, targets[sel])
+            points = self.tree.data[rows[members]]
+            dist, idx = cKDTree(points).query(points[pos], m)
+            # Quita la misma estación, queda al final de cada fila
+            rx = pos[:, np.newaxis]
+            cx = np.arange(len(sel))[:, np.newaxis]
+            # Empates de distancia ordenados por índice
+            order = np.lexsort((idx, dist, idx == rx))[..., :m-1]
+            idx = idx[cx, order]
+            dist = dist[cx, order]
+            out_i[sel, :m-1] = members[idx]
+            out_d[sel, :m-1] = self._dist(dist)
+        return out_i, out_d
+
+# Lee metadatos de una hoja excel
+def stations_xls(archivo,nsheet=0,latlon=False):
+    """ Lee metadatos de estaciones de una hoja excel con columnas
+    NAME, X, Y y opcionales Z, BASIN, ID (1era fila etiquetas)
+    @param archivo: Archivo excel
+    @param nsheet: Indice de la hoja del archivo excel
+    @return: Tabla de estaciones
+    @rtype: Stations
+    """
+    book = xlrd.open_workbook(archivo)
+    if not 0 <= nsheet < book.nsheets:
+        raise ValueError, "nsheet fuera de rango"
+    sheet = book.sheet_by_index(nsheet)
+    label = [str(val).upper() for val in sheet.row_values(0)]
+    cols = {}
+    for key in ['NAME', 'X', 'Y', 'Z', 'BASIN', 'ID']:
+        if key in label:
+            cols[key] = sheet.col_values(label.index(key), 1)
+    for key in ['NAME', 'X', 'Y']:
+        if key not in cols:
+            raise ValueError, "Falta columna %s" % key
+    z = cols.get('Z')
+    if z != None:
+        z = [np.nan if val == '' else val for val in z]
+    return Stations(cols['NAME'], cols['X'], cols['Y'], z,
+                    cols.get('BASIN'), cols.get('ID'), latlon)
+
+# Relleno con distancia inversa
+def idw_fill(stations,names_data,*args,**kwargs):
+    """ Rellena datos faltantes de cada estación con el promedio de
+    las k estaciones más cercanas con dato en el mismo año y mes,
+    ponderado por 1 / distancia**power. Vectorizado sobre todos los
+    datos faltantes y todas las estaciones.
+    @param stations: Tabla de estaciones con las estaciones de names_data
+    @param names_data: Lista con nombre de las estaciones
+        correspondientes a las matrices de datos, [name1, ... ,nameN]
+    @param args: Matrices de datos, matriz_datos1, ... ,matriz_datosN,
+        o una colección de estaciones (ver stack_data)
+    @keyword k: Número de vecinos (4)
+    @keyword power: Exponente de la distancia (2)
+    @keyword same_basin: Si es True sólo vecinos de la misma cuenca
+    @keyword max_neighbors: Máximo de vecinos revisados por estación
+        para completar k vecinos con dato (10 * k)
+    @return: Colección de estaciones rellenada si args es una colección,
+        si no lista de matrices de datos rellenadas
+    @rtype: tuple o list
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = hidro_data.from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> st = Stations(['a', 'b'], [0.0, 1.0], [0.0, 0.0])
+    >>> a_r, b_r = idw_fill(st, ['a', 'b'], a, b)
+    >>> b[1][1][3], b_r[1][1][3], a[1][1][3]
+    (u'', 5.1, 5.1)
+    >>> a_r[0] == a[0], b_r[1][3][3] # 1953 sin dato en a
+    (True, '')
+    >>> yrs = [1950.0, 1951.0]
+    >>> x = np.arange(1.0, 25.0).reshape(2, 12)
+    >>> v = [x.copy(), 2 * x, 3 * x, 4 * x]
+    >>> v[0][0, 0] = v[1][0, 0] = np.nan # Vecino más cercano sin dato
+    >>> c = stack_data(['a', 'b', 'c', 'd'],
+    ...                *[from_array(yrs, vi, a[2]) for vi in v])
+    >>> st = Stations(['a', 'b', 'c', 'd'], np.array([0.0, 1.0, 2.0, 0.0]),
+    ...               np.array([0.0, 0.0, 0.0, 4.0]), z=np.ones(4))
+    >>> idw_fill(st, None, c, k=1)[2][:2, 0, 0].tolist()
+    [3.0, 3.0]
+    >>> round(idw_fill(st, None, c, k=2)[2][0, 0, 0], 4) # c y d
+    3.2
+    >>> st = Stations(['a', 'b', 'c', 'd'], [0.0, 1.0, 0.0, 0.0],
+    ...               [0.0, 0.0, 0.0, 4.0])
+    >>> idw_fill(st, None, c, k=2)[2][0, 0, 0] # c en la misma ubicación
+    3.0
+    """
+    k = kwargs.get('k', 4)
+    power = kwargs.get('power', 2)
+    same_basin = kwargs.get('same_basin', False)
+    max_nb = kwargs.get('max_neighbors', 10 * k)
+    is_col = len(args) == 1 and is_stack(args[0])
+    if is_col:
+        stack = args[0]
+    else:
+        stack = stack_data(names_data, *args)
+    names, yrs_data, valores, label_data = stack
+    lost = np.isnan(valores)
+    shape = (len(names),) + valores.shape[1:]
+    count = np.zeros(shape, dtype=int)
+    sw = np.zeros(shape)
+    s_wv = np.zeros(shape)
+    # Vecinos en la misma ubicación, se usa su dato directamente
+    n_0 = np.zeros(shape, dtype=int)
+    s_0 = np.zeros(shape)
+    # Se piden k vecinos y se duplica el número sólo para las estaciones
+    # con datos faltantes que aún no tienen k vecinos con dato
+    pending = np.flatnonzero(lost.reshape(len(names), -1).any(axis=1))
+    m_max = min(max_nb, len(names) - 1)
+    m = min(k, m_max)
+    while len(pending) > 0 and m > 0:
+        idx, dist = stations.neighbors(names, m, same_basin, pending)
+        d = dist[:, :, np.newaxis, np.newaxis]
+        donor = valores[np.maximum(idx, 0)]     # n_est x m x n_años x n_col
+        valid = ((idx >= 0)[:, :, np.newaxis, np.newaxis] & ~np.isnan(donor) &
+                 lost[pending][:, np.newaxis])
+        # Los primeros k vecinos con dato
+        use = valid & (np.cumsum(valid, axis=1) <= k)
+        at_0 = use & (d == 0)
+        with np.errstate(divide='ignore'):
+            w = np.where(use & (d > 0), 1.0 / d ** power, 0.0)
+        count[pending] = use.sum(axis=1)
+        n_0[pending] = at_0.sum(axis=1)
+        s_0[pending] = np.where(at_0, donor, 0.0).sum(axis=1)
+        sw[pending] = w.sum(axis=1)
+        s_wv[pending] = np.where(w > 0, w * donor, 0.0).sum(axis=1)
+        if m == m_max:
+            break
+        need = lost[pending] & (count[pending] < k)
+        pending = pending[need.reshape(len(pending), -1).any(axis=1)]
+        m = min(2 * m, m_max)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        est = np.where(n_0 > 0, s_0 / n_0, s_wv / sw)
+    filled = np.where(lost & (count > 0), est, valores)
+    if is_col:
+        return names, yrs_data, filled, label_data
+    res = []
+    for i, data in enumerate(args):
+        rows = np.searchsorted(yrs_data, to_array(data)[0])
+        res.append(from_array(yrs_data[rows], filled[i, rows], label_data))
+    return res
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_period.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Índice de sumas acumuladas para consultas de volumen y caudal medio
+   en períodos arbitrarios.
+
+   Los caudales mensuales se ordenan en un eje continuo de meses
+   (mes = año * 12 + número de mes - 1, ver month_id). El índice guarda
+   las sumas acumuladas de caudal, caudal x segundos del mes y número de
+   datos válidos, cada consulta [mes_inicio, mes_fin] se responde con dos
+   lecturas, sin importar el largo del período.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import numpy as np
+from hidro_data import days_in, is_stack, month_axis, to_array
+
+# Número de mes en el eje continuo
+def month_id(year,month):
+    """ Número de mes continuo, year * 12 + month - 1
+    @param year: Año o arreglo de años
+    @param month: Mes (1 ... 12) o arreglo de meses
+    @return: Número de mes o arreglo de números de mes
+    @rtype: int o numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> month_id(1950, 1), month_id(1950, 12) + 1 == month_id(1951, 1)
+    (23400, True)
+    """
+    return (np.asarray(year, dtype='int64') * 12 +
+            np.asarray(month, dtype='int64') - 1)
+
+# Períodos estacionales
+def seasonal(yrs,mes_ini,mes_fin):
+    """ Períodos entre mes_ini y mes_fin de cada año, si mes_fin < mes_ini
+    el período termina el año siguiente (ej. OCT a MAR)
+    @param yrs: Lista o arreglo de años de inicio
+    @param mes_ini: Mes de inicio (1 ... 12)
+    @param mes_fin: Mes de término (1 ... 12)
+    @return: (start, end) arreglos de números de mes (ver month_id)
+    @rtype: tuple
+    """
+    start = month_id(yrs, mes_ini)
+    return start, start + (mes_fin - mes_ini) % 12
+
+# Índice de sumas acumuladas
+class PeriodIndex(object):
+    """ Índice de sumas acumuladas de caudales mensuales de una estación
+    o de una colección de estaciones (ver stack_data)
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> idx = PeriodIndex(a)
+    >>> start, end = seasonal([1950, 1951, 1952], 1, 12)
+    >>> np.round(idx.vol(start, end), 4).tolist() # Igual a vol_yr
+    [208.9584, 240.4944, nan]
+    >>> np.round(idx.complete(start, end), 4).tolist()
+    [1.0, 1.0, 0.25]
+    >>> np.round(idx.mean(*seasonal([1950, 1951], 10, 3)), 4).tolist() # OCT a MAR
+    [7.1, 8.1]
+    >>> idx.vol(month_id(1950, 1), month_id(1951, 6)).shape # 18 meses
+    ()
+    >>> b = hidro_data.from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> idx = PeriodIndex(hidro_data.stack_data(['a', 'b'], a, b))
+    >>> idx.sum(start, end).shape
+    (2, 3)
+    """
+    def __init__(self, data):
+        """
+        @param data: Matriz de datos mensuales o colección de estaciones,
+            se aceptan años hidrológicos (ver hidro_yr)
+        """
+        if is_stack(data):
+            yrs_data, valores, label_data = data[1], data[2], data[3]
+            self.is_multi = True
+        else:
+            yrs_data, valores, label_data = to_array(data)
+            valores = valores[np.newaxis]
+            self.is_multi = False
+        try:
+            months = month_axis(yrs_data, label_data)
+        except KeyError:
+            raise ValueError, "Etiquetas de datos no son meses"
+        ids = months.astype('int64') + 1970 * 12
+        self.first = int(ids.min())
+        n = int(ids.max()) - self.first + 1
+        series = np.empty((valores.shape[0], n), dtype='float64')
+        series.fill(np.nan)
+        series[:, (ids - self.first).ravel()] = valores.reshape(
+            valores.shape[0], -1)
+        valid = ~np.isnan(series)
+        # Segundos de cada mes, considerando años bisiestos
+        months = (np.arange(self.first, self.first + n) -
+                  1970 * 12).astype('datetime64[M]')
+        seconds = days_in(months) * (60 * 60 * 24.0)
+        self.n_months = n
+        self.cum_q = self._cum(np.where(valid, series, 0.0))
+        self.cum_v = self._cum(np.where(valid, series * seconds, 0.0))
+        self.cum_n = self._cum(valid)
+
+    def _cum(self, x):
+        cum = np.zeros((x.shape[0], x.shape[1] + 1), dtype='float64')
+        np.cumsum(x, axis=1, out=cum[:, 1:])
+        return cum
+
+    def _query(self, cum, start, end):
+        """ Suma de cum entre start y end (inclusive), fuera del índice
+        no hay datos """
+        start = np.asarray(start, dtype='int64')
+        end = np.asarray(end, dtype='int64')
+        if (end < start).any():
+            raise ValueError, "Período con fin anterior al inicio"
+        ini = np.clip(start - self.first, 0, self.n_months)
+        fin = np.clip(end - self.first + 1, 0, self.n_months)
+        return cum[:, fin] - cum[:, ini]
+
+    def _out(self, res):
+        if self.is_multi:
+            return res
+        return res[0]
+
+    def count(self, start, end):
+        """ Número de datos válidos de cada período
+        @param start: Número de mes de inicio o arreglo (ver month_id)
+        @param end: Número de mes de término o arreglo, inclusive
+        @return: Arreglo con forma de start (n_estaciones x ... si el
+            índice es de una colección)
+        @rtype: numpy.ndarray
+        """
+        return self._out(self._query(self.cum_n, start, end))
+
+    def complete(self, start, end):
+        """ Fracción de meses con datos de cada período (1.0 completo) """
+        n = np.asarray(end) - np.asarray(start) + 1
+        return self.count(start, end) / n
+
+    def sum(self, start, end, partial=False):
+        """ Suma de caudales de cada período
+        @param partial: Si es False los períodos incompletos son NaN,
+            si es True suma los datos válidos
+        """
+        res = self._query(self.cum_q, start, end)
+        return self._out(self._partial(res, start, end, partial))
+
+    def vol(self, start, end, partial=False):
+        """ Volumen en MMm3 de cada período (ver vol_yr)
+        @param partial: Si es False los períodos incompletos son NaN,
+            si es True suma los datos válidos
+        """
+        res = self._query(self.cum_v, start, end) / 1.0e6
+        return self._out(self._partial(res, start, end, partial))
+
+    def mean(self, start, end):
+        """ Caudal medio de los datos válidos de cada período, NaN si no
+        hay datos """
+        n = self._query(self.cum_n, start, end)
+        res = self._query(self.cum_q, start, end)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            res = np.where(n > 0, res / n, np.nan)
+        return self._out(res)
+
+    def _partial(self, res, start, end, partial):
+        if partial:
+            return res
+        n = np.asarray(end) - np.asarray(start) + 1
+        return np.where(self._query(self.cum_n, start, end) == n, res, np.nan)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
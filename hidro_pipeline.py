@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_pipeline.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Procesamiento por lotes de estaciones con checkpoints por etapa.
+
+   Uso::
+       python -m hidro_data [-w WORKERS] [-f] config.ini
+
+   Archivo de configuración::
+       [pipeline]
+       input = datos/*.xls          ; Planillas, una estación por archivo
+       nsheet = 0
+       output = salida/
+       checkpoints = salida/checkpoints   ; Opcional
+       workers = 4
+       stages = hidro_yr, fill_data, vol_yr, yrs_type, to_xls, plot_vol
+
+       [hidro_yr]
+       estiaje = 4
+
+       [fill_data]
+       donor = datos/donante.xls    ; Opcional, estación para regresión
+
+       [yrs_type]
+       vol_hi = 250.0               ; Opcional, por defecto cuartiles
+       vol_low = 200.0
+
+       [plot_vol]
+       cache = salida/figuras       ; Opcional, cache de figuras (también
+                                    ; en [plot_q], ver hidro_data.plot_q)
+
+   Cada estación guarda un checkpoint después de cada etapa. La clave de un
+   checkpoint depende de la planilla de entrada (ruta, fecha de modificación
+   y tamaño), de los parámetros de la etapa y de las etapas anteriores, por
+   lo que al volver a ejecutar sólo se recalculan las etapas y estaciones
+   cuyas entradas cambiaron o cuyos archivos de salida no existen.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import ConfigParser
+import glob
+import hashlib
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+import cPickle as pickle
+import hidro_data
+
+CHECKPOINT_VERSION = 2
+
+# Etapas, cada una modifica el estado de la estación y retorna la lista
+# de archivos de salida que genera
+def _stage_load(state,params,station):
+    state['data'] = hidro_data.from_xls(station['file'], station['nsheet'])
+
+def _stage_hidro_yr(state,params,station):
+    estiaje = int(params.get('estiaje', 4))
+    state['data'] = hidro_data.hidro_yr(state['data'], estiaje)
+
+def _stage_fill_data(state,params,station):
+    donor = None
+    if params.get('donor'):
+        donor = hidro_data.from_xls(params['donor'],
+                                    int(params.get('donor_nsheet', 0)))
+    state['data'] = hidro_data.fill_data(state['data'], donor)
+
+def _stage_vol_yr(state,params,station):
+    state['vol'] = hidro_data.vol_yr(state['data'])
+
+def _stage_yrs_type(state,params,station):
+    vol_hi = params.get('vol_hi')
+    vol_low = params.get('vol_low')
+    if vol_hi != None:
+        vol_hi = float(vol_hi)
+    if vol_low != None:
+        vol_low = float(vol_low)
+    state['yrs_type'] = hidro_data.yrs_type(state['vol'], vol_hi, vol_low)
+
+def _stage_to_xls(state,params,station):
+    path = os.path.join(station['output'], station['name'])
+    files = ['%s.xls' % path]
+    hidro_data.to_xls(state['data'], files[0])
+    if 'vol' in state:
+        files.append('%s_vol.xls' % path)
+        hidro_data.to_xls(state['vol'], files[1])
+    return files
+
+def _stage_plot_q(state,params,station):
+    hidro_data.plot_q(state['data'], name_fig=station['name'],
+                      path_fig=station['output'] + os.sep,
+                      cache=params.get('cache'))
+    return [os.path.join(station['output'], '%s.png' % station['name'])]
+
+def _stage_plot_vol(state,params,station):
+    hidro_data.plot_vol(state['vol'], name_fig='%s_vol' % station['name'],
+                        path_fig=station['output'] + os.sep,
+                        is_data_vol=True, cache=params.get('cache'))
+    return [os.path.join(station['output'], '%s_vol.png' % station['name'])]
+
+# Archivos externos que afectan el resultado de una etapa
+def _file_key(archivo):
+    stat = os.stat(archivo)
+    return '%s:%r:%d' % (os.path.abspath(archivo), stat.st_mtime,
+                         stat.st_size)
+
+def _stage_keys(station,stages,params):
+    """ Claves de checkpoint de cada etapa, encadenadas con la anterior """
+    key = '%d:%s:%d' % (CHECKPOINT_VERSION, _file_key(station['file']),
+                        station['nsheet'])
+    keys = []
+    for stage in stages:
+        stage_params = params.get(stage, {})
+        extra = ''
+        if stage_params.get('donor'):
+            extra = _file_key(stage_params['donor'])
+        key = hashlib.md5('%s|%s|%r|%s' % (key, stage,
+                          sorted(stage_params.items()), extra)).hexdigest()
+        keys.append(key)
+    return keys
+
+def _checkpoint_file(station,stage):
+    return os.path.join(station['checkpoints'], station['name'],
+                        '%s.pkl' % stage)
+
+def _read_checkpoint(station,stage,key):
+    """ Retorna (estado, salidas) guardados si la clave coincide y existen
+    los archivos de salida de la etapa y las anteriores, si no None """
+    try:
+        f = open(_checkpoint_file(station, stage), 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            key_saved, state, outputs = pickle.load(f)
+        except Exception:
+            return None
+    finally:
+        f.close()
+    if key_saved != key:
+        return None
+    for files in outputs.values():
+        for archivo in files:
+            if not os.path.exists(archivo):
+                return None
+    return state, outputs
+
+def _write_checkpoint(station,stage,key,state,outputs):
+    archivo = _checkpoint_file(station, stage)
+    if not os.path.isdir(os.path.dirname(archivo)):
+        os.makedirs(os.path.dirname(archivo))
+    f = open(archivo + '.tmp', 'wb')
+    try:
+        pickle.dump((key, state, outputs), f, pickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    os.rename(archivo + '.tmp', archivo)
+
+# Procesa todas las etapas de una estación
+def run_station(args):
+    """ Ejecuta las etapas de una estación partiendo del último
+    checkpoint válido.
+    @param args: (station, stages, params, force)
+    @return: (nombre, tiempos, error) con tiempos dict etapa: segundos
+        (None si se usó el checkpoint) y error None o mensaje de error
+    @rtype: tuple
+    """
+    station, stages, params, force = args
+    times = {}
+    try:
+        keys = _stage_keys(station, stages, params)
+        # Último checkpoint válido
+        saved = None
+        start = 0
+        if not force:
+            for i in range(len(stages) - 1, -1, -1):
+                saved = _read_checkpoint(station, stages[i], keys[i])
+                if saved != None:
+                    start = i + 1
+                    break
+        if saved == None:
+            saved = {}, {}
+        state, outputs = saved
+        for stage in stages[:start]:
+            times[stage] = None
+        for i in range(start, len(stages)):
+            t0 = time.time()
+            files = STAGE_FN[stages[i]](state, params.get(stages[i], {}),
+                                        station)
+            outputs[stages[i]] = files or []
+            _write_checkpoint(station, stages[i], keys[i], state, outputs)
+            times[stages[i]] = time.time() - t0
+    except Exception, e:
+        return station['name'], times, '%s: %s' % (type(e).__name__, e)
+    return station['name'], times, None
+
+STAGE_FN = {'load': _stage_load, 'hidro_yr': _stage_hidro_yr,
+            'fill_data': _stage_fill_data, 'vol_yr': _stage_vol_yr,
+            'yrs_type': _stage_yrs_type, 'to_xls': _stage_to_xls,
+            'plot_q': _stage_plot_q, 'plot_vol': _stage_plot_vol}
+
+# Lee el archivo de configuración
+def read_config(config_file):
+    """ Lee el archivo de configuración del pipeline
+    @param config_file: Archivo de configuración (formato ini)
+    @return: (stations, stages, params, workers)
+    @rtype: tuple
+    """
+    config = ConfigParser.SafeConfigParser()
+    if config.read(config_file) == []:
+        raise IOError, "No se pudo leer %s" % config_file
+    if not config.has_section('pipeline'):
+        raise ValueError, "Falta sección [pipeline]"
+    base = os.path.dirname(os.path.abspath(config_file))
+    def get(option, default=None):
+        if config.has_option('pipeline', option):
+            return config.get('pipeline', option)
+        return default
+    if get('input') == None:
+        raise ValueError, "Falta opción input"
+    output = os.path.join(base, get('output', '.'))
+    checkpoints = os.path.join(base, get('checkpoints',
+                                         os.path.join(output, 'checkpoints')))
+    stages = ['load']
+    for stage in get('stages', '').split(','):
+        stage = stage.strip()
+        if stage == '':
+            continue
+        if stage not in STAGE_FN or stage == 'load':
+            raise ValueError, "Etapa no válida: %s" % stage
+        stages.append(stage)
+    params = {}
+    for stage in stages:
+        if config.has_section(stage):
+            params[stage] = dict(config.items(stage))
+            for option in ['donor', 'cache']:
+                if params[stage].get(option):
+                    params[stage][option] = os.path.join(
+                        base, params[stage][option])
+    nsheet = int(get('nsheet', 0))
+    stations = []
+    for archivo in sorted(glob.glob(os.path.join(base, get('input')))):
+        stations.append({'name': os.path.splitext(os.path.basename(archivo))[0],
+                         'file': archivo, 'nsheet': nsheet,
+                         'output': output, 'checkpoints': checkpoints})
+    return stations, stages, params, int(get('workers', 1))
+
+# Ejecuta el pipeline
+def run(config_file,workers=None,force=False,out=sys.stdout):
+    """ Ejecuta el pipeline definido en un archivo de configuración sobre
+    todas las estaciones con un pool de procesos.
+    @param config_file: Archivo de configuración (ver módulo)
+    @param workers: Número de procesos, si workers=None usa el de la
+        configuración
+    @param force: Si es True no usa checkpoints
+    @param out: Archivo donde se escribe el reporte, None no escribe
+    @return: (report, errors) con report dict etapa: (calculadas,
+        desde checkpoint, segundos) y errors lista de (estación, mensaje)
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> shutil.copy('data_test.xls', tmp)
+    >>> config = os.path.join(tmp, 'config.ini')
+    >>> f = open(config, 'w')
+    >>> f.write('[pipeline]\\ninput = *.xls\\nnsheet = 3\\noutput = out\\n'
+    ...         'stages = hidro_yr, fill_data, vol_yr, yrs_type, to_xls\\n')
+    >>> f.close()
+    >>> report, errors = run(config, out=None)
+    >>> errors, report['vol_yr'][:2]
+    ([], (1, 0))
+    >>> sorted(os.listdir(os.path.join(tmp, 'out')))
+    ['checkpoints', 'data_test.xls', 'data_test_vol.xls']
+    >>> report, errors = run(config, out=None) # Todo desde checkpoints
+    >>> report['vol_yr'][:2], report['to_xls'][:2]
+    ((0, 1), (0, 1))
+    >>> os.remove(os.path.join(tmp, 'out', 'data_test_vol.xls'))
+    >>> report, errors = run(config, out=None) # Regenera salidas borradas
+    >>> report['yrs_type'][:2], report['to_xls'][:2]
+    ((0, 1), (1, 0))
+    >>> os.path.exists(os.path.join(tmp, 'out', 'data_test_vol.xls'))
+    True
+    >>> f = open(config, 'a')
+    >>> f.write('[yrs_type]\\nvol_hi = 250.0\\nvol_low = 200.0\\n')
+    >>> f.close()
+    >>> report, errors = run(config, out=None) # Cambia yrs_type
+    >>> report['vol_yr'][:2], report['yrs_type'][:2]
+    ((0, 1), (1, 0))
+    >>> shutil.rmtree(tmp)
+    """
+    stations, stages, params, workers_cfg = read_config(config_file)
+    if workers == None:
+        workers = workers_cfg
+    if stations != [] and not os.path.isdir(stations[0]['output']):
+        os.makedirs(stations[0]['output'])
+    tasks = [(station, stages, params, force) for station in stations]
+    t0 = time.time()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(run_station, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [run_station(task) for task in tasks]
+    report = {}
+    for stage in stages:
+        report[stage] = (0, 0, 0.0)
+    errors = []
+    for name, times, error in results:
+        for stage, seconds in times.items():
+            computed, cached, total = report[stage]
+            if seconds == None:
+                report[stage] = (computed, cached + 1, total)
+            else:
+                report[stage] = (computed + 1, cached, total + seconds)
+        if error != None:
+            errors.append((name, error))
+    if out != None:
+        out.write('%-12s %10s %10s %10s\n' % ('Etapa', 'Calculadas',
+                                              'Checkpoint', 'Tiempo[s]'))
+        for stage in stages:
+            out.write('%-12s %10d %10d %10.3f\n' % ((stage,) + report[stage]))
+        out.write('%d estaciones, %d errores, %.3f s\n' %
+                  (len(stations), len(errors), time.time() - t0))
+        for name, error in errors:
+            out.write('%s: %s\n' % (name, error))
+    return report, errors
+
+def main(argv):
+    """ Punto de entrada de línea de comandos, retorna el código de salida """
+    parser = optparse.OptionParser(usage='python -m hidro_data [opciones] '
+                                         'config.ini')
+    parser.add_option('-w', '--workers', type='int', default=None,
+                      help=u'número de procesos')
+    parser.add_option('-f', '--force', action='store_true', default=False,
+                      help=u'recalcula todas las etapas')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('se requiere un archivo de configuración')
+    report, errors = run(args[0], options.workers, options.force)
+    if errors != []:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
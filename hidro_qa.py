@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_qa.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Control de calidad vectorizado de caudales mensuales.
+
+   qa_flags revisa una matriz de datos o una colección de estaciones
+   (ver stack_data) y entrega un arreglo de flags uint8 alineado con los
+   valores, cada revisión es un bit (FLAG_*). Con index_lost, fill_data_s
+   y fill_data (parámetro flags) los datos con flag se tratan como
+   faltantes.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import numpy as np
+from hidro_data import is_stack, mask_flags, to_array
+
+FLAG_BOUNDS = 1     # Fuera de límites físicos (ej. caudal negativo)
+FLAG_OUTLIER = 2    # Fuera de rango del mes (z-score o IQR)
+FLAG_SPIKE = 4      # Pico respecto a los meses vecinos
+FLAG_FLAT = 8       # Valor repetido en meses consecutivos
+
+FLAG_NAMES = {FLAG_BOUNDS: 'bounds', FLAG_OUTLIER: 'outlier',
+              FLAG_SPIKE: 'spike', FLAG_FLAT: 'flat'}
+
+def _values(data):
+    """ Valores de n_estaciones x n_años x n_columnas """
+    if is_stack(data):
+        return data[2], True
+    return to_array(data)[1][np.newaxis], False
+
+def _bounds(x,low,high):
+    with np.errstate(invalid='ignore'):
+        out = np.zeros(x.shape, dtype=bool)
+        if low != None:
+            out |= x < low
+        if high != None:
+            out |= x > high
+    return out
+
+def _outlier(x,method,k,z):
+    """ Outliers por columna (mes) de cada estación, sobre los años """
+    with np.errstate(invalid='ignore'):
+        if method == 'zscore':
+            mu = np.nanmean(x, axis=1)[:, np.newaxis]
+            sd = np.nanstd(x, axis=1, ddof=1)[:, np.newaxis]
+            return np.abs(x - mu) > z * sd
+        if method == 'iqr':
+            q1, q3 = np.nanpercentile(x, [25, 75], axis=1)
+            iqr = (q3 - q1)[:, np.newaxis]
+            return ((x < q1[:, np.newaxis] - k * iqr) |
+                    (x > q3[:, np.newaxis] + k * iqr))
+    raise ValueError, "method no válido"
+
+def _spike(s,spike):
+    """ Picos en series continuas de n_estaciones x n_datos """
+    out = np.zeros(s.shape, dtype=bool)
+    prev = s[:, :-2]
+    cur = s[:, 1:-1]
+    nxt = s[:, 2:]
+    with np.errstate(invalid='ignore'):
+        hi = np.fmax(prev, nxt)
+        lo = np.fmin(prev, nxt)
+        out[:, 1:-1] = (((cur > spike * hi) & (hi > 0)) |
+                        ((cur * spike < lo) & (cur >= 0)))
+    # Requiere ambos vecinos con dato
+    out[:, 1:-1] &= ~np.isnan(prev) & ~np.isnan(nxt)
+    return out
+
+def _flat(s,n_flat,flat_zero):
+    """ Tramos de n_flat o más datos iguales consecutivos """
+    n = s.shape[1]
+    same = np.zeros(s.shape, dtype=bool)
+    same[:, 1:] = s[:, 1:] == s[:, :-1]
+    # Número de tramo de cada dato, un tramo nuevo donde cambia el valor
+    run = np.cumsum(~same, axis=1) + np.arange(s.shape[0])[:, np.newaxis] * n
+    length = np.bincount(run.ravel(), minlength=s.size)[run]
+    out = (length >= n_flat) & ~np.isnan(s)
+    if not flat_zero:
+        out &= s != 0
+    return out
+
+# Flags de control de calidad
+def qa_flags(data,low=0.0,high=None,method='iqr',k=3.0,z=3.5,spike=5.0,
+             n_flat=4,flat_zero=False,checks=None):
+    """ Revisa los datos y entrega flags de control de calidad
+    @param data: Matriz de datos mensuales o colección de estaciones
+    @param low: Límite inferior físico, si low=None no se revisa
+    @param high: Límite superior físico, si high=None no se revisa
+    @param method: Outliers por mes con 'iqr' (fuera de
+        [Q1 - k IQR, Q3 + k IQR]) o 'zscore' (|x - media| > z desv. est.)
+    @param spike: Pico si el dato es mayor a spike veces el mayor de sus
+        vecinos, o menor al menor de sus vecinos dividido por spike
+    @param n_flat: Largo mínimo de tramos de valores repetidos
+    @param flat_zero: Si es True también marca tramos de caudal 0
+    @param checks: Suma de FLAG_* a revisar, si checks=None todas
+    @return: Arreglo uint8 de n_años x n_columnas (n_estaciones x
+        n_años x n_columnas si data es una colección), 0 sin problemas
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> a[1][1][4] = -1.0
+    >>> a[1][0][6] = 80.0
+    >>> flags = qa_flags(a)
+    >>> np.argwhere(flags).tolist(), flags[1, 4], flags[0, 6]
+    ([[0, 6], [1, 4]], 1, 4)
+    >>> hidro_data.index_lost(a, flags=flags)[:2]
+    [[1950.0, 6], [1951.0, 4]]
+    >>> hidro_data.fill_data_s(a, flags=flags)[1][0][6]
+    7.1
+    >>> c = hidro_data.stack_data(['a', 'a2'], a, a)
+    >>> qa_count(qa_flags(c))['bounds'].tolist()
+    [1, 1]
+    >>> f = hidro_data.from_array([1950.0], [[1.0, 2.0, 2.0, 2.0, 2.0, 3.0]],
+    ...                           a[2][:7])
+    >>> qa_flags(f, checks=FLAG_FLAT).tolist()
+    [[0, 8, 8, 8, 8, 0]]
+    """
+    if checks == None:
+        checks = FLAG_BOUNDS | FLAG_OUTLIER | FLAG_SPIKE | FLAG_FLAT
+    x, is_multi = _values(data)
+    x = np.asarray(x, dtype='float64')
+    flags = np.zeros(x.shape, dtype='uint8')
+    s = x.reshape(x.shape[0], -1)   # Series leídas año por año
+    if checks & FLAG_BOUNDS:
+        flags[_bounds(x, low, high)] |= FLAG_BOUNDS
+    if checks & FLAG_OUTLIER:
+        flags[_outlier(x, method, k, z)] |= FLAG_OUTLIER
+    if checks & FLAG_SPIKE:
+        flags[_spike(s, spike).reshape(x.shape)] |= FLAG_SPIKE
+    if checks & FLAG_FLAT:
+        flags[_flat(s, n_flat, flat_zero).reshape(x.shape)] |= FLAG_FLAT
+    if is_multi:
+        return flags
+    return flags[0]
+
+# Datos con flag como faltantes
+def apply_flags(data,flags,mask=None):
+    """ Reemplaza los datos con flag por datos faltantes
+    @param data: Matriz de datos o colección de estaciones
+    @param flags: Flags de qa_flags
+    @param mask: Suma de FLAG_* a considerar, si mask=None todas
+    @return: Matriz de datos ('' en datos con flag) o colección de
+        estaciones (NaN en datos con flag)
+    @rtype: Matriz de datos o tuple
+    """
+    flags = np.asarray(flags)
+    if mask != None:
+        flags = flags & mask
+    if is_stack(data):
+        names, yrs_data, valores, label_data = data
+        return (names, yrs_data, np.where(flags != 0, np.nan, valores),
+                label_data)
+    return mask_flags(data, flags)
+
+# Resumen de flags
+def qa_count(flags):
+    """ Número de datos con cada flag
+    @param flags: Flags de qa_flags
+    @return: Diccionario {nombre flag: número de datos}, arreglos por
+        estación si flags es de una colección
+    @rtype: dict
+    """
+    flags = np.asarray(flags)
+    axis = tuple(range(1, flags.ndim)) if flags.ndim == 3 else None
+    return dict((name, (flags & flag != 0).sum(axis=axis))
+                for flag, name in FLAG_NAMES.items())
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_reg.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Regresión lineal incremental entre 2 estaciones con validación
+   cruzada.
+
+   Para cada año concurrente se guardan las sumas
+   (n, Sx, Sy, Sxx, Sxy, Syy) de los datos del año. Los parámetros de
+   la regresión se calculan sólo con las sumas totales, así agregar o
+   quitar un año es O(1) y la validación cruzada dejando fuera un año
+   (o un grupo de años) se calcula para todos los años a la vez.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import numpy as np
+from scipy import stats
+from hidro_data import to_array, yr_concurrent
+
+TINY = 1.0e-20
+
+def _rows(yrs,yr_conc):
+    """ Filas de yrs de cada año de yr_conc, yrs ordenado """
+    yrs = np.asarray(yrs)
+    if (np.diff(yrs) <= 0).any():
+        raise ValueError, "Años de la matriz de datos no ordenados"
+    rows = np.searchsorted(yrs, yr_conc)
+    found = rows < len(yrs)
+    found[found] = yrs[rows[found]] == np.asarray(yr_conc)[found]
+    if not found.all():
+        missing = np.asarray(yr_conc)[~found].tolist()
+        raise ValueError, "Años no encontrados: %s" % missing
+    return rows
+
+# Sumas por año de 2 matrices de datos
+def yr_sums(data1,data2,yr_conc=None):
+    """ Sumas (n, Sx, Sy, Sxx, Sxy, Syy) por año de los datos
+    concurrentes, x de data1 e y de data2 como en lin_reg
+    @param data1: Matriz de datos
+    @param data2: Matriz de datos
+    @param yr_conc: Lista de años concurrentes, si yr_conc=None utiliza
+        todos los años concurrentes disponibles (ver yr_concurrent)
+    @return: (yrs_data, sums) con sums arreglo de n_años x 6
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> yrs, sums = yr_sums(a, a, [1950.0, 1951.0])
+    >>> yrs, sums.shape
+    ([1950.0, 1951.0], (2, 6))
+    >>> yr_sums(a, a, [1950.0, 1949.5, 1953.0]) # Años sin datos
+    Traceback (most recent call last):
+    ...
+    ValueError: Años no encontrados: [1949.5, 1953.0]
+    """
+    if yr_conc == None:
+        yr_conc = yr_concurrent(data1, data2)
+    yrs1, x, label1 = to_array(data1)
+    yrs2, y, label2 = to_array(data2)
+    x = x[_rows(yrs1, yr_conc)]
+    y = y[_rows(yrs2, yr_conc)]
+    if np.isnan(x).any() or np.isnan(y).any():
+        raise ValueError, "yr_conc incluye años con datos faltantes"
+    sums = np.column_stack((np.repeat(float(x.shape[1]), len(yr_conc)),
+                            x.sum(axis=1), y.sum(axis=1),
+                            (x * x).sum(axis=1), (x * y).sum(axis=1),
+                            (y * y).sum(axis=1)))
+    return list(yr_conc), sums
+
+# Parámetros de regresión a partir de sumas
+def reg_params(sums):
+    """ Parámetros de regresión lineal a partir de sumas totales,
+    iguales a scipy.stats.linregress
+    @param sums: Arreglo de ... x 6 con (n, Sx, Sy, Sxx, Sxy, Syy)
+    @return: Arreglo de ... x 5 con
+        (gradient, intercept, r_value, p_value, std_err)
+    @rtype: numpy.ndarray
+    """
+    sums = np.asarray(sums, dtype='float64')
+    n, sx, sy, sxx, sxy, syy = [sums[..., i] for i in range(6)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ssxm = sxx / n - (sx / n) ** 2
+        ssym = syy / n - (sy / n) ** 2
+        ssxym = sxy / n - sx * sy / n ** 2
+        r = np.clip(ssxym / np.sqrt(ssxm * ssym), -1.0, 1.0)
+        r = np.where((ssxm * ssym) == 0.0, 0.0, r)
+        df = n - 2
+        t = r * np.sqrt(df / ((1.0 - r + TINY) * (1.0 + r + TINY)))
+        p = 2 * stats.t.sf(np.abs(t), df)
+        gradient = ssxym / ssxm
+        intercept = sy / n - gradient * sx / n
+        std_err = np.sqrt((1 - r ** 2) * ssym / ssxm / df)
+    return np.stack((gradient, intercept, r, p, std_err), axis=-1)
+
+# Error cuadrático de la predicción de un año
+def _sse(sums,gradient,intercept):
+    """ Suma de (y - intercept - gradient * x)**2 a partir de sumas """
+    n, sx, sy, sxx, sxy, syy = [sums[..., i] for i in range(6)]
+    return (syy - 2 * intercept * sy - 2 * gradient * sxy +
+            intercept ** 2 * n + 2 * gradient * intercept * sx +
+            gradient ** 2 * sxx)
+
+# Regresión lineal incremental
+class LinReg(object):
+    """ Regresión lineal entre 2 matrices de datos (ver lin_reg) con
+    años que se agregan o quitan en O(1)
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> rnd = np.random.RandomState(0)
+    >>> yrs = [1950.0 + i for i in range(10)]
+    >>> label = hidro_data.from_xls('data_test.xls', 0)[2]
+    >>> x = rnd.gamma(2.0, 5.0, (10, 12))
+    >>> y = 0.8 * x + 1.0 + rnd.normal(0.0, 1.0, (10, 12))
+    >>> a = hidro_data.from_array(yrs, x, label)
+    >>> b = hidro_data.from_array(yrs, y, label)
+    >>> reg = LinReg(a, b)
+    >>> np.allclose(reg.params(), hidro_data.lin_reg(a, b))
+    True
+    >>> reg.remove(1953.0)
+    >>> yr_conc = [yr for yr in yrs if yr != 1953.0]
+    >>> np.allclose(reg.params(), hidro_data.lin_reg(a, b, yr_conc))
+    True
+    >>> reg.add(1953.0)
+    >>> yrs_cv, params, rmse = reg.loo()
+    >>> np.allclose(params[3], hidro_data.lin_reg(a, b, yr_conc))
+    True
+    >>> bool(rmse.max() < 1.5)
+    True
+    >>> folds, params, rmse = reg.kfold(5, seed=0)
+    >>> params.shape, sorted(sum(folds, [])) == yrs
+    ((5, 5), True)
+    """
+    def __init__(self, data1, data2, yr_conc=None):
+        """
+        @param data1: Matriz de datos (x)
+        @param data2: Matriz de datos (y)
+        @param yr_conc: Años concurrentes usados al inicio, si
+            yr_conc=None utiliza todos los años concurrentes
+        """
+        self.yrs, self.sums = yr_sums(data1, data2)
+        # Índice de cada año, add y remove en O(1)
+        self._rows = dict((yr, i) for i, yr in enumerate(self.yrs))
+        self.active = np.ones(len(self.yrs), dtype=bool)
+        if yr_conc != None:
+            self.active[:] = False
+            for yr in yr_conc:
+                self.active[self._iyr(yr)] = True
+        self.total = self.sums[self.active].sum(axis=0)
+
+    def _iyr(self, yr):
+        try:
+            return self._rows[yr]
+        except KeyError:
+            raise ValueError, "Año no concurrente: %s" % yr
+
+    def years(self):
+        """ Lista de años usados en la regresión """
+        return [yr for yr, act in zip(self.yrs, self.active) if act]
+
+    def add(self, yr):
+        """ Agrega un año concurrente a la regresión """
+        i = self._iyr(yr)
+        if not self.active[i]:
+            self.active[i] = True
+            self.total += self.sums[i]
+
+    def remove(self, yr):
+        """ Quita un año de la regresión """
+        i = self._iyr(yr)
+        if self.active[i]:
+            self.active[i] = False
+            self.total -= self.sums[i]
+
+    def params(self):
+        """ [gradient, intercept, r_value, p_value, std_err] como lin_reg """
+        return reg_params(self.total).tolist()
+
+    def loo(self):
+        """ Validación cruzada dejando fuera un año, para todos los años
+        usados a la vez
+        @return: (yrs_data, params, rmse) con params arreglo de
+            n_años x 5 de la regresión sin cada año y rmse el error
+            de predicción del año dejado fuera
+        @rtype: tuple
+        """
+        sums = self.sums[self.active]
+        params = reg_params(self.total - sums)
+        rmse = np.sqrt(_sse(sums, params[:, 0], params[:, 1]) / sums[:, 0])
+        return self.years(), params, rmse
+
+    def kfold(self, k=5, seed=None):
+        """ Validación cruzada con k grupos de años al azar
+        @param k: Número de grupos
+        @param seed: Semilla de números aleatorios
+        @return: (folds, params, rmse) con folds lista de años de cada
+            grupo, params arreglo de k x 5 de la regresión sin cada grupo
+            y rmse el error de predicción del grupo dejado fuera
+        @rtype: tuple
+        """
+        yrs = self.years()
+        if not 2 <= k <= len(yrs):
+            raise ValueError, "k fuera de rango"
+        sums = self.sums[self.active]
+        fold = np.random.RandomState(seed).permutation(len(yrs)) % k
+        fold_sums = np.zeros((k, 6))
+        np.add.at(fold_sums, fold, sums)
+        params = reg_params(self.total - fold_sums)
+        rmse = np.sqrt(_sse(fold_sums, params[:, 0], params[:, 1]) /
+                       fold_sums[:, 0])
+        folds = [[yr for yr, f in zip(yrs, fold) if f == i] for i in range(k)]
+        return folds, params, rmse
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
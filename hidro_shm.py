@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_shm.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Espacio de trabajo en memoria compartida para análisis con varios
+   procesos.
+
+   La colección de estaciones se copia una vez a un archivo en /dev/shm
+   (memoria compartida del sistema) y los procesos reciben sólo un
+   identificador pequeño con el que abren los valores con np.memmap,
+   sin copiarlos ni serializarlos.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import multiprocessing
+import os
+import tempfile
+import numpy as np
+from hidro_data import ArrayRows, is_stack, stack_data
+
+if os.path.isdir('/dev/shm'):
+    SHM_DIR = '/dev/shm'
+else:
+    SHM_DIR = tempfile.gettempdir()
+
+# Arreglos abiertos por este proceso, {nombre archivo: np.memmap}
+_ATTACHED = {}
+
+# Espacio de trabajo compartido
+class Workspace(object):
+    """ Colección de estaciones en memoria compartida
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = hidro_data.from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> ws = Workspace(['a', 'b'], a, b)
+    >>> h = ws.handle
+    >>> station(h, 'b')[0]
+    [1950.0, 1951.0, 1952.0, 1953.0]
+    >>> hidro_data.stad(station(h, 0)) == hidro_data.stad(a)
+    True
+    >>> ws.map(hidro_data.stad, [0, 1], workers=2) == [
+    ...     hidro_data.stad(a), hidro_data.stad(b)]
+    True
+    >>> f = ws.map(hidro_data.fill_data, [(1, 0)], workers=2)[0]
+    >>> f == hidro_data.fill_data(station(h, 1), station(h, 0))
+    True
+    >>> ws.close()
+    >>> os.path.exists(h['name'])
+    False
+    """
+    def __init__(self, names_data, *args):
+        """
+        @param names_data: Lista con nombre de las estaciones
+            correspondientes a las matrices de datos, [name1, ... ,nameN]
+        @param args: Matrices de datos, matriz_datos1, ... ,matriz_datosN,
+            o una colección de estaciones (ver stack_data)
+        """
+        if len(args) == 1 and is_stack(args[0]):
+            stack = args[0]
+        else:
+            stack = stack_data(names_data, *args)
+        fd, name = tempfile.mkstemp('.shm', 'hidro_', SHM_DIR)
+        os.close(fd)
+        shape = stack[2].shape
+        valores = np.memmap(name, dtype='<f8', mode='w+', shape=shape)
+        valores[:] = stack[2]
+        valores.flush()
+        self.valores = valores
+        self.handle = {'name': name, 'shape': shape,
+                       'names': list(stack[0]),
+                       'yrs': [float(yr) for yr in stack[1]],
+                       'label': list(stack[3])}
+
+    def collection(self):
+        """ Colección de estaciones sobre la memoria compartida """
+        return attach(self.handle)
+
+    def map(self, func, items, args=(), workers=None):
+        """ Aplica func a estaciones del espacio de trabajo con un
+        grupo de procesos
+        @param func: Función de matrices de datos definida a nivel de
+            módulo, ej. fill_data o lin_reg
+        @param items: Lista de nombres o índices de estación, o de tuplas
+            de ellos, func(station1, station2, ..., *args)
+        @param args: Argumentos adicionales de func
+        @param workers: Número de procesos, si workers=None usa el
+            número de CPU
+        @return: Lista con el resultado de func para cada item
+        @rtype: list
+        """
+        tasks = [(func, self.handle, item, args) for item in items]
+        pool = multiprocessing.Pool(workers)
+        try:
+            return pool.map(_call, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def close(self):
+        """ Libera la memoria compartida """
+        _ATTACHED.pop(self.handle['name'], None)
+        self.valores = None
+        if os.path.exists(self.handle['name']):
+            os.remove(self.handle['name'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Abre la memoria compartida
+def attach(handle):
+    """ Colección de estaciones a partir del identificador de un espacio
+    de trabajo, los valores son de sólo lectura y no se copian
+    @param handle: Identificador, Workspace.handle
+    @return: Colección de estaciones (ver stack_data)
+    @rtype: tuple
+    """
+    name = handle['name']
+    if name not in _ATTACHED:
+        _ATTACHED[name] = np.memmap(name, dtype='<f8', mode='r',
+                                    shape=tuple(handle['shape']))
+    return (handle['names'], np.array(handle['yrs']), _ATTACHED[name],
+            handle['label'])
+
+# Matriz de datos de una estación compartida
+def station(handle,st):
+    """ Matriz de datos de una estación del espacio de trabajo
+    @param handle: Identificador, Workspace.handle
+    @param st: Nombre o índice de la estación
+    @return: Matriz de datos con valores ArrayRows sobre la memoria
+        compartida, sólo incluye los años con datos de la estación
+    @rtype: Matriz de datos
+    """
+    names, yrs_data, valores, label_data = attach(handle)
+    if type(st) != int:
+        if st not in names:
+            raise ValueError, "Estación no encontrada: %s" % st
+        st = names.index(st)
+    valores = valores[st]
+    keep = np.flatnonzero(~np.isnan(valores).all(axis=1))
+    # Años consecutivos con datos quedan como vista sin copia
+    if len(keep) > 0 and keep[-1] - keep[0] + 1 == len(keep):
+        valores = valores[keep[0]:keep[-1] + 1]
+    else:
+        valores = valores[keep]
+    return yrs_data[keep].tolist(), ArrayRows(valores), label_data
+
+def _call(task):
+    func, handle, item, args = task
+    if type(item) != tuple:
+        item = (item,)
+    datas = [station(handle, st) for st in item]
+    return func(*(datas + list(args)))
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
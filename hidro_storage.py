@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_storage.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Análisis almacenamiento - rendimiento de embalses con caudales
+   mensuales.
+
+   Las funciones reciben una matriz de datos o una colección de
+   estaciones (ver stack_data) y una lista de rendimientos (caudal
+   extraído constante, m3/s). Los meses se recorren en orden y cada paso
+   se calcula a la vez para todas las estaciones y rendimientos, los
+   resultados son arreglos de n_rendimientos (n_estaciones x
+   n_rendimientos si data es una colección). Los volúmenes son en MMm3.
+   Los meses sin dato no cambian el almacenamiento.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import numpy as np
+from hidro_data import days_in, is_stack, month_axis, to_array
+
+def _flows(data,yields,relative):
+    """ Retorna (q, vol_mes, demanda, is_multi) con q caudales de
+    n_estaciones x n_meses, vol_mes MMm3 por m3/s de cada mes y demanda
+    de n_estaciones x n_rendimientos """
+    if is_stack(data):
+        yrs_data, valores, label_data = data[1], data[2], data[3]
+        is_multi = True
+    else:
+        yrs_data, valores, label_data = to_array(data)
+        valores = valores[np.newaxis]
+        is_multi = False
+    q = np.asarray(valores, dtype='float64').reshape(valores.shape[0], -1)
+    days = days_in(month_axis(yrs_data, label_data)).ravel()
+    vol_mes = days * (60 * 60 * 24.0) / 1.0e6
+    yields = np.atleast_1d(np.asarray(yields, dtype='float64'))
+    if relative:
+        demand = np.nanmean(q, axis=1)[:, np.newaxis] * yields
+    else:
+        demand = np.repeat(yields[np.newaxis], q.shape[0], axis=0)
+    return q, vol_mes, demand, is_multi
+
+def _out(res,is_multi):
+    if is_multi:
+        return res
+    return res[0]
+
+# Algoritmo sequent peak
+def sequent_peak(data,yields,relative=False,cyclic=True):
+    """ Almacenamiento requerido para entregar cada rendimiento sin
+    fallas, K_t = max(0, K_t-1 + (demanda - Q_t) * segundos del mes)
+    @param data: Matriz de datos mensuales o colección de estaciones
+    @param yields: Lista de rendimientos en m3/s
+    @param relative: Si es True yields es fracción del caudal medio
+    @param cyclic: Si es True recorre la serie 2 veces para considerar
+        déficits al final de la serie que continúan al inicio
+    @return: (storage, crit) almacenamiento requerido en MMm3 y largo
+        en meses del período crítico (desde el último embalse lleno
+        hasta el máximo déficit). Con cyclic=True el almacenamiento es
+        inf si el rendimiento no se puede entregar en forma sostenida
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> label = hidro_data.from_xls('data_test.xls', 0)[2]
+    >>> q = [[4.0, 4.0, 1.0, 1.0, 1.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0]]
+    >>> a = hidro_data.from_array([1951.0], q, label)
+    >>> storage, crit = sequent_peak(a, [1.0, 2.0, 5.0])
+    >>> np.round(storage, 4).tolist(), crit.tolist()
+    ([0.0, 7.9488, inf], [0, 3, 24])
+    """
+    q, vol_mes, demand, is_multi = _flows(data, yields, relative)
+    n = q.shape[1]
+    k = np.zeros(demand.shape)
+    run = np.zeros(demand.shape, dtype=int)
+    storage = np.zeros(demand.shape)
+    crit = np.zeros(demand.shape, dtype=int)
+    passes = 2 if cyclic else 1
+    k_end = None
+    for p in range(passes):
+        if p == 1:
+            k_end = k.copy()
+        for t in xrange(n):
+            qt = q[:, t, np.newaxis]
+            d = np.where(np.isnan(qt), 0.0, (demand - qt) * vol_mes[t])
+            k = np.maximum(k + d, 0.0)
+            run = np.where(k > 0, run + 1, 0)
+            new = k > storage
+            storage = np.where(new, k, storage)
+            crit = np.where(new, run, crit)
+    # El déficit sigue creciendo en la segunda pasada, rendimiento mayor
+    # al que la serie puede entregar
+    if k_end is not None:
+        storage[k > k_end + 1.0e-9] = np.inf
+    return _out(storage, is_multi), _out(crit, is_multi)
+
+# Simulación de operación con capacidad dada
+def behaviour(data,yields,capacity,relative=False):
+    """ Simula el embalse con capacidad dada, partiendo lleno,
+    S_t = min(C, S_t-1 + (Q_t - demanda) * segundos del mes), con falla
+    en los meses en que S_t < 0 (se entrega sólo lo disponible)
+    @param data: Matriz de datos mensuales o colección de estaciones
+    @param yields: Lista de rendimientos en m3/s
+    @param capacity: Capacidad en MMm3, escalar o arreglo de
+        n_estaciones x n_rendimientos
+    @param relative: Si es True yields es fracción del caudal medio
+    @return: (reliability, n_fail, max_run, deficit) confiabilidad
+        temporal (1 - meses con falla / meses con dato), número de meses
+        con falla, máximo de meses consecutivos con falla y volumen no
+        entregado en MMm3
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> label = hidro_data.from_xls('data_test.xls', 0)[2]
+    >>> q = [[4.0, 4.0, 1.0, 1.0, 1.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0]]
+    >>> a = hidro_data.from_array([1951.0], q, label)
+    >>> rel, n_fail, max_run, deficit = behaviour(a, [2.0], 0.0)
+    >>> np.round(rel, 4).tolist(), n_fail.tolist(), max_run.tolist()
+    ([0.75], [3], [3])
+    >>> behaviour(a, [2.0], 7.9488)[1].tolist()
+    [0]
+    """
+    q, vol_mes, demand, is_multi = _flows(data, yields, relative)
+    n = q.shape[1]
+    cap = np.broadcast_to(np.asarray(capacity, dtype='float64'),
+                          demand.shape)
+    s = cap.copy()
+    n_fail = np.zeros(demand.shape, dtype=int)
+    run = np.zeros(demand.shape, dtype=int)
+    max_run = np.zeros(demand.shape, dtype=int)
+    deficit = np.zeros(demand.shape)
+    n_valid = (~np.isnan(q)).sum(axis=1)[:, np.newaxis]
+    for t in xrange(n):
+        qt = q[:, t, np.newaxis]
+        if np.isnan(qt).all():
+            continue
+        valid = ~np.isnan(qt)
+        s_new = np.where(valid, s + (qt - demand) * vol_mes[t], s)
+        # Tolerancia de redondeo
+        fail = s_new < -1.0e-9
+        deficit += np.where(fail, -s_new, 0.0)
+        n_fail += fail
+        run = np.where(fail, run + 1, np.where(valid, 0, run))
+        max_run = np.maximum(max_run, run)
+        s = np.clip(s_new, 0.0, cap)
+    reliability = 1.0 - n_fail / np.maximum(n_valid, 1).astype('float64')
+    return (_out(reliability, is_multi), _out(n_fail, is_multi),
+            _out(max_run, is_multi), _out(deficit, is_multi))
+
+# Almacenamiento para una confiabilidad dada
+def storage_reliability(data,yields,reliability=0.95,relative=False,
+                        n_iter=20):
+    """ Almacenamiento mínimo para alcanzar la confiabilidad temporal
+    dada (ver behaviour), por bisección entre 0 y el almacenamiento
+    de sequent_peak, para todas las estaciones y rendimientos a la vez
+    @param reliability: Confiabilidad requerida (0 ... 1)
+    @param n_iter: Número de iteraciones de bisección
+    @return: Almacenamiento en MMm3
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> label = hidro_data.from_xls('data_test.xls', 0)[2]
+    >>> q = [[4.0, 4.0, 1.0, 1.0, 1.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0, 4.0]]
+    >>> a = hidro_data.from_array([1951.0], q, label)
+    >>> np.round(storage_reliability(a, [2.0], 1.0), 2).tolist()
+    [7.95]
+    >>> storage_reliability(a, [2.0], 0.75).tolist() # Falla 3 meses
+    [0.0]
+    >>> np.round(storage_reliability(a, [3.5], 0.9), 2).tolist()
+    [13.18]
+    """
+    hi, crit = sequent_peak(data, yields, relative)
+    hi = np.asarray(hi, dtype='float64')
+    # Rendimiento no sostenible, cota superior con el déficit total
+    q, vol_mes, demand, is_multi = _flows(data, yields, relative)
+    if not is_multi:
+        demand = demand[0]
+        q = q[0]
+    total = np.nansum(np.maximum(demand[..., np.newaxis] - q[..., np.newaxis, :],
+                                 0.0) * vol_mes, axis=-1)
+    hi = np.where(np.isinf(hi), total, hi)
+    lo = np.zeros(hi.shape)
+    ok = behaviour(data, yields, lo, relative)[0] >= reliability
+    hi = np.where(ok, 0.0, hi)
+    for i in range(n_iter):
+        mid = (lo + hi) / 2
+        ok = behaviour(data, yields, mid, relative)[0] >= reliability
+        hi = np.where(ok, mid, hi)
+        lo = np.where(ok, lo, mid)
+    return hi
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_store.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Almacén en disco de estaciones con np.memmap para archivos más
+   grandes que la memoria.
+
+   Un almacén es un directorio con::
+       values.f8      valores float64 de todas las estaciones, una
+                      estación a continuación de la otra (n_años x
+                      n_columnas, años consecutivos, NaN en datos faltantes)
+       index.json     tipo de los valores, nombre, etiquetas, primer año,
+                      n_años, n_columnas, escala y posición de cada
+                      estación en values.f8
+
+   Un almacén se puede crear con valores en precisión reducida (float32,
+   o int16 e int32 con escala por estación, ver hidro_data.encode), el
+   archivo de valores es values.f4, values.i2 o values.i4. Los valores
+   se entregan en float64.
+
+   Agregar una estación escribe al final de values.f8 y reescribe sólo
+   index.json. Las funciones store_* recorren el almacén por bloques de
+   a lo más max_bytes, la memoria usada no depende del tamaño del archivo.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import json
+import os
+import numpy as np
+from hidro_data import (ArrayRows, decode, encode, to_array, vol_array,
+                        yrs_type)
+
+VERSION = 2
+MAX_BYTES = 64 * 2**20
+
+# Almacén de estaciones
+class Store(object):
+    """ Almacén en disco de matrices de datos de varias estaciones
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil, hidro_data
+    >>> tmp = tempfile.mkdtemp()
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> b = hidro_data.from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> store = Store(tmp)
+    >>> store.append('a', a)
+    >>> store.append('b', b)
+    >>> store.names(), len(store)
+    ([u'a', u'b'], 2)
+    >>> b_s = store.get('b', 1951, 1952)
+    >>> b_s[0], b_s[1][0][:5]
+    ([1951.0, 1952.0], [2.1, 3.1, 4.1, '', 6.1])
+    >>> hidro_data.index_lost(store.get(0)) == hidro_data.index_lost(a)
+    True
+    >>> Store(tmp).names() # Reabre el almacén
+    [u'a', u'b']
+    >>> shutil.rmtree(tmp)
+    >>> store = Store(tmp, dtype='<i2') # Enteros con escala
+    >>> store.append('a', a)
+    >>> np.allclose(store.array('a')[1], to_array(a)[1], 1e-4,
+    ...             equal_nan=True)
+    True
+    >>> os.path.getsize(os.path.join(tmp, 'values.i2'))
+    72
+    >>> shutil.rmtree(tmp)
+    """
+    def __init__(self, path, dtype=None):
+        """
+        @param path: Directorio del almacén, se crea si no existe
+        @param dtype: Tipo de los valores de un almacén nuevo, '<f8',
+            '<f4', '<i2' o '<i4'. Si dtype=None '<f8', o el del almacén
+            existente
+        """
+        self.path = path
+        self._index = os.path.join(path, 'index.json')
+        self._mm = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if os.path.exists(self._index):
+            f = open(self._index)
+            try:
+                index = json.load(f)
+            finally:
+                f.close()
+            if index['version'] > VERSION:
+                raise ValueError, "Versión de almacén no soportada"
+            self.dtype = np.dtype(index.get('dtype', '<f8'))
+            if dtype != None and np.dtype(dtype) != self.dtype:
+                raise ValueError, "Almacén existente con tipo %s" % \
+                    self.dtype.str
+            self.stations = index['stations']
+        else:
+            self.dtype = np.dtype(dtype or '<f8')
+            # Valida el tipo
+            encode(np.zeros(0), self.dtype)
+            self.stations = []
+        self._values = os.path.join(path, 'values.' + self.dtype.str[1:])
+        if not os.path.exists(self._values):
+            open(self._values, 'ab').close()
+            self._write_index()
+
+    def _write_index(self):
+        f = open(self._index + '.tmp', 'w')
+        try:
+            json.dump({'version': VERSION, 'dtype': self.dtype.str,
+                       'stations': self.stations}, f)
+        finally:
+            f.close()
+        os.rename(self._index + '.tmp', self._index)
+
+    def _memmap(self):
+        """ Mapa en memoria del archivo de valores, se rehace si creció """
+        size = os.path.getsize(self._values)
+        if self._mm is None or self._mm.nbytes != size:
+            if size == 0:
+                return np.zeros(0, dtype=self.dtype)
+            self._mm = np.memmap(self._values, dtype=self.dtype, mode='r')
+        return self._mm
+
+    def __len__(self):
+        return len(self.stations)
+
+    def names(self):
+        """ Lista con nombre de las estaciones """
+        return [st['name'] for st in self.stations]
+
+    def _istation(self, station):
+        if type(station) == int:
+            if not 0 <= station < len(self.stations):
+                raise ValueError, "station fuera de rango"
+            return station
+        for i, st in enumerate(self.stations):
+            if st['name'] == station:
+                return i
+        raise ValueError, "Estación no encontrada: %s" % station
+
+    def append(self, name, data):
+        """ Agrega una estación al final del almacén sin reescribir
+        los datos existentes.
+        @param name: Nombre de la estación
+        @param data: Matriz de datos
+        """
+        if type(name) == str:
+            name = name.decode('utf-8')
+        if name in self.names():
+            raise ValueError, "Estación ya existe: %s" % name
+        yrs_data, valores, label_data = to_array(data)
+        # Años consecutivos, años sin datos quedan con NaN
+        yr0 = int(yrs_data.min())
+        n_yrs = int(yrs_data.max()) - yr0 + 1
+        block = np.empty((n_yrs, valores.shape[1]), dtype='<f8')
+        block.fill(np.nan)
+        block[yrs_data.astype(int) - yr0] = valores
+        block, scale, shift = encode(block, self.dtype)
+        f = open(self._values, 'ab')
+        try:
+            f.seek(0, 2)
+            offset = f.tell() // self.dtype.itemsize
+            f.write(block.tobytes())
+        finally:
+            f.close()
+        self.stations.append({'name': name, 'label': list(label_data),
+                              'yr0': yr0, 'n_yrs': n_yrs,
+                              'n_cols': block.shape[1], 'offset': offset,
+                              'scale': scale, 'shift': shift})
+        self._write_index()
+
+    def array(self, station, yr_ini=None, yr_fin=None):
+        """ Valores de una estación entre yr_ini y yr_fin
+        @param station: Nombre o índice de la estación
+        @param yr_ini: Primer año, si yr_ini=None desde el primer año
+        @param yr_fin: Último año, si yr_fin=None hasta el último año
+        @return: (yrs_data, valores) con valores float64 de n_años x
+            n_columnas, vista de np.memmap sin copiar si el almacén es
+            float64
+        @rtype: tuple
+        """
+        yrs_data, raw = self.raw(station, yr_ini, yr_fin)
+        st = self.stations[self._istation(station)]
+        return yrs_data, decode(raw, st.get('scale', 1.0),
+                                st.get('shift', 0.0))
+
+    def raw(self, station, yr_ini=None, yr_fin=None):
+        """ Valores guardados de una estación entre yr_ini y yr_fin
+        (ver hidro_data.encode), vista de np.memmap sin copiar
+        @return: (yrs_data, valores)
+        @rtype: tuple
+        """
+        st = self.stations[self._istation(station)]
+        ini = 0
+        fin = st['n_yrs']
+        if yr_ini != None:
+            ini = min(max(int(yr_ini) - st['yr0'], 0), fin)
+        if yr_fin != None:
+            fin = max(min(int(yr_fin) - st['yr0'] + 1, fin), ini)
+        n_cols = st['n_cols']
+        mm = self._memmap()
+        valores = mm[st['offset'] + ini * n_cols:
+                     st['offset'] + fin * n_cols].reshape(fin - ini, n_cols)
+        yrs_data = [float(st['yr0'] + i) for i in xrange(ini, fin)]
+        return yrs_data, valores
+
+    def get(self, station, yr_ini=None, yr_fin=None):
+        """ Matriz de datos de una estación entre yr_ini y yr_fin
+        @return: Matriz de datos con valores ArrayRows sobre el archivo
+        @rtype: Matriz de datos
+        """
+        yrs_data, raw = self.raw(station, yr_ini, yr_fin)
+        st = self.stations[self._istation(station)]
+        return yrs_data, ArrayRows(raw, None, st.get('scale', 1.0),
+                                   st.get('shift', 0.0)), st['label']
+
+    def blocks(self, max_bytes=MAX_BYTES, yr_ini=None, yr_fin=None):
+        """ Recorre el almacén por bloques de a lo más max_bytes
+        @return: Iterador de (índice estación, yrs_data, valores), una
+            estación grande se entrega en varios bloques de años
+        """
+        for i, st in enumerate(self.stations):
+            yrs_data, raw = self.raw(i, yr_ini, yr_fin)
+            rows = max(1, max_bytes // (8 * st['n_cols']))
+            scale = st.get('scale', 1.0)
+            shift = st.get('shift', 0.0)
+            # Los valores se pasan a float64 por bloque
+            for ini in xrange(0, len(yrs_data), rows):
+                yield (i, yrs_data[ini:ini+rows],
+                       decode(raw[ini:ini+rows], scale, shift))
+
+# Estadísticos por bloques
+def store_stad(store,max_bytes=MAX_BYTES):
+    """ (max, media, min) de cada estación del almacén (ver stad)
+    @param store: Almacén de estaciones
+    @param max_bytes: Tamaño máximo de los bloques leídos
+    @return: Lista de (max, media, min) de cada estación
+    @rtype: list
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil, hidro_data
+    >>> tmp = tempfile.mkdtemp()
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> store = Store(tmp)
+    >>> store.append('a', a)
+    >>> st = store_stad(store, max_bytes=96) # Bloques de 1 año
+    >>> np.allclose(st[0], hidro_data.stad(a))
+    True
+    >>> shutil.rmtree(tmp)
+    """
+    n = len(store)
+    vmax = np.repeat(-np.inf, n)
+    vmin = np.repeat(np.inf, n)
+    total = np.zeros(n)
+    count = np.zeros(n)
+    for i, yrs_data, valores in store.blocks(max_bytes):
+        valid = ~np.isnan(valores)
+        if not valid.any():
+            continue
+        vals = valores[valid]
+        vmax[i] = max(vmax[i], vals.max())
+        vmin[i] = min(vmin[i], vals.min())
+        total[i] += vals.sum()
+        count[i] += len(vals)
+    return [(vmax[i], total[i] / count[i], vmin[i]) if count[i] > 0
+            else (np.nan, np.nan, np.nan) for i in range(n)]
+
+# Volúmenes anuales por bloques
+def store_vol_yr(store,max_bytes=MAX_BYTES):
+    """ Volúmenes anuales de cada estación del almacén (ver vol_yr)
+    @param store: Almacén de estaciones con caudales mensuales
+    @param max_bytes: Tamaño máximo de los bloques leídos
+    @return: Lista de matrices de datos de volúmenes anuales
+    @rtype: list
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil, hidro_data
+    >>> tmp = tempfile.mkdtemp()
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> store = Store(tmp)
+    >>> store.append('a', a)
+    >>> vol = store_vol_yr(store, max_bytes=96)[0]
+    >>> vol[0] == hidro_data.vol_yr(a)[0]
+    True
+    >>> np.allclose(vol[1], hidro_data.vol_yr(a)[1])
+    True
+    >>> yrs_type(vol) == hidro_data.yrs_type(hidro_data.vol_yr(a))
+    True
+    >>> store_yrs_type(store)[0] == yrs_type(vol)
+    True
+    >>> shutil.rmtree(tmp)
+    """
+    result = []
+    for st in store.stations:
+        result.append(([], [], [st['label'][0], u'Vol[MMm3]']))
+    for i, yrs_data, valores in store.blocks(max_bytes):
+        vol = vol_array(yrs_data, valores, store.stations[i]['label'])
+        for yr, v in zip(yrs_data, vol.tolist()):
+            if not np.isnan(v):
+                result[i][0].append(yr)
+                result[i][1].append(v)
+    return result
+
+# Tipo de año por bloques
+def store_yrs_type(store,vol_hi=None,vol_low=None,max_bytes=MAX_BYTES):
+    """ [Años secos, Años normales, Años húmedos] de cada estación del
+    almacén (ver yrs_type)
+    @return: Lista con el resultado de yrs_type de cada estación
+    @rtype: list
+    """
+    return [yrs_type(vol, vol_hi, vol_low)
+            for vol in store_vol_yr(store, max_bytes)]
+
+# Datos faltantes por bloques
+def store_index_lost(store,max_bytes=MAX_BYTES):
+    """ Datos faltantes de cada estación del almacén, [[año, cx], ...]
+    (ver index_lost)
+    @return: Lista con los datos faltantes de cada estación
+    @rtype: list
+
+    @note: Ejemplos
+
+    >>> import tempfile, shutil, hidro_data
+    >>> tmp = tempfile.mkdtemp()
+    >>> a = hidro_data.from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> store = Store(tmp)
+    >>> store.append('a', a)
+    >>> store_index_lost(store, max_bytes=96)[0] == hidro_data.index_lost(a)
+    True
+    >>> shutil.rmtree(tmp)
+    """
+    result = [[] for st in store.stations]
+    for i, yrs_data, valores in store.blocks(max_bytes):
+        rx, cx = np.nonzero(np.isnan(valores))
+        result[i].extend([[yrs_data[r], c] for r, c in zip(rx.tolist(),
+                                                          cx.tolist())])
+    return result
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
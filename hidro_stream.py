@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_stream.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Lectura por flujo de registros (año, código, valor).
+
+   Los registros son tuplas (year, code, value) leídos año por año como
+   en rd_data_rec, code es el índice de la columna (etiqueta
+   label_data[code+1]) y los datos faltantes tienen value NaN.
+   Las fuentes iter_* y las etapas son generadores que se encadenan con
+   pipe, ningún paso guarda la serie completa en memoria.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import collections
+import itertools
+import math
+import numpy as np
+from hidro_data import REC_DTYPE, win_param
+
+NAN = float('nan')
+
+def _value(val):
+    if val == '':
+        return NAN
+    return float(val)
+
+def _rows(yrs_data,valores,cx,lost_OK):
+    """ Registros de filas (año, valores de la fila) """
+    for yr, row in itertools.izip(yrs_data, valores):
+        # Caso datos anuales, filas de un solo dato
+        if type(row) != list:
+            row = [row]
+        if cx == None:
+            cols = xrange(len(row))
+        elif 0 <= cx < len(row):
+            cols = (cx,)
+        else:
+            raise ValueError, "cx fuera de rango"
+        for c in cols:
+            val = _value(row[c])
+            if lost_OK or val == val:
+                yield (yr, c, val)
+
+# Registros de una matriz de datos
+def iter_data(data,cx=None,lost_OK=False):
+    """ Registros (year, code, value) de una matriz de datos
+    @param data: Matriz de datos, los valores pueden ser ArrayRows
+        (ej. from_bin o Store.get) y se leen fila a fila
+    @param cx: Indice de la columna a leer, si cx=None todas las columnas
+    @param lost_OK: Si es True incluye los datos faltantes como NaN
+    @return: Iterador de registros
+    @rtype: generator
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls') # Lee sheet 0 (mensual)
+    >>> list(iter_data(a, 11))
+    [(1950.0, 11, 12.1), (1951.0, 11, 13.1)]
+    >>> rec = hidro_data.rd_data_rec(a)[0]
+    >>> list(iter_data(a)) == rec.tolist()
+    True
+    """
+    if cx != None and type(cx) != int:
+        raise ValueError, "cx no válido"
+    return _rows(data[0], data[1], cx, lost_OK)
+
+# Registros de una hoja excel
+def iter_xls(archivo,nsheet=0,cx=None,lost_OK=False):
+    """ Registros (year, code, value) de una hoja excel (ver from_xls),
+    sin generar la matriz de datos
+    @param archivo: Datos mensuales o anuales
+    @param nsheet: Indice de la hoja del archivo excel
+    @return: Iterador de registros
+    @rtype: generator
+
+    @note: Ejemplos
+
+    >>> list(iter_xls('data_test.xls', 1, lost_OK=True)) # Lee sheet anual
+    [(1950.0, 0, 1.1), (1951.0, 0, 2.1), (1952.0, 0, nan)]
+    """
+    import xlrd
+    if type(nsheet) != int:
+        raise ValueError, "nsheet debe ser un entero"
+    book = xlrd.open_workbook(archivo, on_demand=True)
+    # Libera la planilla aunque no se lean todos los registros
+    try:
+        if not 0 <= nsheet < book.nsheets:
+            raise ValueError, "nsheet fuera de rango"
+        sheet = book.sheet_by_index(nsheet)
+        yrs = (sheet.cell_value(rx, 0) for rx in xrange(1, sheet.nrows))
+        rows = (sheet.row_values(rx, 1, sheet.ncols)
+                for rx in xrange(1, sheet.nrows))
+        for rec in _rows(yrs, rows, cx, lost_OK):
+            yield rec
+    finally:
+        book.release_resources()
+
+# Registros de un archivo binario
+def iter_bin(archivo,station,cx=None,lost_OK=False):
+    """ Registros (year, code, value) de una estación de un archivo
+    binario (ver hidro_bin.to_bin), leídos bajo demanda con np.memmap
+    @param station: Nombre o índice de la estación
+    @return: Iterador de registros
+    @rtype: generator
+    """
+    import hidro_bin
+    return iter_data(hidro_bin.from_bin(archivo, station), cx, lost_OK)
+
+# Encadena etapas
+def pipe(records,*stages):
+    """ Aplica las etapas en orden, cada etapa recibe el iterador de
+    registros de la anterior
+    @param records: Iterador de registros
+    @param stages: Funciones etapa, las etapas con parámetros se pasan
+        con functools.partial
+    @return: Iterador de registros
+    @rtype: generator
+
+    @note: Ejemplos
+
+    >>> import functools
+    >>> recs = pipe(iter_xls('data_test.xls', 2, lost_OK=True), # sheet lost
+    ...             functools.partial(select, codes=[0, 1]), fill_prev)
+    >>> list(recs)[:5]
+    [(1950.0, 0, nan), (1950.0, 1, 2.1), (1951.0, 0, 2.1), (1951.0, 1, 3.1), (1952.0, 0, 3.1)]
+    """
+    for stage in stages:
+        records = stage(records)
+    return records
+
+# Etapa filtro
+def select(records,yr_ini=None,yr_fin=None,codes=None,lost_OK=True):
+    """ Filtra registros por rango de años y columnas
+    @param yr_ini: Primer año, si yr_ini=None desde el primer año
+    @param yr_fin: Último año, si yr_fin=None hasta el último año
+    @param codes: Lista de códigos de columna, si codes=None todas
+    @param lost_OK: Si es False elimina los datos faltantes
+    @return: Iterador de registros
+    @rtype: generator
+    """
+    if codes != None:
+        codes = set(codes)
+    for rec in records:
+        yr, code, val = rec
+        if yr_ini != None and yr < yr_ini:
+            continue
+        if yr_fin != None and yr > yr_fin:
+            continue
+        if codes != None and code not in codes:
+            continue
+        if not lost_OK and val != val:
+            continue
+        yield rec
+
+# Etapa relleno con valor constante
+def fill_value(records,value):
+    """ Reemplaza los datos faltantes por value
+    @return: Iterador de registros
+    @rtype: generator
+    """
+    for yr, code, val in records:
+        if val != val:
+            val = value
+        yield (yr, code, val)
+
+# Etapa relleno con el dato anterior
+def fill_prev(records):
+    """ Reemplaza los datos faltantes por el último dato válido
+    anterior, los faltantes al comienzo quedan NaN
+    @return: Iterador de registros
+    @rtype: generator
+    """
+    prev = NAN
+    for yr, code, val in records:
+        if val != val:
+            val = prev
+        else:
+            prev = val
+        yield (yr, code, val)
+
+# Etapa media móvil
+def moving_mean(records,n=6,min_data=None):
+    """ Media móvil de largo n, igual a hidro_data.mov_mean para
+    registros leídos con lost_OK=True. Guarda sólo los últimos n datos y
+    suma la ventana en cada registro (sin acumular error de redondeo en
+    series largas).
+    @param n: Largo de la ventana
+    @param min_data: Mínimo de datos válidos en la ventana (ver mov_sum)
+    @return: Iterador de registros con la media de la ventana que
+        termina en cada registro
+    @rtype: generator
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> m = [r[2] for r in moving_mean(iter_data(a, lost_OK=True), 3, 2)]
+    >>> np.allclose(m, hidro_data.mov_mean(a, 3, 2), equal_nan=True)
+    True
+    >>> recs = [(1950.0, cx, val) for cx, val in enumerate([1.0e16, 1.0, 1.0])]
+    >>> [r[2] for r in moving_mean(recs, 1)]
+    [1e+16, 1.0, 1.0]
+    """
+    min_data = win_param(n, min_data)
+    win = collections.deque()
+    count = 0
+    for yr, code, val in records:
+        win.append(val)
+        if val == val:
+            count += 1
+        if len(win) > n:
+            old = win.popleft()
+            if old == old:
+                count -= 1
+        if len(win) < n or count < min_data:
+            yield (yr, code, NAN)
+        else:
+            yield (yr, code, math.fsum(v for v in win if v == v) / count)
+
+# Etapa agregación anual
+def agg_yr(records,how='sum',min_data=1):
+    """ Agrega los registros de cada año en un registro (year, 0, value)
+    @param how: 'sum', 'mean', 'max' o 'min'
+    @param min_data: Mínimo de datos válidos del año, con menos datos
+        el valor es NaN
+    @return: Iterador de registros anuales
+    @rtype: generator
+
+    @note: Ejemplos
+
+    >>> list(agg_yr(iter_xls('data_test.xls', 2), 'max')) # sheet lost
+    [(1950.0, 0, 12.1), (1951.0, 0, 13.1), (1952.0, 0, 13.1)]
+    """
+    if how not in ('sum', 'mean', 'max', 'min'):
+        raise ValueError, "how no válido"
+    for yr, recs in itertools.groupby(records, lambda rec: rec[0]):
+        vals = [val for y, code, val in recs if val == val]
+        if len(vals) < max(min_data, 1):
+            yield (yr, 0, NAN)
+        elif how == 'sum':
+            yield (yr, 0, sum(vals))
+        elif how == 'mean':
+            yield (yr, 0, sum(vals) / len(vals))
+        elif how == 'max':
+            yield (yr, 0, max(vals))
+        else:
+            yield (yr, 0, min(vals))
+
+# Índice de datos faltantes
+def iter_lost(records):
+    """ Datos faltantes [año, code] como index_lost, requiere registros
+    leídos con lost_OK=True
+    @return: Iterador de [año, code]
+    @rtype: generator
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 2) # Lee sheet lost
+    >>> list(iter_lost(iter_data(a, lost_OK=True))) == hidro_data.index_lost(a)
+    True
+    """
+    for yr, code, val in records:
+        if val != val:
+            yield [yr, code]
+
+# Bloques de registros
+def chunks(records,size=4096):
+    """ Agrupa los registros en arreglos con dtype REC_DTYPE
+    (ver rd_data_rec) de largo size, el último puede ser menor
+    @return: Iterador de arreglos de registros
+    @rtype: generator
+
+    @note: Ejemplos
+
+    >>> [len(c) for c in chunks(iter_xls('data_test.xls'), 10)]
+    [10, 10, 7]
+    """
+    if size < 1:
+        raise ValueError, "size no válido"
+    records = iter(records)
+    while True:
+        block = list(itertools.islice(records, size))
+        if block == []:
+            return
+        yield np.array(block, dtype=REC_DTYPE)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
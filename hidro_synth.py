@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_synth.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Generación de caudales mensuales sintéticos.
+
+   Modelos de Thomas-Fiering (correlación de cada mes con el mes
+   anterior) y AR(1) estacionario sobre caudales estandarizados por
+   mes. Los parámetros se ajustan a cada estación de una matriz de
+   datos o colección (ver stack_data) y las series se generan a la vez
+   para todas las estaciones y series. Cada estación resulta en una
+   colección de n_series x n_años x 12, que se puede usar directamente
+   con vol_array y status_type.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import multiprocessing
+import numpy as np
+from hidro_data import is_stack, to_array
+
+CHUNK = 256     # Series por bloque, cada bloque con su propia semilla
+N_WARM = 12     # Meses iniciales que se descartan
+
+# Parámetros de los modelos
+def fit_params(data,model='tf',log=False):
+    """ Ajusta los parámetros del modelo a cada estación
+    @param data: Matriz de datos mensuales o colección de estaciones
+    @param model: 'tf' Thomas-Fiering o 'ar1' AR(1) estacionario
+    @param log: Si es True ajusta el logaritmo de los caudales
+        (los caudales menores o iguales a 0 se ignoran)
+    @return: (mean, std, r) arreglos de n_estaciones x n_meses con
+        media, desviación estándar y correlación con el mes anterior
+        de cada mes (con 'ar1' la misma correlación para todos los meses)
+    @rtype: tuple
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> mean, std, r = fit_params(a)
+    >>> mean.shape, round(mean[0, 0], 4)
+    ((1, 12), 2.6)
+    >>> np.round(fit_params(a, 'ar1')[2][0, :3], 4).tolist()
+    [0.6683, 0.6683, 0.6683]
+    """
+    if model not in ['tf', 'ar1']:
+        raise ValueError, "model no válido"
+    if is_stack(data):
+        valores = data[2]
+    else:
+        valores = to_array(data)[1][np.newaxis]
+    if valores.shape[2] != 12:
+        raise ValueError, "Se requieren 12 meses por año"
+    x = np.array(valores, dtype='float64')
+    if log:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = np.where(x > 0, np.log(x), np.nan)
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(x, axis=1)
+        std = np.nanstd(x, axis=1, ddof=1)
+    z = ((x - mean[:, np.newaxis]) / std[:, np.newaxis]).reshape(len(x), -1)
+    # Pares (mes anterior, mes), el 1er mes con el último del año anterior
+    prod = z[:, :-1] * z[:, 1:]
+    valid = ~np.isnan(prod)
+    prod = np.where(valid, prod, 0.0)
+    col = np.arange(1, z.shape[1]) % 12
+    if model == 'tf':
+        s_prod = np.zeros((len(x), 12))
+        n = np.zeros((len(x), 12))
+        for j in range(12):
+            s_prod[:, j] = prod[:, col == j].sum(axis=1)
+            n[:, j] = valid[:, col == j].sum(axis=1)
+    else:
+        s_prod = prod.sum(axis=1)[:, np.newaxis].repeat(12, axis=1)
+        n = valid.sum(axis=1)[:, np.newaxis].repeat(12, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.clip(s_prod / n, -0.99, 0.99)
+    r[n == 0] = 0.0
+    std = np.where(np.isnan(std), 0.0, std)
+    return mean, std, r
+
+def _generate(task):
+    """ Genera un bloque de series, retorna arreglo de
+    n_estaciones x n_series x n_meses """
+    mean, std, r, n_traces, n_months, log, seed = task
+    rnd = np.random.RandomState(seed)
+    n_st = mean.shape[0]
+    e = rnd.standard_normal((N_WARM + n_months, n_st, n_traces))
+    out = np.empty((n_st, n_traces, n_months))
+    # Desde el último mes del año para que el primer mes generado sea
+    # el 1er mes del año
+    z = e[0]
+    for t in xrange(1, N_WARM + n_months):
+        j = t % 12
+        rj = r[:, j, np.newaxis]
+        z = rj * z + np.sqrt(1.0 - rj ** 2) * e[t]
+        if t >= N_WARM:
+            out[:, :, t - N_WARM] = z
+    mes = np.arange(n_months) % 12
+    q = mean[:, np.newaxis, mes] + std[:, np.newaxis, mes] * out
+    if log:
+        return np.exp(q)
+    return np.maximum(q, 0.0)
+
+# Caudales sintéticos
+def synth_flows(data,n_traces,n_yrs=None,model='tf',log=False,seed=None,
+                yr_ini=None,workers=1):
+    """ Genera series sintéticas de caudales mensuales,
+    z_j = r_j z_j-1 + sqrt(1 - r_j**2) e, q_j = mean_j + std_j z_j
+    (Thomas-Fiering con z estandarizado)
+    @param data: Matriz de datos mensuales o colección de estaciones
+    @param n_traces: Número de series
+    @param n_yrs: Años de cada serie, si n_yrs=None los mismos de data
+    @param model: 'tf' o 'ar1' (ver fit_params)
+    @param log: Si es True genera el logaritmo de los caudales, si no
+        los caudales negativos se reemplazan por 0
+    @param seed: Semilla de números aleatorios, el resultado sólo
+        depende de seed (no del número de procesos)
+    @param yr_ini: Primer año de las series, si yr_ini=None el de data
+    @param workers: Número de procesos, si workers=1 no usa procesos
+    @return: Colección (nombres de series, años, arreglo de n_series x
+        n_años x 12, etiquetas) si data es una matriz de datos, lista
+        con una colección por estación si data es una colección
+    @rtype: tuple o list
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 3) # Lee sheet mensual1
+    >>> s = synth_flows(a, 500, 30, seed=1)
+    >>> s[2].shape, s[1][:2].tolist(), s[0][:2]
+    ((500, 30, 12), [1950.0, 1951.0], [u'0000', u'0001'])
+    >>> bool((s[2] >= 0).all())
+    True
+    >>> hidro_data.vol_array(*s[1:]).shape # Volumen anual de cada serie
+    (500, 30)
+    >>> hidro_data.status_type(s).shape # Tipo de año de cada serie
+    (500, 30)
+    >>> np.array_equal(synth_flows(a, 300, 5, seed=2, workers=2)[2],
+    ...                synth_flows(a, 300, 5, seed=2)[2])
+    True
+    >>> c = hidro_data.stack_data(['a', 'b'], a, a)
+    >>> [s_i[2].shape for s_i in synth_flows(c, 10, 3, log=True, seed=0)]
+    [(10, 3, 12), (10, 3, 12)]
+    """
+    mean, std, r = fit_params(data, model, log)
+    if is_stack(data):
+        names, yrs_data, valores, label_data = data
+    else:
+        yrs_data, valores, label_data = to_array(data)
+        names = None
+    if n_yrs == None:
+        n_yrs = len(yrs_data)
+    if yr_ini == None:
+        yr_ini = yrs_data[0]
+    n_months = n_yrs * 12
+    rnd = np.random.RandomState(seed)
+    sizes = [min(CHUNK, n_traces - i) for i in range(0, n_traces, CHUNK)]
+    seeds = rnd.randint(0, 2 ** 31 - 1, size=len(sizes)).tolist()
+    tasks = [(mean, std, r, size, n_months, log, s)
+             for size, s in zip(sizes, seeds)]
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            res = pool.map(_generate, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        res = [_generate(task) for task in tasks]
+    q = np.concatenate(res, axis=1).reshape(len(mean), n_traces, n_yrs, 12)
+    yrs = np.arange(n_yrs, dtype='float64') + yr_ini
+    traces = [u'%04d' % i for i in xrange(n_traces)]
+    if names == None:
+        return traces, yrs, q[0], list(label_data)
+    return [(traces, yrs, q[i], list(label_data)) for i in range(len(names))]
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       hidro_valid.py
+#
+#       Copyright 2010 Javier Rovegno Campos <javier.rovegno@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""Validación de métodos de relleno ocultando datos conocidos.
+
+   Se ocultan tramos de datos de años completos (con dato anterior y
+   posterior conocido) y se comparan los datos rellenados con los datos
+   originales. Los tramos que no se tocan (separados por al menos un dato
+   conocido) se ocultan en la misma matriz, así cada llamada al método
+   de relleno valida muchas réplicas a la vez. Con estación donante la
+   regresión de cada tramo se calcula sin los años del tramo, igual que
+   al rellenar cada tramo por separado.
+   @author: Javier Rovegno
+   @contact: javier.rovegno@gmail.com
+   @version: 0.1
+   @license: GNU General Public License
+
+   Website: U{http://code.google.com/p/hydropy/}
+"""
+
+import heapq
+import multiprocessing
+import time
+import numpy as np
+from hidro_data import fill_data, fill_data_s, from_array, to_array
+from hidro_reg import reg_params, yr_sums
+
+# Métodos de relleno, {nombre: (función, usa estación donante)}
+METHODS = {'fill_data_s': (fill_data_s, False),
+           'fill_data': (fill_data, False),
+           'fill_data_lr': (fill_data, True)}
+
+# Posibles tramos ocultos
+def gap_starts(data,length):
+    """ Posiciones de inicio de tramos de largo length que se pueden
+    ocultar, la posición es rx * n_columnas + cx (datos leídos año por año)
+    @param data: Matriz de datos mensuales
+    @param length: Largo del tramo
+    @return: Arreglo de posiciones, el tramo está en años completos y
+        tiene dato anterior y posterior conocido
+    @rtype: numpy.ndarray
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> gap_starts(a, 1).tolist() == range(1, 24)
+    True
+    >>> len(gap_starts(a, 6))
+    18
+    """
+    yrs_data, valores, label_data = to_array(data)
+    valid = ~np.isnan(valores)
+    ok = (valid & valid.all(axis=1)[:, np.newaxis]).ravel()
+    valid = valid.ravel()
+    n = len(ok)
+    if length < 1 or n < length + 2:
+        return np.zeros(0, dtype=int)
+    cum = np.concatenate(([0], np.cumsum(ok)))
+    start = np.arange(1, n - length)
+    full = cum[start + length] - cum[start] == length
+    return start[full & valid[start - 1] & valid[start + length]]
+
+# Réplicas de tramos ocultos
+def mask_gaps(data,n_rep,lengths=(1, 2, 3, 6),probs=None,seed=None):
+    """ Elige al azar n_rep tramos a ocultar
+    @param data: Matriz de datos mensuales
+    @param n_rep: Número de réplicas
+    @param lengths: Largos de tramo posibles
+    @param probs: Probabilidad de cada largo, si probs=None todos los
+        largos tienen la misma probabilidad
+    @param seed: Semilla de números aleatorios o np.random.RandomState
+    @return: (starts, lens) arreglos de posición de inicio y largo
+    @rtype: tuple
+    """
+    rnd = seed
+    if not isinstance(rnd, np.random.RandomState):
+        rnd = np.random.RandomState(seed)
+    lens = rnd.choice(np.asarray(lengths), size=n_rep, p=probs)
+    starts = np.zeros(n_rep, dtype=int)
+    keep = np.ones(n_rep, dtype=bool)
+    for length in np.unique(lens):
+        cand = gap_starts(data, length)
+        sel = lens == length
+        if len(cand) == 0:
+            keep[sel] = False
+        else:
+            starts[sel] = rnd.choice(cand, size=sel.sum())
+    return starts[keep], lens[keep]
+
+def _batches(starts,lens):
+    """ Agrupa tramos que no se tocan, retorna lista de índices por grupo """
+    order = np.argsort(starts, kind='mergesort')
+    ends = []
+    batches = []
+    for i in order.tolist():
+        # Reutiliza el grupo cuyo último tramo termina antes del dato
+        # anterior de este tramo
+        if ends != [] and ends[0][0] <= starts[i] - 1:
+            end, ib = heapq.heappop(ends)
+        else:
+            ib = len(batches)
+            batches.append([])
+        batches[ib].append(i)
+        heapq.heappush(ends, (starts[i] + lens[i], ib))
+    return batches
+
+def _groups(s,length,yrs_data,n_cols,donor,data):
+    """ Grupos de tramos con la misma regresión, retorna lista de
+    (lin_reg_param, índices de s). Con donante los tramos se agrupan por
+    años que ocupan y la regresión se calcula sin esos años, como al
+    rellenar cada tramo por separado """
+    if donor == None:
+        return [(None, np.arange(len(s)))]
+    yrs_conc, sums = yr_sums(data, donor)
+    total = sums.sum(axis=0)
+    conc = dict((yr, i) for i, yr in enumerate(yrs_conc))
+    first = s // n_cols
+    last = (s + length - 1) // n_cols
+    groups = []
+    for f, l in sorted(set(zip(first.tolist(), last.tolist()))):
+        members = np.flatnonzero((first == f) & (last == l))
+        out = [conc[yr] for yr in yrs_data[f:l+1].tolist() if yr in conc]
+        if len(out) == len(yrs_conc):
+            # Sin años para la regresión, los datos quedan sin rellenar
+            continue
+        params = reg_params(total - sums[out].sum(axis=0)).tolist()
+        groups.append((params, members))
+    return groups
+
+def _run(task):
+    """ Valida un método en una estación, retorna filas del reporte """
+    method, func, donor, name, data, starts, lens = task
+    yrs_data, valores, label_data = to_array(data)
+    n_cols = valores.shape[1]
+    rows = []
+    for length in np.unique(lens).tolist():
+        sel = lens == length
+        s = starts[sel]
+        err = []
+        seconds = 0.0
+        for params, members in _groups(s, length, yrs_data, n_cols, donor,
+                                       data):
+            for batch in _batches(s[members], lens[sel][members]):
+                start = s[members[batch]]
+                pos = (start[:, np.newaxis] + np.arange(length)).ravel()
+                masked = valores.copy()
+                masked.ravel()[pos] = np.nan
+                lind_lost = [[p // n_cols, p % n_cols] for p in pos.tolist()]
+                args = [from_array(yrs_data, masked, label_data)]
+                kwargs = {'lind_lost': lind_lost}
+                if donor != None:
+                    args.append(donor)
+                    kwargs['lin_reg_param'] = params
+                t0 = time.time()
+                try:
+                    filled = func(*args, **kwargs)
+                # Método no aplicable, los datos quedan sin rellenar
+                except ValueError:
+                    continue
+                finally:
+                    seconds += time.time() - t0
+                for p, (rx, cx) in zip(pos.tolist(), lind_lost):
+                    val = filled[1][rx][cx]
+                    if val != '':
+                        err.append(val - valores.flat[p])
+        err = np.array(err)
+        n = int(sel.sum()) * length
+        if len(err) > 0:
+            rmse = float(np.sqrt((err ** 2).mean()))
+            bias = float(err.mean())
+        else:
+            rmse = bias = np.nan
+        rows.append((method, name, length, n, len(err), rmse, bias, seconds))
+    return rows
+
+# Validación de métodos de relleno
+def validate(names_data,*args,**kwargs):
+    """ Oculta tramos de datos conocidos y evalúa los métodos de relleno
+    @param names_data: Lista con nombre de las estaciones
+        correspondientes a las matrices de datos, [name1, ... ,nameN]
+    @param args: Matrices de datos mensuales, matriz_datos1, ...
+    @keyword methods: Lista de nombres de métodos de METHODS,
+        por defecto todos
+    @keyword donors: Lista de matrices de datos de estación donante de
+        cada estación (None sin donante), usada por los métodos con donante
+    @keyword n_rep: Número de tramos ocultos por estación (1000)
+    @keyword lengths: Largos de tramo posibles ((1, 2, 3, 6))
+    @keyword probs: Probabilidad de cada largo (iguales)
+    @keyword seed: Semilla de números aleatorios
+    @keyword workers: Número de procesos, si workers=1 no usa procesos
+    @return: Lista de filas (método, estación, largo, n_datos, n_rellenos,
+        rmse, sesgo, segundos), n_rellenos son los datos ocultos que el
+        método rellenó y sobre los que se calcula rmse y sesgo
+    @rtype: list
+
+    @note: Ejemplos
+
+    >>> import hidro_data
+    >>> a = hidro_data.from_xls('data_test.xls', 0) # Lee sheet mensual
+    >>> res = validate(['a'], a, methods=['fill_data_s', 'fill_data'],
+    ...                n_rep=200, lengths=(1, 3), seed=0)
+    >>> [row[:5] for row in res]
+    [('fill_data', 'a', 1, 99, 99), ('fill_data', 'a', 3, 303, 303), ('fill_data_s', 'a', 1, 99, 99), ('fill_data_s', 'a', 3, 303, 0)]
+    >>> [round(row[5], 4) for row in res] # rmse
+    [2.2111, 2.7995, 2.2111, nan]
+    >>> rnd = np.random.RandomState(0)
+    >>> yrs = [1950.0 + i for i in range(10)]
+    >>> x = rnd.gamma(4.0, 5.0, (10, 12))
+    >>> y = 0.8 * x + 1.0 + rnd.normal(0.0, 2.0, (10, 12))
+    >>> a = hidro_data.from_array(yrs, x, a[2])
+    >>> b = hidro_data.from_array(yrs, y, a[2])
+    >>> res = validate(['a'], a, methods=['fill_data_lr'], donors=[b],
+    ...                n_rep=60, lengths=(3,), seed=0)
+    >>> starts, lens = mask_gaps(a, 60, (3,), None, np.random.RandomState(0))
+    >>> err = []
+    >>> for start in starts.tolist(): # Cada tramo por separado
+    ...     pos = range(start, start + 3)
+    ...     masked = x.copy()
+    ...     masked.ravel()[pos] = np.nan
+    ...     lind_lost = [[p // 12, p % 12] for p in pos]
+    ...     filled = hidro_data.fill_data(hidro_data.from_array(yrs, masked,
+    ...                                   a[2]), b, lind_lost=lind_lost)
+    ...     err.extend([filled[1][rx][cx] - x[rx, cx] for rx, cx in lind_lost])
+    >>> np.allclose(res[0][5], np.sqrt((np.array(err) ** 2).mean()))
+    True
+    """
+    if len(args) != len(names_data):
+        raise IndexError, "largo names_data no coincide con args"
+    methods = kwargs.get('methods', sorted(METHODS))
+    donors = kwargs.get('donors', [None] * len(args))
+    n_rep = kwargs.get('n_rep', 1000)
+    lengths = kwargs.get('lengths', (1, 2, 3, 6))
+    probs = kwargs.get('probs', None)
+    workers = kwargs.get('workers', 1)
+    rnd = np.random.RandomState(kwargs.get('seed', None))
+    tasks = []
+    for name, data, donor in zip(names_data, args, donors):
+        # Los mismos tramos para todos los métodos
+        starts, lens = mask_gaps(data, n_rep, lengths, probs, rnd)
+        for method in methods:
+            func, use_donor = METHODS[method]
+            if use_donor and donor == None:
+                continue
+            if not use_donor:
+                donor_m = None
+            else:
+                donor_m = donor
+            tasks.append((method, func, donor_m, name, data, starts, lens))
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            res = pool.map(_run, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        res = [_run(task) for task in tasks]
+    rows = []
+    for task_rows in res:
+        rows.extend(task_rows)
+    rows.sort()
+    return rows
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()